@@ -4,14 +4,29 @@
 #author: Aaron Paul
 ######################################
 
-from dash import Dash, dash_table, html, dcc, Input, Output, State
+import gzip
+import json
+import os
+
+import brotli
+from dash import Dash, html, dcc, Input, Output, State, ClientsideFunction, callback_context, no_update
+from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
+import flask
+from flask_compress import Compress
 
 import pandas as pd
 import numpy as np
 
 import plotly.graph_objects as go
-import plotly.express as px
+import plotly.io as pio
+from plotly.io.json import to_json_plotly
+
+import cache
+import data
+import downsample
+import engine
+import metrics
 
 # Meta_tags
 meta_tags = [
@@ -26,123 +41,35 @@ app = Dash(__name__, external_stylesheets = [dbc.themes.BOOTSTRAP, dbc.icons.BOO
 app.title = "COVID-19 Live Tracker"
 server = app.server
 
-# Read the data
-url_confirmed_global = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_global.csv"
-url_deaths_global = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_global.csv"
-url_recovered_global = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_recovered_global.csv"
-confirmed_df = pd.read_csv(url_confirmed_global)
-deaths_df = pd.read_csv(url_deaths_global)
-recovered_df = pd.read_csv(url_recovered_global)
-# This is used to control the map zoom level late
-area_df = pd.read_csv("area.csv")
-area_list = area_df.country.to_list()
-
-# Unpivot (reshape) the data using the melt() function
-confirmed_global = confirmed_df.melt(
-    id_vars = ["Province/State", "Country/Region", "Lat", "Long"],
-    value_vars = confirmed_df.columns[4:],
-    var_name = "date",
-    value_name = 'confirmed'
-)
-deaths_global = deaths_df.melt(
-    id_vars = ["Province/State", "Country/Region", "Lat", "Long"],
-    value_vars = deaths_df.columns[4:],
-    var_name = "date",
-    value_name = 'deaths'
-)
-recovered_global = recovered_df.melt(
-    id_vars = ["Province/State", "Country/Region", "Lat", "Long"],
-    value_vars = recovered_df.columns[4:],
-    var_name = "date",
-    value_name = 'recovered'
-)
-#################### Merge Datasets ####################
-covid_merge = pd.merge(confirmed_global, deaths_global, on = ['Province/State', 'Country/Region', 'Lat', 'Long', 'date'], how = "left")
-covid_merge = pd.merge(covid_merge, recovered_global, on = ['Province/State', 'Country/Region', 'Lat', 'Long', 'date'], how = "left")
-covid_merge["date"] = pd.to_datetime(covid_merge["date"]) # Convert "Date to datetime type"
-covid_merge["recovered"] = covid_merge["recovered"].fillna(0)
-covid_merge["recovered"] = covid_merge["recovered"].astype(int)
-# Active cases
-covid_merge["active"] = covid_merge["confirmed"] - covid_merge["deaths"]- covid_merge["recovered"]
-
-################################ Data Cleaning ######################
-change_country_region = covid_merge[covid_merge["Province/State"].notnull()]
-for index, row in change_country_region.iterrows():
-  if row["Province/State"] in ["Diamond Princess", "Grand Princess", "Tibet"]:
-    covid_merge['Country/Region'].at[index] = row["Province/State"] # update the row in the dataframe
-  elif row["Country/Region"] in ["Denmark", "France", "Netherlands", "New Zealand", "United Kingdom"]:
-    covid_merge['Country/Region'].at[index] = row["Province/State"] # update the row in the dataframe
-replace_names = {
-    "US": "USA",
-    "Korea, South": "South Korea",
-    "Korea, North": "North Korea",
-    "Taiwan*": "Taiwan",
-    "Burma": "Myanmar",
-    "Holy See": "Vatican City",
-    "Diamond Princess": "Cruise Ship",
-    "MS Zaandam": "Cruise Ship",
-    "Grand Princess": "Cruise Ship",
-}
-covid_merge["Country/Region"] = covid_merge["Country/Region"].replace(replace_names)
-################################ Canada: Impute the values in "Lat" and "Long" ######################
-condition1 = covid_merge["Country/Region"] == "Canada" 
-canada_df = covid_merge.loc[condition1]
-# We can use the mean function to impute the values in Lattitude and Longtitude.
-canada_lat_mean = canada_df['Lat'].mean()
-canada_long_mean = canada_df['Long'].mean()
-# position of NaN values in terms of index
-canada_nan = canada_df.loc[pd.isna(canada_df["Lat"]), :].index
-# Update covid_merge DataFrame for missing "Lat" and "Long"
-for index in canada_nan:
-  covid_merge.loc[index, "Lat"] = canada_lat_mean
-  covid_merge.loc[index, "Long"] = canada_long_mean
-################################ China: Impute the values in "Lat" and "Long" ######################
-condition2 = covid_merge["Country/Region"] == "China"
-china_df = covid_merge.loc[condition2]
-# We can use the mean function to impute the values in Lattitude and Longtitude.
-china_lat_mean = china_df['Lat'].mean()
-china_long_mean = china_df['Long'].mean()
-# position of NaN values in terms of index
-china_nan = china_df.loc[pd.isna(china_df["Lat"]), :].index
-for index in china_nan:
-  covid_merge.loc[index, "Lat"] = china_lat_mean
-  covid_merge.loc[index, "Long"] = china_long_mean
-# Final Dataset
-covid_global = covid_merge.groupby(["date", "Country/Region"], as_index = False).agg(
-    {
-        "Lat": "mean",
-        "Long": "mean",
-        "confirmed": "sum",
-        "deaths": "sum",
-        "recovered": "sum",
-        "active": "sum",
-    }
-)
-# List of all countries (sorted)
-country_list = covid_global["Country/Region"].sort_values(ascending=True).unique()
-# Last Update
-last_update = covid_global["date"].iloc[-1].strftime("%B %d, %Y")
-# Global Cumulative for each day
-daily_cum_global = covid_global.groupby(["date"])[['confirmed', 'deaths', 'recovered', 'active']].sum().reset_index()
-# Global Totals
-tot_confirmed_global = daily_cum_global["confirmed"].iloc[-1]
-tot_deaths_global = daily_cum_global["deaths"].iloc[-1]
-tot_recovered_global = daily_cum_global["recovered"].iloc[-1]
-tot_active_global = daily_cum_global["active"].iloc[-1]
-# New Global Cases, Deaths, Recovery, Active
-new_confirmed_global = tot_confirmed_global - daily_cum_global["confirmed"].iloc[-2]
-new_deaths_global = tot_deaths_global - daily_cum_global["deaths"].iloc[-2]
-new_recovered_global = tot_recovered_global - daily_cum_global["recovered"].iloc[-2]
-new_active_global = tot_active_global - daily_cum_global["active"].iloc[-2]
-# Percentage of Previous Day
-pct_change_confirmed = round((new_confirmed_global / daily_cum_global["confirmed"].iloc[-2]) * 100, 2)
-pct_change_deaths = round((new_deaths_global / daily_cum_global["deaths"].iloc[-2]) * 100, 2)
-pct_change_recovered = 0 if daily_cum_global["recovered"].iloc[-2] == 0 else round((new_recovered_global / daily_cum_global["recovered"].iloc[-2]) * 100, 2)
-pct_change_active = round((new_active_global / daily_cum_global["active"].iloc[-2]) * 100, 2)
-
-# Countries Lattest Totals
-country_totals_df = covid_global.loc[covid_global["date"] == last_update].reset_index(drop = True)
-dict_country_locations = country_totals_df.set_index("Country/Region")[["Lat", "Long"]].T.to_dict("dict")
+# Compute the country figures in the browser from a per-country bundle loaded once
+# per data version, instead of a server round trip for every dropdown change
+CLIENTSIDE_FIGURES = os.environ.get("COVID_CLIENTSIDE_FIGURES", "0") == "1"
+
+# JSON engine for the figures and the callback responses, which Dash serializes through the
+# same Plotly setting: "json" (Plotly's encoder), "orjson" (needs the orjson package, fails at
+# startup without it) or "auto" (orjson when installed). Both give the same bytes.
+JSON_ENGINE = os.environ.get("COVID_JSON_ENGINE", "json")
+pio.json.config.default_engine = JSON_ENGINE
+
+# Country callback responses, keyed by (country, line series, date range, data version)
+figure_cache = cache.FigureCache(dumps = to_json_plotly)
+data.on_swap(lambda dataset: figure_cache.set_version(dataset.version))
+
+# Request and stage timings on /metrics and in Server-Timing headers (COVID_METRICS=1)
+metrics.init_app(server)
+
+# Compress responses (callbacks, layout, assets) with Brotli, or gzip for clients without it.
+# Dash's own compress option is gzip only. Turn it off when a proxy in front already compresses.
+COMPRESS = os.environ.get("COVID_COMPRESS", "1") == "1"
+if COMPRESS:
+    server.config.update(COMPRESS_ALGORITHM = ["br", "gzip"], COMPRESS_BR_LEVEL = 4)
+    Compress(server)
+
+# With COVID_ASYNC_LOAD=1 pages show a placeholder until the data is loaded (see the end
+# of this module). Their components are not in that placeholder, so Dash cannot check
+# the callbacks against the first layout it sees.
+if data.ASYNC_LOAD:
+    app.config.suppress_callback_exceptions = True
 
 # # default CSV
 # csv_data = country_totals_df.to_csv()
@@ -259,172 +186,197 @@ navbar = dbc.Navbar(
     dark = True
 ) # End navbar
 
+# Latest global analytics (precomputed with the dataset) for the marquee, without the undefined ones
+def global_analytics(dataset):
+    latest = {name: values[0, -1] for name, values in dataset.global_derived.items()}
+    texts = [
+        (latest["rolling7_confirmed"], "Global 7 Day Average: {:,.0f} new cases a day"),
+        (latest["growth_confirmed"], "{:+.1f}% week over week"),
+        (latest["rolling7_deaths"], "{:,.0f} deaths a day"),
+        (latest["doubling_time"], "Doubling Time: {:,.0f} days"),
+        (latest["cfr"], "Case Fatality Ratio: {:.2f}%"),
+    ]
+    return [text.format(value) for value, text in texts if not np.isnan(value)]
+
 # The Marquee Container
-marquee = dbc.Container(
-    # Rows
-    [
-        # Marquee Row
-        dbc.Row(
-            children = [
-                # Rolling text
-                html.Marquee(
-                    id = "marquee", 
-                    children = f"Last Update: {last_update}",
-                )
-            ],
-            style = {
-                "color": "orange",
-                "fontWeight": "bold",
-                "padding": "10px",
-                "backgroundColor": "white"
-            },
+def make_marquee(dataset):
+    return dbc.Container(
+        # Rows
+        [
+            # Marquee Row
+            dbc.Row(
+                children = [
+                    # Rolling text
+                    html.Marquee(
+                        id = "marquee", 
+                        children = "   |   ".join([f"Last Update: {dataset.last_update}"] + global_analytics(dataset)),
+                    )
+                ],
+                style = {
+                    "color": "orange",
+                    "fontWeight": "bold",
+                    "padding": "10px",
+                    "backgroundColor": "white"
+                },
             
-        ), # End Marquee Row
-        # html.Br(),
-        # html.Br(),
-    ], 
-    fluid = True,
-)
+            ), # End Marquee Row
+            # html.Br(),
+            # html.Br(),
+        ], 
+        fluid = True,
+    )
 
 # Total Cards
-card_layout = html.Div(
-    id = "cards",
-    className = "row flex-display",
-    children = [
-        # Card #1
-        # Global Cases
-        html.Div(
-            id = "card-one",
-            className = "card-container three columns",
-            children = [
-                html.H6(
-                    "Global Cases",
-                    style = {
-                        "textAlign": "center",
-                        "color": "white",
-                        "fontWeight": "bold"
-                    }    
-                ),
-                html.P(
-                    f"{tot_confirmed_global:,}",
-                    style = {
-                        "textAlign": "center",
-                        "color": "orange",
-                        "fontSize": "40px"
-                    },
-                ),
-                html.P(
-                    f"New: {new_confirmed_global:,}   ({pct_change_confirmed}%)",
-                    style = {
-                        "textAlign": "center",
-                        "color": "orange",
-                        "fontSize": "15px",
-                        "marginTop": "-18px"
-                    }    
-                ),
-            ]
-        ), # End Card #1
-        # Card #2
-        # Global Deaths
-        html.Div(
-            id = "card-two",
-            className = "card-container three columns",
-            children = [
-                html.H6(
-                    "Global Deaths",
-                    style = {
-                        "textAlign": "center",
-                        "color": "white",
-                        "fontWeight": "bold"
-                    }    
-                ),
-                html.P(
-                    f"{tot_deaths_global:,}",
-                    style = {
-                        "textAlign": "center",
-                        "color": "#dd1e35",
-                        "fontSize": "40px"
-                    },
-                ),
-                html.P(
-                    f"New: {new_deaths_global:,}   ({pct_change_deaths}%)",
-                    style = {
-                        "textAlign": "center",
-                        "color": "#dd1e35",
-                        "fontSize": "15px",
-                        "marginTop": "-18px"
-                    }    
-                ),
-            ]
-        ), # End Card #2
-        # Card #3
-        # Global Recovered
-        html.Div(
-            id = "card-three",
-            className = "card-container three columns",
-            children = [
-                html.H6(
-                    "Global Recovered",
-                    style = {
-                        "textAlign": "center",
-                        "color": "white",
-                        "fontWeight": "bold"
-                    }    
-                ),
-                html.P(
-                    f"{tot_recovered_global:,}",
-                    style = {
-                        "textAlign": "center",
-                        "color": "#7CFC00",
-                        "fontSize": "40px"
-                    },
-                ),
-                html.P(
-                    f"New: {new_recovered_global:,}   ({pct_change_recovered}%)",
-                    style = {
-                        "textAlign": "center",
-                        "color": "#7CFC00",
-                        "fontSize": "15px",
-                        "marginTop": "-18px"
-                    }    
-                ),
-            ]
-        ), # End Card #3
-        # Card #4
-        # Global Active
-        html.Div(
-            id = "card-four",
-            className = "card-container three columns",
-            children = [
-                html.H6(
-                    "Global Active",
-                    style = {
-                        "textAlign": "center",
-                        "color": "white",
-                        "fontWeight": "bold"
-                    }    
-                ),
-                html.P(
-                    f"{tot_active_global:,}",
-                    style = {
-                        "textAlign": "center",
-                        "color": "#e55467",
-                        "fontSize": "40px"
-                    },
-                ),
-                html.P(
-                    f"New: {new_active_global:,}   ({pct_change_active}%)",
-                    style = {
-                        "textAlign": "center",
-                        "color": "#e55467",
-                        "fontSize": "15px",
-                        "marginTop": "-18px"
-                    }    
-                ),
-            ]
-        ), # End Card #4
-    ]
-)
+def make_cards(dataset):
+    return html.Div(
+        id = "cards",
+        className = "row flex-display",
+        children = [
+            # Card #1
+            # Global Cases
+            html.Div(
+                id = "card-one",
+                className = "card-container three columns",
+                children = [
+                    html.H6(
+                        "Global Cases",
+                        style = {
+                            "textAlign": "center",
+                            "color": "white",
+                            "fontWeight": "bold"
+                        }    
+                    ),
+                    html.P(
+                        f"{dataset.tot_global['confirmed']:,}",
+                        style = {
+                            "textAlign": "center",
+                            "color": "orange",
+                            "fontSize": "40px"
+                        },
+                    ),
+                    html.P(
+                        f"New: {dataset.new_global['confirmed']:,}   ({dataset.pct_change['confirmed']}%)",
+                        style = {
+                            "textAlign": "center",
+                            "color": "orange",
+                            "fontSize": "15px",
+                            "marginTop": "-18px"
+                        }    
+                    ),
+                ]
+            ), # End Card #1
+            # Card #2
+            # Global Deaths
+            html.Div(
+                id = "card-two",
+                className = "card-container three columns",
+                children = [
+                    html.H6(
+                        "Global Deaths",
+                        style = {
+                            "textAlign": "center",
+                            "color": "white",
+                            "fontWeight": "bold"
+                        }    
+                    ),
+                    html.P(
+                        f"{dataset.tot_global['deaths']:,}",
+                        style = {
+                            "textAlign": "center",
+                            "color": "#dd1e35",
+                            "fontSize": "40px"
+                        },
+                    ),
+                    html.P(
+                        f"New: {dataset.new_global['deaths']:,}   ({dataset.pct_change['deaths']}%)",
+                        style = {
+                            "textAlign": "center",
+                            "color": "#dd1e35",
+                            "fontSize": "15px",
+                            "marginTop": "-18px"
+                        }    
+                    ),
+                ]
+            ), # End Card #2
+            # Card #3
+            # Global Recovered
+            html.Div(
+                id = "card-three",
+                className = "card-container three columns",
+                children = [
+                    html.H6(
+                        "Global Recovered",
+                        style = {
+                            "textAlign": "center",
+                            "color": "white",
+                            "fontWeight": "bold"
+                        }    
+                    ),
+                    html.P(
+                        f"{dataset.tot_global['recovered']:,}",
+                        style = {
+                            "textAlign": "center",
+                            "color": "#7CFC00",
+                            "fontSize": "40px"
+                        },
+                    ),
+                    html.P(
+                        f"New: {dataset.new_global['recovered']:,}   ({dataset.pct_change['recovered']}%)",
+                        style = {
+                            "textAlign": "center",
+                            "color": "#7CFC00",
+                            "fontSize": "15px",
+                            "marginTop": "-18px"
+                        }    
+                    ),
+                ]
+            ), # End Card #3
+            # Card #4
+            # Global Active
+            html.Div(
+                id = "card-four",
+                className = "card-container three columns",
+                children = [
+                    html.H6(
+                        "Global Active",
+                        style = {
+                            "textAlign": "center",
+                            "color": "white",
+                            "fontWeight": "bold"
+                        }    
+                    ),
+                    html.P(
+                        f"{dataset.tot_global['active']:,}",
+                        style = {
+                            "textAlign": "center",
+                            "color": "#e55467",
+                            "fontSize": "40px"
+                        },
+                    ),
+                    html.P(
+                        f"New: {dataset.new_global['active']:,}   ({dataset.pct_change['active']}%)",
+                        style = {
+                            "textAlign": "center",
+                            "color": "#e55467",
+                            "fontSize": "15px",
+                            "marginTop": "-18px"
+                        }    
+                    ),
+                ]
+            ), # End Card #4
+        ]
+    )
+
+# With orjson, a figure of graph objects as plain dicts and arrays, which it serializes
+# directly (otherwise Plotly walks the whole figure to clean it first). Plotly's json
+# encoder converts the graph objects itself just as fast, so they are kept for it.
+def plain_figure(figure):
+    if pio.json.config.default_engine == "json":
+        return figure
+    return {
+        "data": [trace.to_plotly_json() for trace in figure["data"]],
+        "layout": figure["layout"].to_plotly_json(),
+    }
 
 def make_kpi(new_today, new_yesterday, color, title):
     indicator = {
@@ -468,7 +420,7 @@ def make_kpi(new_today, new_yesterday, color, title):
         )
     }
     
-    return indicator
+    return plain_figure(indicator)
 
 # Pie Chart
 def make_pie_chart(country, confirmed, deaths, recovered, active, colors):
@@ -515,39 +467,147 @@ def make_pie_chart(country, confirmed, deaths, recovered, active, colors):
         )
     }
     
-    return figure
+    return plain_figure(figure)
+
+# x of the daily traces of the days in the `days` slice: a start date and a one day step when the
+# days are consecutive, instead of one date string per point. The dates are ISO strings
+# formatted once per data version (dataset.iso_dates).
+def date_axis(dataset, days):
+    dates = dataset.iso_dates[days]
+    if dataset.consecutive_days:
+        return {"x0": dates[0], "dx": 86400000}
+    return {"x": dates}
+
+# Line series of the bar and line chart, precomputed for every country by engine.derive_series:
+# derived array -> [legend name, hover label, hover format, title of the right axis]. Lines that
+# are not daily confirmed cases are plotted against their own right axis.
+LINE_SERIES = {}
+for window in engine.WINDOWS:
+    for name in engine.METRICS:
+        LINE_SERIES[f"rolling{window}_{name}"] = [
+            f"{window} Day Rolling Average: Daily {name.title()}",
+            f"Rolling Avg. {name.title()}",
+            ",.0f",
+            None if name == "confirmed" else f"<b>Daily {name.title()}</b>",
+        ]
+for name in ["confirmed", "deaths"]:
+    LINE_SERIES[f"growth_{name}"] = [
+        f"Week-over-Week Growth: 7 Day Average of Daily {name.title()}",
+        "Week-over-Week Growth",
+        "+,.1f",
+        "<b>Growth (%)</b>",
+    ]
+LINE_SERIES["doubling_time"] = ["Doubling Time: Total Confirmed", "Doubling Time (days)", ",.1f", "<b>Doubling Time (days)</b>"]
+LINE_SERIES["cfr"] = ["Case Fatality Ratio", "Case Fatality Ratio (%)", ".2f", "<b>Case Fatality Ratio (%)</b>"]
+DEFAULT_LINE = "rolling7_confirmed"
+
+# Date ranges of the bar and line chart: days back from the latest day (None: the whole history)
+DATE_RANGES = {
+    "90": ("90 Days", 90),
+    "365": ("1 Year", 365),
+    "730": ("2 Years", 730),
+    "all": ("All", None),
+}
+DEFAULT_RANGE = "365"
+
+# Bars of the bar and line chart per bucket size (downsample.BUCKETS): legend name, and the hover
+# lines of the date, the confirmed cases (y) and the daily deaths (customdata[0])
+BAR_BUCKETS = {
+    "day": ["Daily Confirmed Cases", "Date: %{x|%b %d, %Y}", "Daily Confirmed: %{y:,}", "Daily Deaths: %{customdata[0]:,}"],
+    "week": ["Daily Confirmed Cases (weekly average)", "Week of %{x|%b %d, %Y}", "Avg. Daily Confirmed: %{y:,.0f}", "Avg. Daily Deaths: %{customdata[0]:,.0f}"],
+    "month": ["Daily Confirmed Cases (monthly average)", "Month: %{x|%b %Y}", "Avg. Daily Confirmed: %{y:,.0f}", "Avg. Daily Deaths: %{customdata[0]:,.0f}"],
+}
+
+# Bars and line of the bar and line chart over the days in the `days` slice. Up to
+# downsample.MAX_POINTS days are plotted day by day. Longer ranges get the average daily
+# values of weekly or monthly buckets as bars and an LTTB reduction of the line, so the
+# chart sends at most MAX_POINTS bars and line points for any range.
+# Returns the bucket entry of downsample.BUCKETS and the x, y and customdata of both traces.
+def bar_line_points(dataset, series, line, days):
+    bucket, starts = downsample.buckets(dataset.arrays["dates"][days], downsample.MAX_POINTS)
+    daily_confirmed = series["daily_confirmed"][days]
+    daily_deaths = series["daily_deaths"][days]
+    confirmed = series["confirmed"][days]
+    deaths = series["deaths"][days]
+    if bucket[0] == "day":
+        bars = dict(date_axis(dataset, days), y = daily_confirmed, customdata = np.column_stack([daily_deaths, confirmed, deaths]))
+    else:
+        # Totals at the end of each bucket
+        ends = np.r_[starts[1:], len(daily_confirmed)] - 1
+        bars = dict(
+            x = [dataset.iso_dates[days.start + start] for start in starts],
+            y = np.round(downsample.bucket_means(daily_confirmed, starts), 2),
+            customdata = np.column_stack([np.round(downsample.bucket_means(daily_deaths, starts), 2), confirmed[ends], deaths[ends]]),
+        )
+    # Two decimals are plenty for a line and its labels
+    line_values = np.round(series[line][days], 2)
+    kept = downsample.lttb(line_values, downsample.MAX_POINTS)
+    if len(kept) == len(line_values):
+        points = dict(date_axis(dataset, days), y = line_values, customdata = daily_confirmed)
+    else:
+        points = dict(x = [dataset.iso_dates[days.start + day] for day in kept], y = line_values[kept], customdata = daily_confirmed[kept])
+
+    return bucket, bars, points
 
 # Create Bar and Line Charts
-def make_bar_line_chart(country, df, x, y):
+# The hover labels read the date and the plotted value from x and y, and the country from
+# the template, so customdata only carries the columns that are not plotted:
+# bar [daily deaths, total confirmed, total deaths], line the daily confirmed.
+# bars and points are the x (or x0 and dx), y and customdata of the traces (bar_line_points).
+def make_bar_line_chart(country, title, bucket, bars, points, line = DEFAULT_LINE):
+    line_name, line_label, line_format, line_axis = LINE_SERIES[line]
+    bar_name, date_label, confirmed_label, deaths_label = BAR_BUCKETS[bucket[0]]
+    # Buckets span their week or month
+    bar_period = {}
+    if bucket[2] is not None:
+        bar_period = dict(xperiod = bucket[2], xperiod0 = bucket[3], xperiodalignment = "middle")
+    # Lines that are not daily confirmed cases get their own right axis
+    line_layout = {}
+    if line_axis:
+        line_layout["yaxis2"] = dict(
+            title = line_axis,
+            color = "white",
+            showline = True,
+            showgrid = False,
+            showticklabels = True,
+            linecolor = "white",
+            linewidth = 1,
+            ticks = "outside",
+            tickfont = dict(
+                family = "Arial",
+                color = "white",
+                size = 12
+            ),
+            overlaying = "y",
+            side = "right",
+        )
     figure = {
         "data": [
             go.Bar(
-                name = "Daily Confirmed Cases",
-                x = df[x],
-                y = df[y], 
-                # text = df[y],
-                customdata = df.values,
-                hovertemplate = "<br>".join(["<b>%{customdata[0]}</b>",
-                                        "Date: %{customdata[1]|%b %d, %Y}",
-                                        "Daily Confirmed: %{customdata[4]:,}",
-                                        "Daily Deaths: %{customdata[5]:,}",
-                                        "Total Confirmed: %{customdata[2]:,}",
-                                        "Total Deaths: %{customdata[3]:,}",
+                name = bar_name,
+                **bars,
+                # text = y,
+                hovertemplate = "<br>".join([f"<b>{country}</b>",
+                                        date_label,
+                                        confirmed_label,
+                                        deaths_label,
+                                        "Total Confirmed: %{customdata[1]:,}",
+                                        "Total Deaths: %{customdata[2]:,}",
                                         "<extra></extra>"]),
                 marker = dict(color = "orange"),
+                **bar_period,
             ),
             go.Scatter(
-                name = "7 Day Rolling Average: Daily Confirmed",
-                x = df[x],
-                y = df["rolling_average"], 
+                name = line_name,
+                **points,
                 mode = "lines",
-                # text = df[y],
-                customdata = df.values,
-                hovertemplate = "<br>".join(["<b>%{customdata[0]}</b>",
-                                        "<b>Date</b>: %{customdata[1]|%b %d, %Y}",
-                                        "<b>Rolling Avg. Confirmed</b>: %{customdata[6]:,.0f}",
-                                        "<b>Daily Confirmed</b>: %{customdata[4]:,}",
+                # text = y,
+                hovertemplate = "<br>".join([f"<b>{country}</b>",
+                                        "<b>Date</b>: %{x|%b %d, %Y}",
+                                        f"<b>{line_label}</b>: %{{y:{line_format}}}",
+                                        "<b>Daily Confirmed</b>: %{customdata:,}",
                                         "<extra></extra>"]),
+                **({"yaxis": "y2"} if line_axis else {}),
                 line = dict(
                     width = 3,
                     color = "#FF00FF",
@@ -556,7 +616,7 @@ def make_bar_line_chart(country, df, x, y):
         ],
         "layout": go.Layout(
             title = {
-                "text": f"{country}: Last 356 Days",
+                "text": title,
                 "y": 0.93,
                 "x": 0.5,
                 "xanchor": "center",
@@ -582,7 +642,8 @@ def make_bar_line_chart(country, df, x, y):
                 "xanchor": "center",
             },
             margin = dict(
-                r = 0,
+                # Room for the tick labels of the right axis
+                r = 60 if line_axis else 0,
             ),
             xaxis = dict(
                 title = "<b>Date</b>",
@@ -614,9 +675,78 @@ def make_bar_line_chart(country, df, x, y):
                     size = 12
                 ),
             ),
+            **line_layout,
         )
     }
     
+    return plain_figure(figure)
+
+# Comparison Chart
+# One line per country over the same days, from one (countries, days) slice of the matrix.
+# The shared trace settings are validated once; each country only adds its name and values.
+def make_compare_chart(countries, x_axis, values, title, value_title, value_format):
+    trace = go.Scatter(
+        **x_axis,
+        mode = "lines",
+        line = dict(width = 2),
+    ).to_plotly_json()
+    figure = {
+        "data": [
+            dict(
+                trace,
+                name = country,
+                y = row,
+                hovertemplate = f"<b>{country}</b><br>%{{x|%b %d, %Y}}: %{{y:{value_format}}}<extra></extra>",
+            )
+            for country, row in zip(countries, values)
+        ],
+        "layout": go.Layout(
+            title = {
+                "text": title,
+                "y": 0.93,
+                "x": 0.5,
+                "xanchor": "center",
+                "yanchor": "top"
+            },
+            titlefont = {
+                "color": "white",
+                "size": 20
+            },
+            font = dict(
+                family = "sans-serif",
+                color = "white",
+                size = 12
+            ),
+            hovermode = "closest",
+            paper_bgcolor = "#1f2c56",
+            plot_bgcolor = "#1f2c56",
+            legend = {
+                "bgcolor": "#1f2c56",
+            },
+            margin = dict(
+                r = 0,
+            ),
+            xaxis = dict(
+                title = "<b>Date</b>",
+                color = "white",
+                showline = True,
+                showgrid = True,
+                linecolor = "white",
+                linewidth = 1,
+                ticks = "outside",
+            ),
+            yaxis = dict(
+                title = value_title,
+                color = "white",
+                showline = True,
+                showgrid = True,
+                linecolor = "white",
+                linewidth = 1,
+                ticks = "outside",
+            ),
+        ).to_plotly_json()
+    }
+
     return figure
 
 # Create Scatter Plot on Mapbox
@@ -629,24 +759,29 @@ def make_map_chart(df, zoom, zoom_lat, zoom_long):
                 lat = df["Lat"],
                 mode = "markers",
                 marker = go.scattermapbox.Marker(
-                    size = df["confirmed"]/80000,
+                    # Rounded like the markers of the map date slider (make_map_day)
+                    size = (df["confirmed"]/80000).round(4),
                     sizemin = 10,
                     # sizeref = 0.00001,
-                    color = (df["confirmed"] - df["confirmed"].min()) / (df["confirmed"].max() - df["confirmed"].min()),
+                    color = ((df["confirmed"] - df["confirmed"].min()) / (df["confirmed"].max() - df["confirmed"].min())).round(6),
                     colorscale = [ [0, "#7CFC00"], [0.00018, "yellow"], [0.00091, "rgb(255, 0, 255)"], [0.0046, "turquoise"],[0.0098, "royalblue"],[0.043, "purple"], [0.5, "#e55467"], [1.0, "rgb(255, 0, 0)"]],
                     showscale = True,
                     sizemode = "area",
                     opacity = 0.6
                 ),
-                customdata = df.values,
-                hovertemplate = "<br>".join(["<b>%{customdata[1]}</b>",
-                                        "<b>Latitude:</b> %{customdata[2]}",
-                                        "<b>Longitude:</b> %{customdata[3]}",
-                                        "<b>Total Confirmed:</b> %{customdata[4]:,}",
-                                        "<b>Total Deaths:</b> %{customdata[5]:,}",
-                                        "<b>Total Recovered:</b> %{customdata[6]:,}",
-                                        "<b>Total Active:</b> %{customdata[7]:,}",
-                                        "<b>Date:</b> %{customdata[0]|%b %d, %Y}",
+                # Country names in text, the totals in customdata and the date (the same
+                # for every marker) once in meta; the coordinates come from lat and lon
+                text = df["Country/Region"],
+                customdata = df[engine.METRICS].to_numpy(),
+                meta = f"{df['date'].iloc[0]:%b %d, %Y}",
+                hovertemplate = "<br>".join(["<b>%{text}</b>",
+                                        "<b>Latitude:</b> %{lat}",
+                                        "<b>Longitude:</b> %{lon}",
+                                        "<b>Total Confirmed:</b> %{customdata[0]:,}",
+                                        "<b>Total Deaths:</b> %{customdata[1]:,}",
+                                        "<b>Total Recovered:</b> %{customdata[2]:,}",
+                                        "<b>Total Active:</b> %{customdata[3]:,}",
+                                        "<b>Date:</b> %{meta}",
                                         "<extra></extra>"]),
                 # showlegend = True
             ),
@@ -691,156 +826,381 @@ def make_map_chart(df, zoom, zoom_lat, zoom_long):
     
     return figure # End Map Chart
 
+# The map markers only change with the data, so the map figure is built and serialized
+# once per data version; selecting a country only moves the view (see the map-view store)
+map_figures = {}
+
+@data.on_prepare
+def get_map_figure(dataset):
+    figure = map_figures.get(dataset.version)
+    if figure is None:
+        with metrics.stage("map_figure"):
+            figure = json.loads(to_json_plotly(make_map_chart(dataset.country_totals_df, 1, 20, 0)))
+        map_figures[dataset.version] = figure
+        # Keep the previous version for pages that are still on it
+        for version in list(map_figures)[:-2]:
+            map_figures.pop(version, None)
+    return figure
+
+# Markers and hover values of one day of the map, merged into the map figure clientside.
+# Everything comes from per-day arrays built once per data version (dataset.map_markers).
+def make_map_day(dataset, day):
+    arrays = dataset.arrays
+    day = min(max(int(day), 0), len(arrays["dates"]) - 1)
+    markers = dataset.map_markers
+    return {
+        "date": dataset.iso_dates[day],
+        # Date in the hover labels (the meta of the map trace)
+        "label": f"{arrays['dates'][day]:%b %d, %Y}",
+        "values": [arrays[name][:, day].tolist() for name in engine.METRICS],
+        "size": np.round(markers["size"][:, day].astype(np.float64), 4).tolist(),
+        "color": np.round(markers["color"][:, day].astype(np.float64), 6).tolist(),
+    }
+
+# Marks on the map date slider: the first day of every half year
+def make_date_marks(dates):
+    return {
+        day: f"{date:%b %Y}"
+        for day, date in enumerate(dates)
+        if date.day == 1 and date.month in (1, 7)
+    }
+
 # Country Information
-country_info = html.Div(
-    className = "row flex-display",
-    children = [
-        # Create KPI's
-        html.Div(
-            className = "create-container three columns",
-            children = [
-                html.P(
-                    className = "fix-label",
-                    children = ["Select Country:"],
-                    style = {
-                        "color": "white",
-                    }    
-                ),
-                # Country Dropdown
-                dcc.Dropdown(
-                    id = "country-dropdown",
-                    className = "dcc-component",
-                    multi = False,
-                    searchable = True,
-                    options = [
-                        {"label": country, "value": country} for country in country_list  #covid_global["Country/Region"].unique()
-                    ],
-                    value = "Belize",
-                    placeholder = "Select a Country.",
-                ),
-                # Country New Cases
-                html.P(
-                    id = "country-last-update",
-                    className = "fix-label",
-                    # children = [
-                    #     f"New Cases: {last_update}"
-                    # ],
-                    style = {
-                        "textAlign": "center",
-                        "color": "white",
-                    }    
-                ),
-                # Confirmed KPI
-                dcc.Graph(
-                    id = "confirmed-kpi",
-                    className = "dcc-component",
-                    config = {
-                        "displayModeBar": False
-                    },
-                    style = {
-                        "margin-top": "20px",
-                    }
-                ),
-                # Deaths KPI
-                dcc.Graph(
-                    id = "deaths-kpi",
-                    className = "dcc-component",
-                    config = {
-                        "displayModeBar": False
-                    },
-                    style = {
-                        "margin-top": "20px",
-                    }
-                ),
-                # Recovery KPI
-                dcc.Graph(
-                    id = "recovery-kpi",
-                    className = "dcc-component",
-                    config = {
-                        "displayModeBar": False
-                    },
-                    style = {
-                        "margin-top": "20px",
-                    }
-                ),
-                # Active KPI
-                dcc.Graph(
-                    id = "active-kpi",
-                    className = "dcc-component",
-                    config = {
-                        "displayModeBar": False
-                    },
-                    style = {
-                        "margin-top": "20px",
-                    }
-                ),
-            ]
-        ), 
-        # Create Pie Chart for Country Totals
-        html.Div(
-            className = "create-container four columns",
-            children = [
-                # Pie Chart
-                dcc.Graph(
-                    id = "pie-chart",
-                    config = {
-                        "displayModeBar": "hover"
-                    }
-                ),
-            ]
-        ),
-        # Add Bar and Line Charts
-        html.Div(
-            id = "bar-line",
-            className = "create-container five columns",
-            children = [
-                # Bar and line Chart
-                dcc.Graph(
-                    id = "bar-line-chart",
-                    config = {
-                        "displayModeBar": "hover"
-                    }
-                ),
-            ]
-        ),
-    ]
-)
+def make_country_info(dataset):
+    return html.Div(
+        className = "row flex-display",
+        children = [
+            # Create KPI's
+            html.Div(
+                className = "create-container three columns",
+                children = [
+                    html.P(
+                        className = "fix-label",
+                        children = ["Select Country:"],
+                        style = {
+                            "color": "white",
+                        }    
+                    ),
+                    # Country Dropdown
+                    dcc.Dropdown(
+                        id = "country-dropdown",
+                        className = "dcc-component",
+                        multi = False,
+                        searchable = True,
+                        options = [
+                            {"label": country, "value": country} for country in dataset.country_list  #covid_global["Country/Region"].unique()
+                        ],
+                        value = "Belize",
+                        placeholder = "Select a Country.",
+                    ),
+                    # URL of the per-country bundle (clientside figures only)
+                    dcc.Store(
+                        id = "country-bundle",
+                        data = app.get_relative_path(f"/country-bundle/{dataset.version}.json") if CLIENTSIDE_FIGURES else None,
+                    ),
+                    # Country New Cases
+                    html.P(
+                        id = "country-last-update",
+                        className = "fix-label",
+                        # children = [
+                        #     f"New Cases: {last_update}"
+                        # ],
+                        style = {
+                            "textAlign": "center",
+                            "color": "white",
+                        }    
+                    ),
+                    # Confirmed KPI
+                    dcc.Graph(
+                        id = "confirmed-kpi",
+                        className = "dcc-component",
+                        config = {
+                            "displayModeBar": False
+                        },
+                        style = {
+                            "margin-top": "20px",
+                        }
+                    ),
+                    # Deaths KPI
+                    dcc.Graph(
+                        id = "deaths-kpi",
+                        className = "dcc-component",
+                        config = {
+                            "displayModeBar": False
+                        },
+                        style = {
+                            "margin-top": "20px",
+                        }
+                    ),
+                    # Recovery KPI
+                    dcc.Graph(
+                        id = "recovery-kpi",
+                        className = "dcc-component",
+                        config = {
+                            "displayModeBar": False
+                        },
+                        style = {
+                            "margin-top": "20px",
+                        }
+                    ),
+                    # Active KPI
+                    dcc.Graph(
+                        id = "active-kpi",
+                        className = "dcc-component",
+                        config = {
+                            "displayModeBar": False
+                        },
+                        style = {
+                            "margin-top": "20px",
+                        }
+                    ),
+                ]
+            ), 
+            # Create Pie Chart for Country Totals
+            html.Div(
+                className = "create-container four columns",
+                children = [
+                    # Pie Chart
+                    dcc.Graph(
+                        id = "pie-chart",
+                        config = {
+                            "displayModeBar": "hover"
+                        }
+                    ),
+                ]
+            ),
+            # Add Bar and Line Charts
+            html.Div(
+                id = "bar-line",
+                className = "create-container five columns",
+                children = [
+                    # Line series of the chart
+                    dcc.Dropdown(
+                        id = "bar-line-series",
+                        className = "dcc-component",
+                        multi = False,
+                        clearable = False,
+                        options = [
+                            {"label": name, "value": line} for line, (name, _, _, _) in LINE_SERIES.items()
+                        ],
+                        value = DEFAULT_LINE,
+                    ),
+                    # Date range of the chart (the clientside figures only have the default range)
+                    html.Div(
+                        hidden = CLIENTSIDE_FIGURES,
+                        children = [
+                            dcc.RadioItems(
+                                id = "bar-line-range",
+                                options = [
+                                    {"label": f" {label}", "value": date_range} for date_range, (label, _) in DATE_RANGES.items()
+                                ],
+                                value = DEFAULT_RANGE,
+                                inline = True,
+                                labelStyle = {
+                                    "margin-right": "15px",
+                                },
+                                style = {
+                                    "color": "white",
+                                    "margin-top": "10px",
+                                }
+                            ),
+                        ]
+                    ),
+                    # Bar and line Chart
+                    dcc.Graph(
+                        id = "bar-line-chart",
+                        config = {
+                            "displayModeBar": "hover"
+                        }
+                    ),
+                ]
+            ),
+        ]
+    )
+
+# Country Comparison
+def make_compare_info(dataset):
+    return html.Div(
+        className = "row flex-display",
+        children = [
+            html.Div(
+                className = "create-container three columns",
+                children = [
+                    html.P(
+                        className = "fix-label",
+                        children = ["Compare Countries:"],
+                        style = {
+                            "color": "white",
+                        }
+                    ),
+                    dcc.Dropdown(
+                        id = "compare-dropdown",
+                        className = "dcc-component",
+                        multi = True,
+                        searchable = True,
+                        options = [
+                            {"label": country, "value": country} for country in dataset.country_list
+                        ],
+                        # The five countries with the most cases
+                        value = dataset.country_totals_df.nlargest(5, "confirmed")["Country/Region"].tolist(),
+                        placeholder = "Select Countries.",
+                    ),
+                    html.P(
+                        className = "fix-label",
+                        children = ["Show:"],
+                        style = {
+                            "color": "white",
+                            "margin-top": "20px",
+                        }
+                    ),
+                    dcc.RadioItems(
+                        id = "compare-scale",
+                        options = [
+                            {"label": " Cases", "value": "cases"},
+                            {"label": " Cases per 1,000 sq mi", "value": "area"},
+                        ],
+                        value = "cases",
+                        labelStyle = {
+                            "display": "block",
+                        },
+                        style = {
+                            "color": "white",
+                        }
+                    ),
+                ]
+            ),
+            html.Div(
+                className = "create-container nine columns",
+                children = [
+                    dcc.Graph(
+                        id = "compare-confirmed-chart",
+                        config = {
+                            "displayModeBar": "hover"
+                        }
+                    ),
+                    dcc.Graph(
+                        id = "compare-deaths-chart",
+                        config = {
+                            "displayModeBar": "hover"
+                        }
+                    ),
+                ]
+            ),
+        ]
+    )
 
 # Map Information
-map_info = html.Div(
-    className = "row flex-display",
-    children = [
-        # Add Map
-        html.Div(
-            className = "create-container-map twelve columns",
-            children = [
-                # Bar Chart
-                dcc.Graph(
-                    id = "map-chart",
-                    config = {
-                        "displayModeBar": "hover"
-                    }
-                ),
-            ]
-        ),
-    ]
-)
+def make_map_info(dataset):
+    return html.Div(
+        className = "row flex-display",
+        children = [
+            # Add Map
+            html.Div(
+                className = "create-container-map twelve columns",
+                children = [
+                    # Bar Chart
+                    dcc.Graph(
+                        id = "map-chart",
+                        figure = get_map_figure(dataset),
+                        config = {
+                            "displayModeBar": "hover"
+                        }
+                    ),
+                    # Map center and zoom for the selected country
+                    dcc.Store(id = "map-view"),
+                    # Map date slider
+                    html.P(
+                        id = "map-date-label",
+                        className = "fix-label",
+                        children = f"Map as of {dataset.last_update}",
+                        style = {
+                            "color": "white",
+                        }
+                    ),
+                    dcc.Slider(
+                        id = "map-date",
+                        min = 0,
+                        max = len(dataset.arrays["dates"]) - 1,
+                        step = 1,
+                        value = len(dataset.arrays["dates"]) - 1,
+                        marks = make_date_marks(dataset.arrays["dates"]),
+                        updatemode = "drag",
+                    ),
+                    # Markers of the selected day, and the data version the page was built from
+                    dcc.Store(id = "map-day"),
+                    dcc.Store(id = "map-version", data = dataset.version),
+                ]
+            ),
+        ]
+    )
+
+# Warming Up Placeholder
+# Served while the data loads in the background (COVID_ASYNC_LOAD=1). The page polls
+# /healthz and reloads itself once the dataset is ready.
+def make_warming_up():
+    return html.Div(
+        id = "parent",
+        children = [
+            navbar,
+            dbc.Container(
+                [
+                    dbc.Spinner(color = "warning"),
+                    html.H4("Loading the latest data..."),
+                    html.P("This page reloads itself as soon as it is ready."),
+                ],
+                className = "text-center",
+                style = {
+                    "color": "white",
+                    "padding": "80px 0"
+                },
+            ),
+            dcc.Store(id = "healthz-url", data = app.get_relative_path("/healthz")),
+            dcc.Interval(id = "warming-up", interval = 2000),
+        ]
+    )
 
 # HTML Body
-app.layout = html.Div(
-    id = "parent",
-    children = [
-        navbar,
-        marquee,
-        card_layout,
-        country_info,
-        map_info
-    ],
-    # style = {
-    #     "display": "flex",
-    #     "flex-direction": "column"
-    # }
-)
+# Built on every page load from the current dataset, so refreshed data shows up without a restart
+def serve_layout():
+    dataset = data.current()
+    if dataset is None:
+        return make_warming_up()
+    return html.Div(
+        id = "parent",
+        children = [
+            navbar,
+            make_marquee(dataset),
+            make_cards(dataset),
+            make_country_info(dataset),
+            make_compare_info(dataset),
+            make_map_info(dataset)
+        ],
+        # style = {
+        #     "display": "flex",
+        #     "flex-direction": "column"
+        # }
+    )
+
+app.layout = serve_layout
+
+# Warming Up Callback
+if data.ASYNC_LOAD:
+    app.clientside_callback(
+        """
+        function(n, url) {
+            fetch(url).then(function(response) {
+                if (response.ok) {
+                    window.location.reload();
+                }
+            });
+            return window.dash_clientside.no_update;
+        }
+        """,
+        Output("warming-up", "disabled"),
+        Input("warming-up", "n_intervals"),
+        State("healthz-url", "data"),
+        prevent_initial_call = True,
+    )
 
 # Navbar Callback
 # add callback for toggling the collapse on small screens
@@ -855,7 +1215,9 @@ def toggle_navbar_collapse(n, is_open):
     return is_open
 
 # Country Callback
-@app.callback(
+# Server-side by default; with CLIENTSIDE_FIGURES the figures are computed in the browser
+# (assets/country_figures.js) from the per-country bundle, see the registration below
+country_outputs = [
     Output(
         component_id = "country-last-update", # What will be updated
         component_property = "children"
@@ -885,71 +1247,366 @@ def toggle_navbar_collapse(n, is_open):
         component_property = "figure"
     ),
     Output(
-        component_id = "map-chart", # What will be updated
-        component_property = "figure"
+        component_id = "map-view", # What will be updated
+        component_property = "data"
     ),
-    Input( 
-        component_id = "country-dropdown", # Info coming from
-        component_property = "value"
-    )
+]
+country_input = Input( 
+    component_id = "country-dropdown", # Info coming from
+    component_property = "value"
+)
+
+line_input = Input(
+    component_id = "bar-line-series",
+    component_property = "value"
 )
-def country_kpi(country):
-    # Country Data
-    country_data = covid_global[covid_global["Country/Region"] == country]
-    tot_confirmed = country_data["confirmed"].iloc[-1]
-    tot_deaths = country_data["deaths"].iloc[-1]
-    tot_recovered = country_data["recovered"].iloc[-1]
-    tot_active = country_data["active"].iloc[-1]
-    # Yesterday's total
-    tot_confirmed_yesterday = country_data["confirmed"].iloc[-2]
-    tot_deaths_yesterday = country_data["deaths"].iloc[-2]
-    tot_recovered_yesterday = country_data["recovered"].iloc[-2]
-    tot_active_yesterday = country_data["active"].iloc[-2]
-    # Today New: Cases, Deaths, Recovery, Active
-    new_confirmed = tot_confirmed - tot_confirmed_yesterday
-    new_deaths = tot_deaths - tot_deaths_yesterday
-    new_recovered = tot_recovered - tot_recovered_yesterday
-    new_active = tot_active - tot_active_yesterday
-    # Yesterday New: Cases, Deaths, Recovery, Active
-    yesterday_new_confirmed = tot_confirmed_yesterday - country_data["confirmed"].iloc[-3]
-    yesterday_new_deaths = tot_deaths_yesterday - country_data["deaths"].iloc[-3]
-    yesterday_new_recovered = tot_recovered_yesterday - country_data["recovered"].iloc[-3]
-    yesterday_new_active = tot_active_yesterday - country_data["active"].iloc[-3]
-    # Date of last update by Country
-    country_date_text = f"New Cases: {last_update}"
-    # Colors for Pie Chart
-    colors = ["orange", "#dd1e35", "#7CFC00", "#e55467"]
-    # Compute Daily Cases for each Country
-    country_daily_data = country_data.loc[:, ["Country/Region", "date", "confirmed", "deaths"]]
-    country_daily_data["daily_confirmed"] = country_daily_data["confirmed"] - country_daily_data["confirmed"].shift(1)
-    country_daily_data["daily_confirmed"] = country_daily_data["daily_confirmed"].fillna(0)
-    country_daily_data["daily_confirmed"] = country_daily_data["daily_confirmed"].astype(int)
-    country_daily_data["daily_deaths"] = country_daily_data["deaths"] - country_daily_data["deaths"].shift(1)
-    country_daily_data["daily_deaths"] = country_daily_data["daily_deaths"].fillna(0)
-    country_daily_data["daily_deaths"] = country_daily_data["daily_deaths"].astype(int)
-    # 7-Day Rolling Average
-    country_daily_data["rolling_average"] = country_daily_data["daily_confirmed"].rolling(window = 7).mean()
-    # Scattermapbox: zoom control information
+
+# Date range of the bar and line chart, and its zoom (server-side figures only)
+range_inputs = [
+    Input(
+        component_id = "bar-line-range",
+        component_property = "value"
+    ),
+    Input(
+        component_id = "bar-line-chart",
+        component_property = "relayoutData"
+    ),
+]
+
+def country_kpi(country, line = DEFAULT_LINE, date_range = DEFAULT_RANGE):
+    # Use one dataset for the whole request, even if a refresh swaps it meanwhile
+    dataset = data.current()
+    if line not in LINE_SERIES:
+        line = DEFAULT_LINE
+    if date_range not in DATE_RANGES:
+        date_range = DEFAULT_RANGE
+    key = (country, line, date_range, dataset.version)
+    with metrics.stage("cache"):
+        response = figure_cache.get(key)
+    if response is not None:
+        return response
+    response = build_country_response(dataset, country, line, date_range)
+    with metrics.stage("cache"):
+        figure_cache.put(key, response)
+
+    return response
+
+# The country callback. A new line series or date range only updates the bar and line chart,
+# and so does a zoom of the chart, which brings the detail of the zoomed days from the server
+# (a double click goes back to the date range).
+def update_country(country, line, date_range, relayout):
+    # A page left open while this worker is still loading the data (COVID_ASYNC_LOAD=1)
+    if data.current() is None:
+        raise PreventUpdate
+    triggered = {item["prop_id"] for item in callback_context.triggered}
+    if triggered == {"bar-line-chart.relayoutData"}:
+        if relayout and relayout.get("xaxis.autorange"):
+            chart = country_kpi(country, line, date_range)[6]
+        else:
+            dataset = data.current()
+            days = zoom_days(dataset, relayout)
+            # Resizes and other layout events
+            if days is None or country not in dataset.country_series or line not in LINE_SERIES:
+                raise PreventUpdate
+            with metrics.stage("zoom"):
+                chart = build_bar_line_chart(dataset, country, line, days)
+        return [no_update] * 6 + [chart, no_update]
+    response = country_kpi(country, line, date_range)
+    if triggered and triggered <= {"bar-line-series.value", "bar-line-range.value"}:
+        return [no_update] * 6 + [response[6], no_update]
+
+    return response
+
+# Days of a zoom of the bar and line chart as a slice, from its relayoutData
+# (None when the event is not a zoom of the x axis, or covers less than two days)
+def zoom_days(dataset, relayout):
+    relayout = relayout or {}
+    low, high = relayout.get("xaxis.range") or [relayout.get("xaxis.range[0]"), relayout.get("xaxis.range[1]")]
+    try:
+        low, high = pd.Timestamp(low), pd.Timestamp(high)
+    except (TypeError, ValueError):
+        return None
+    dates = dataset.arrays["dates"]
+    start = dates.searchsorted(low.floor("D"))
+    stop = dates.searchsorted(high, side = "right")
+    if stop - start < 2:
+        return None
+
+    return slice(int(start), int(stop))
+
+# Days of a date range of the bar and line chart as a slice, and the title of the range
+def range_days(dataset, date_range):
+    n_days = len(dataset.iso_dates)
+    window = DATE_RANGES[date_range][1]
+    if window is None or window >= n_days:
+        return slice(0, n_days), f"Since {dataset.arrays['dates'][0]:%b %d, %Y}"
+
+    return slice(n_days - window, n_days), f"Last {window} Days"
+
+# The bar and line chart of the days in the `days` slice
+def build_bar_line_chart(dataset, country, line, days, title = None):
+    series = dataset.country_series[country]
+    if title is None:
+        title = f"{country}: {dataset.arrays['dates'][days.start]:%b %d, %Y} - {dataset.arrays['dates'][days.stop - 1]:%b %d, %Y}"
+
+    return make_bar_line_chart(country, title, *bar_line_points(dataset, series, line, days), line)
+
+# The eight outputs of the country callback, with the selected line series and date range in the
+# bar and line chart
+def build_country_response(dataset, country, line = DEFAULT_LINE, date_range = DEFAULT_RANGE):
+    with metrics.stage("series"):
+        # Country Data
+        series = dataset.country_series[country]
+        confirmed = series["confirmed"]
+        deaths = series["deaths"]
+        recovered = series["recovered"]
+        active = series["active"]
+        tot_confirmed = confirmed[-1]
+        tot_deaths = deaths[-1]
+        tot_recovered = recovered[-1]
+        tot_active = active[-1]
+        # Today New: Cases, Deaths, Recovery, Active
+        new_confirmed = series["daily_confirmed"][-1]
+        new_deaths = series["daily_deaths"][-1]
+        new_recovered = series["daily_recovered"][-1]
+        new_active = series["daily_active"][-1]
+        # Yesterday New: Cases, Deaths, Recovery, Active
+        yesterday_new_confirmed = series["daily_confirmed"][-2]
+        yesterday_new_deaths = series["daily_deaths"][-2]
+        yesterday_new_recovered = series["daily_recovered"][-2]
+        yesterday_new_active = series["daily_active"][-2]
+        # Date of last update by Country
+        country_date_text = f"New Cases: {dataset.last_update}"
+        # Colors for Pie Chart
+        colors = ["orange", "#dd1e35", "#7CFC00", "#e55467"]
+        # Daily Cases of the date range
+        days, range_title = range_days(dataset, date_range)
+    
+    with metrics.stage("figures"):
+        response = country_date_text, \
+            make_kpi(new_confirmed, yesterday_new_confirmed, "orange", "<b>New Confirmed</b>"),\
+            make_kpi(new_deaths, yesterday_new_deaths, "#dd1e35", "<b>New Deaths</b>"),\
+            make_kpi(new_recovered, yesterday_new_recovered, "#7CFC00", "<b>New Recovered</b>"),\
+            make_kpi(new_active, yesterday_new_active, "#e55467", "<b>New Active</b>"),\
+            make_pie_chart(country, tot_confirmed, tot_deaths, tot_recovered, tot_active, colors),\
+            build_bar_line_chart(dataset, country, line, days, f"{country}: {range_title}"),\
+            make_map_view(dataset, country)
+
+    return response
+
+# Scattermapbox: zoom control information
+def make_map_view(dataset, country):
+    row = dataset.country_rows[country]
     # Use the area of each country to control the zoom level
-    if country in area_list:  #country == "Belize":
-        area = area_df.loc[area_df.country == country, "areasqmi"].values[0]
-        slope = (3 - 7) / (3800000 - 8900)
-        zoom = 7 + slope * (area - 8900)
-        zoom_lat = dict_country_locations[country]["Lat"]
-        zoom_long = dict_country_locations[country]["Long"]
+    area = dataset.areas[row]
+    if np.isnan(area):
+        zoom = 7
     else:
-        zoom = 7    
-        zoom_lat = dict_country_locations[country]["Lat"]
-        zoom_long = dict_country_locations[country]["Long"]
-    
-    return country_date_text, \
-        make_kpi(new_confirmed, yesterday_new_confirmed, "orange", "<b>New Confirmed</b>"),\
-        make_kpi(new_deaths, yesterday_new_deaths, "#dd1e35", "<b>New Deaths</b>"),\
-        make_kpi(new_recovered, yesterday_new_recovered, "#7CFC00", "<b>New Recovered</b>"),\
-        make_kpi(new_active, yesterday_new_active, "#e55467", "<b>New Active</b>"),\
-        make_pie_chart(country, tot_confirmed, tot_deaths, tot_recovered, tot_active, colors),\
-        make_bar_line_chart(country, country_daily_data.tail(365), "date", "daily_confirmed"),\
-        make_map_chart(country_totals_df, zoom, zoom_lat, zoom_long)
+        slope = (3 - 7) / (3800000 - 8900)
+        zoom = 7 + slope * (float(area) - 8900)
+
+    return {"zoom": zoom, "lat": float(dataset.arrays["lat"][row]), "lon": float(dataset.arrays["long"][row])}
+
+# The two outputs of the comparison callback. The daily series of all countries are dense
+# (countries, days) arrays built once per data version, so any number of countries is one
+# fancy-index slice of each. area.csv has no population column, so the rates are per area.
+def build_compare_response(dataset, countries, scale = "cases"):
+    rows = dataset.country_index.get_indexer(countries)
+    rows = rows[rows >= 0]
+    names = dataset.country_list[rows]
+    window = min(365, len(dataset.iso_dates))
+    x_axis = date_axis(dataset, slice(-window, None))
+    figures = []
+    for name, label in (("confirmed", "Confirmed"), ("deaths", "Deaths")):
+        values = dataset.derived[f"daily_{name}"][rows, -window:]
+        if scale == "area":
+            values = np.round(values / dataset.areas[rows, None] * 1000, 3)
+            figures.append(make_compare_chart(names, x_axis, values, f"Daily {label} per 1,000 sq mi", f"<b>Daily {label} per 1,000 sq mi</b>", ",.3f"))
+        else:
+            figures.append(make_compare_chart(names, x_axis, values, f"Daily {label}", f"<b>Daily {label} Cases</b>", ","))
+
+    return figures
+
+# Per-country bundle for the clientside figures: just enough of every country's series
+# for the outputs of build_country_response. The cumulative totals of the last year and
+# the line series of the bar and line chart are rebuilt in the browser from the daily values.
+def make_country_bundle(dataset):
+    dates = dataset.arrays["dates"]
+    # The clientside figures show the default date range, day by day
+    days, title = range_days(dataset, DEFAULT_RANGE)
+    window = days.stop - days.start
+    # Days before the window needed for the analytics of its first day
+    lead = min(engine.LOOKBACK - 1, len(dates) - window)
+    first = len(dates) - window - lead
+    countries = {}
+    for country, series in dataset.country_series.items():
+        countries[country] = {
+            # Daily values of every metric from the first lead day, and the totals of that day
+            "daily": [series[f"daily_{name}"][first:].tolist() for name in engine.METRICS],
+            "confirmed": int(series["confirmed"][first]),
+            "deaths": int(series["deaths"][first]),
+            "totals": [int(series[name][-1]) for name in engine.METRICS],
+            "new": [[int(series[f"daily_{name}"][day]) for name in engine.METRICS] for day in (-1, -2)],
+            "view": make_map_view(dataset, country),
+        }
+
+    return {
+        "version": dataset.version,
+        "last_update": dataset.last_update,
+        "dates": dataset.iso_dates[-window:],
+        "title": title,
+        "lead": lead,
+        "metrics": engine.METRICS,
+        "lines": LINE_SERIES,
+        "countries": countries,
+    }
+
+# The bundle compressed with Brotli and with gzip (for clients without Brotli), once per
+# data version and at the highest levels, so a request only picks one of the two
+country_bundles = {}
+
+def get_country_bundle(dataset):
+    bundle = country_bundles.get(dataset.version)
+    if bundle is None:
+        with metrics.stage("bundle"):
+            raw = to_json_plotly(make_country_bundle(dataset)).encode()
+            bundle = {"br": brotli.compress(raw, quality = 11), "gzip": gzip.compress(raw, 9)}
+        country_bundles[dataset.version] = bundle
+        # Keep the previous version for pages that are still on it
+        for version in list(country_bundles)[:-2]:
+            country_bundles.pop(version, None)
+    return bundle
+
+if CLIENTSIDE_FIGURES:
+    data.on_prepare(get_country_bundle)
+    app.clientside_callback(
+        ClientsideFunction(namespace = "country", function_name = "figures"),
+        *country_outputs,
+        country_input,
+        line_input,
+        State("country-bundle", "data"),
+    )
+else:
+    app.callback(*country_outputs, country_input, line_input, *range_inputs)(update_country)
+
+# Map Callback
+# Move the map to the selected country in the browser, without resending the markers
+app.clientside_callback(
+    """
+    function(view, day, figure) {
+        var triggered = window.dash_clientside.callback_context.triggered.map(function(t) { return t.prop_id; });
+        if (!figure) {
+            return window.dash_clientside.no_update;
+        }
+        var layout = figure.layout;
+        var traces = figure.data;
+        if (view && triggered.indexOf("map-view.data") >= 0) {
+            var mapbox = Object.assign({}, layout.mapbox, {
+                center: {lat: view.lat, lon: view.lon},
+                zoom: view.zoom
+            });
+            layout = Object.assign({}, layout, {mapbox: mapbox});
+        }
+        if (day && triggered.indexOf("map-day.data") >= 0) {
+            // Replace the totals and the date of the hover labels
+            var trace = traces[0];
+            var customdata = day.values[0].map(function(confirmed, i) {
+                return [confirmed, day.values[1][i], day.values[2][i], day.values[3][i]];
+            });
+            var marker = Object.assign({}, trace.marker, {size: day.size, color: day.color});
+            traces = [Object.assign({}, trace, {customdata: customdata, marker: marker, meta: day.label})].concat(traces.slice(1));
+        }
+        if (layout === figure.layout && traces === figure.data) {
+            return window.dash_clientside.no_update;
+        }
+        return Object.assign({}, figure, {data: traces, layout: layout});
+    }
+    """,
+    Output("map-chart", "figure"),
+    Input("map-view", "data"),
+    Input("map-day", "data"),
+    State("map-chart", "figure"),
+)
+
+# Map Date Callback
+# One slider tick only sends the markers of that day (a few KB). They line up with the
+# countries of the map in the page only for the data version the page was built from:
+# a page left open across a refresh keeps its map until it is reloaded.
+@app.callback(
+    Output("map-day", "data"),
+    Output("map-date-label", "children"),
+    Input("map-date", "value"),
+    State("map-version", "data"),
+    prevent_initial_call = True,
+)
+def map_date(day, version):
+    dataset = data.current()
+    if dataset is None or version != dataset.version:
+        raise PreventUpdate
+    with metrics.stage("map_day"):
+        map_day = make_map_day(dataset, day)
+    return map_day, f"Map as of {pd.Timestamp(map_day['date']):%B %d, %Y}"
         
+# Comparison Callback
+@app.callback(
+    Output("compare-confirmed-chart", "figure"),
+    Output("compare-deaths-chart", "figure"),
+    Input("compare-dropdown", "value"),
+    Input("compare-scale", "value"),
+)
+def compare_countries(countries, scale):
+    dataset = data.current()
+    if dataset is None:
+        raise PreventUpdate
+    with metrics.stage("compare"):
+        return build_compare_response(dataset, countries or [], scale)
+
+# Per-country bundle of one data version. The URL changes with the version, so browsers
+# can cache it for good.
+@server.route("/country-bundle/<version>.json")
+def country_bundle(version):
+    dataset = data.current()
+    if dataset is None:
+        flask.abort(404)
+    bundle = get_country_bundle(dataset) if version == dataset.version else country_bundles.get(version)
+    if bundle is None:
+        flask.abort(404)
+    accepted = flask.request.headers.get("Accept-Encoding", "")
+    encoding = next((encoding for encoding in ("br", "gzip") if encoding in accepted), None)
+    if encoding is not None:
+        response = flask.Response(bundle[encoding], mimetype = "application/json")
+        response.headers["Content-Encoding"] = encoding
+    else:
+        response = flask.Response(gzip.decompress(bundle["gzip"]), mimetype = "application/json")
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+# Figure cache hit/miss counters
+@server.route("/cache-stats")
+def cache_stats():
+    return flask.jsonify(figure_cache.stats())
+
+# Health check: 200 with the version and age of the dataset once it is loaded, 503 until then
+@server.route("/healthz")
+def healthz():
+    status = data.status()
+    response = flask.jsonify(status)
+    response.status_code = 200 if status["loaded"] else 503
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+# Load the data (from the local snapshot when there is one), once every prepare hook
+# above is registered, so the first dataset gets its map figure and country bundle built
+# here like every later one instead of on the first request that needs them.
+# A background thread rebuilds it and swaps in new versions, so everything above
+# reads the data through data.current() instead of module-level globals.
+# With COVID_ASYNC_LOAD=1 the loading itself runs in a background thread too.
+if data.ASYNC_LOAD:
+    data.start_loader()
+else:
+    data.load()
+    data.start_refresher()
+
 if __name__ == '__main__':
     app.run()
\ No newline at end of file
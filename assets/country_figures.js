@@ -0,0 +1,241 @@
+// Country figures computed in the browser (COVID_CLIENTSIDE_FIGURES=1).
+// The per-country bundle is fetched once per data version from its immutable URL,
+// then every dropdown change builds the same figures as make_kpi, make_pie_chart
+// and make_bar_line_chart in app.py without a round trip to the server.
+
+(function() {
+    var bundles = {};
+
+    function loadBundle(url) {
+        if (!bundles[url]) {
+            bundles[url] = fetch(url).then(function(response) {
+                if (!response.ok) {
+                    throw new Error("Could not load " + url + ": " + response.status);
+                }
+                return response.json();
+            });
+            // Try again on the next change after a failed download
+            bundles[url].catch(function() {
+                delete bundles[url];
+            });
+        }
+        return bundles[url];
+    }
+
+    function makeKpi(newToday, newYesterday, color, title) {
+        return {
+            data: [{
+                delta: {font: {size: 15}, position: "right", reference: newYesterday, relative: false, valueformat: ",.0f"},
+                domain: {x: [0, 1], y: [0, 1]},
+                mode: "number+delta",
+                number: {font: {size: 20}, valueformat: ","},
+                value: newToday,
+                type: "indicator"
+            }],
+            layout: {
+                font: {color: color},
+                height: 50,
+                paper_bgcolor: "#1f2c56",
+                plot_bgcolor: "#1f2c56",
+                title: {text: title, x: 0.5, xanchor: "center", y: 1, yanchor: "top"}
+            }
+        };
+    }
+
+    function chartLayout(title) {
+        return {
+            font: {color: "white", family: "sans-serif", size: 12},
+            hovermode: "closest",
+            legend: {bgcolor: "#1f2c56", orientation: "h", x: 0.5, xanchor: "center", y: -0.7},
+            paper_bgcolor: "#1f2c56",
+            plot_bgcolor: "#1f2c56",
+            title: {text: title, x: 0.5, xanchor: "center", y: 0.93, yanchor: "top", font: {color: "white", size: 20}}
+        };
+    }
+
+    function makePieChart(country, totals, colors) {
+        return {
+            data: [{
+                hole: 0.7,
+                hoverinfo: "label+value+percent",
+                labels: ["<b>Confirmed</b>", "<b>Deaths</b>", "<b>Recovered</b>", "<b>Active</b>"],
+                marker: {colors: colors},
+                rotation: 45,
+                textinfo: "label+value",
+                values: totals,
+                type: "pie"
+            }],
+            layout: chartLayout("Totals Cases: " + country)
+        };
+    }
+
+    function axis(title) {
+        return {
+            color: "white",
+            linecolor: "white",
+            linewidth: 1,
+            showgrid: true,
+            showline: true,
+            showticklabels: true,
+            tickfont: {color: "white", family: "Arial", size: 12},
+            ticks: "outside",
+            title: {text: title}
+        };
+    }
+
+    // Start date and one day step for consecutive days, like date_axis in app.py
+    function dateAxis(dates) {
+        if (dates.length > 1 && (Date.parse(dates[dates.length - 1]) - Date.parse(dates[0])) / 86400000 === dates.length - 1) {
+            return {x0: dates[0], dx: 86400000};
+        }
+        return {x: dates};
+    }
+
+    // Two decimals, as sent by the server: numpy.round rounds halves to even
+    function roundCents(value) {
+        var scaled = value * 100;
+        var rounded = Math.abs(scaled % 1) === 0.5 ? 2 * Math.round(scaled / 2) : Math.round(scaled);
+        return rounded / 100;
+    }
+
+    // Mean of the last `window` days from a running sum, NaN before the first full window,
+    // like rolling_mean in engine.py
+    function rollingMean(values, window) {
+        var running = 0;
+        var runningBefore = 0;
+        return values.map(function(value, day) {
+            running += value;
+            if (day >= window) {
+                runningBefore += values[day - window];
+            }
+            return day >= window - 1 ? (running - runningBefore) / window : NaN;
+        });
+    }
+
+    // Line series of the bar and line chart over the lead and window days of the bundle,
+    // like engine.derive_series: rolling means, week-over-week growth (%) of the 7-day mean,
+    // doubling time (days) of the confirmed cases and case fatality ratio (%)
+    function lineSeries(line, bundle, entry, cumulative) {
+        var lag = 7;
+        var match = /^rolling(\d+)_(\w+)$/.exec(line);
+        if (match) {
+            return rollingMean(entry.daily[bundle.metrics.indexOf(match[2])], Number(match[1]));
+        }
+        match = /^growth_(\w+)$/.exec(line);
+        if (match) {
+            var mean = rollingMean(entry.daily[bundle.metrics.indexOf(match[1])], 7);
+            return mean.map(function(value, day) {
+                return day >= lag && mean[day - lag] > 0 ? (value / mean[day - lag] - 1) * 100 : NaN;
+            });
+        }
+        if (line === "doubling_time") {
+            return cumulative.confirmed.map(function(value, day) {
+                var before = cumulative.confirmed[day - lag];
+                return day >= lag && before > 0 && value > before ? lag * Math.LN2 / Math.log(value / before) : NaN;
+            });
+        }
+        return cumulative.confirmed.map(function(value, day) {
+            return value > 0 ? cumulative.deaths[day] / value * 100 : NaN;
+        });
+    }
+
+    // Daily cases of the last year, with the cumulative totals and the selected line
+    // series rebuilt from the daily values
+    function makeBarLineChart(country, line, bundle, entry) {
+        var dates = bundle.dates;
+        var lead = bundle.lead;
+        var dailyConfirmed = entry.daily[0];
+        var dailyDeaths = entry.daily[1];
+        var cumulative = {confirmed: [], deaths: []};
+        var confirmed = entry.confirmed;
+        var deaths = entry.deaths;
+        for (var day = 0; day < dailyConfirmed.length; day++) {
+            if (day > 0) {
+                confirmed += dailyConfirmed[day];
+                deaths += dailyDeaths[day];
+            }
+            cumulative.confirmed.push(confirmed);
+            cumulative.deaths.push(deaths);
+        }
+        var values = lineSeries(line, bundle, entry, cumulative);
+        var y = [];
+        var lineValues = [];
+        var customdata = [];
+        for (var i = 0; i < dates.length; i++) {
+            var day = lead + i;
+            y.push(dailyConfirmed[day]);
+            lineValues.push(roundCents(values[day]));
+            customdata.push([dailyDeaths[day], cumulative.confirmed[day], cumulative.deaths[day]]);
+        }
+        var spec = bundle.lines[line];
+        var layout = chartLayout(country + ": " + bundle.title);
+        layout.margin = {r: 0};
+        layout.xaxis = axis("<b>Date</b>");
+        layout.yaxis = axis("<b>Daily Confirmed Cases</b>");
+        var lineTrace = {
+            customdata: y,
+            hovertemplate: ["<b>" + country + "</b>",
+                            "<b>Date</b>: %{x|%b %d, %Y}",
+                            "<b>" + spec[1] + "</b>: %{y:" + spec[2] + "}",
+                            "<b>Daily Confirmed</b>: %{customdata:,}",
+                            "<extra></extra>"].join("<br>"),
+            line: {color: "#FF00FF", width: 3},
+            mode: "lines",
+            name: spec[0],
+            y: lineValues,
+            type: "scatter"
+        };
+        // Lines that are not daily confirmed cases get their own right axis
+        if (spec[3]) {
+            lineTrace.yaxis = "y2";
+            layout.yaxis2 = Object.assign(axis(spec[3]), {overlaying: "y", showgrid: false, side: "right"});
+            layout.margin = {r: 60};
+        }
+        return {
+            data: [Object.assign({
+                customdata: customdata,
+                hovertemplate: ["<b>" + country + "</b>",
+                                "Date: %{x|%b %d, %Y}",
+                                "Daily Confirmed: %{y:,}",
+                                "Daily Deaths: %{customdata[0]:,}",
+                                "Total Confirmed: %{customdata[1]:,}",
+                                "Total Deaths: %{customdata[2]:,}",
+                                "<extra></extra>"].join("<br>"),
+                marker: {color: "orange"},
+                name: "Daily Confirmed Cases",
+                y: y,
+                type: "bar"
+            }, dateAxis(dates)), Object.assign(lineTrace, dateAxis(dates))],
+            layout: layout
+        };
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        country: {
+            // Same eight outputs as the server-side country callback
+            figures: function(country, line, url) {
+                if (!country || !url) {
+                    return window.dash_clientside.no_update;
+                }
+                return loadBundle(url).then(function(bundle) {
+                    var entry = bundle.countries[country];
+                    if (!bundle.lines[line]) {
+                        line = "rolling7_confirmed";
+                    }
+                    var today = entry.new[0];
+                    var yesterday = entry.new[1];
+                    return [
+                        "New Cases: " + bundle.last_update,
+                        makeKpi(today[0], yesterday[0], "orange", "<b>New Confirmed</b>"),
+                        makeKpi(today[1], yesterday[1], "#dd1e35", "<b>New Deaths</b>"),
+                        makeKpi(today[2], yesterday[2], "#7CFC00", "<b>New Recovered</b>"),
+                        makeKpi(today[3], yesterday[3], "#e55467", "<b>New Active</b>"),
+                        makePieChart(country, entry.totals, ["orange", "#dd1e35", "#7CFC00", "#e55467"]),
+                        makeBarLineChart(country, line, bundle, entry),
+                        entry.view
+                    ];
+                });
+            }
+        }
+    });
+})();
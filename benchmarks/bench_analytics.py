@@ -0,0 +1,91 @@
+######################################
+# Analytics benchmark
+#
+# Checks the analytics of engine.derive_series (rolling means, week-over-
+# week growth, doubling time, case fatality ratio) for every country and
+# the global totals against the same series computed per country with
+# pandas, and times the one vectorized pass at load time against that
+# per-country pandas loop. Then times the country callback for every
+# line series of the bar and line chart, which only slices the arrays.
+#
+#   python benchmarks/bench_analytics.py [directory of CSSE CSVs]
+######################################
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from fixture import ROOT, write_fixture
+
+
+def best_ms(function, repeat = 3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+# The analytics of one country (or the global totals) with pandas
+def pandas_series(frame, engine):
+    series = {}
+    for name in engine.METRICS:
+        daily = frame[name].diff().fillna(0)
+        series[f"daily_{name}"] = daily
+        for window in engine.WINDOWS:
+            series[f"rolling{window}_{name}"] = daily.rolling(window).mean()
+    for name in ["confirmed", "deaths"]:
+        mean = series[f"rolling{engine.WINDOWS[0]}_{name}"]
+        before = mean.shift(engine.LAG)
+        series[f"growth_{name}"] = (mean / before.where(before > 0) - 1) * 100
+    confirmed = frame["confirmed"].astype(float)
+    before = confirmed.shift(engine.LAG)
+    grew = (before > 0) & (confirmed > before)
+    series["doubling_time"] = (engine.LAG * np.log(2) / np.log(confirmed / before)).where(grew)
+    series["cfr"] = frame["deaths"] / confirmed.where(confirmed > 0) * 100
+    return series
+
+
+def pandas_all(covid_global, engine):
+    return {country: pandas_series(frame, engine) for country, frame in covid_global.groupby("Country/Region", observed = True)}
+
+
+def check(derived, row, expected, label):
+    for name, values in expected.items():
+        np.testing.assert_allclose(derived[name][row], values.to_numpy(dtype = np.float64), rtol = 1e-9, atol = 1e-9, err_msg = f"{label} {name}")
+
+
+if __name__ == "__main__":
+    tmp = tempfile.mkdtemp()
+    os.environ["COVID_DATA_SOURCE"] = sys.argv[1] if len(sys.argv) > 1 else write_fixture(os.path.join(tmp, "fixture"))
+    os.environ["COVID_SNAPSHOT_DIR"] = os.path.join(tmp, "snapshot")
+    os.environ["COVID_REFRESH_INTERVAL"] = "0"
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    import app
+    import engine
+
+    dataset = app.data.current()
+    expected = pandas_all(dataset.covid_global, engine)
+    for row, country in enumerate(dataset.country_list):
+        check(dataset.derived, row, expected[country], country)
+    check(dataset.global_derived, 0, pandas_series(dataset.daily_cum_global, engine), "global")
+    n_countries, n_days = dataset.arrays["confirmed"].shape
+    analytics = [name for name in dataset.derived if name != "rolling_average"]
+    print(f"{len(analytics)} series match pandas for all {n_countries} countries and the global totals ({n_days} days)")
+
+    vectorized_ms = best_ms(lambda: engine.derive_series(dataset.arrays))
+    pandas_ms = best_ms(lambda: pandas_all(dataset.covid_global, engine), repeat = 1)
+    size = sum(dataset.derived[name].nbytes for name in analytics)
+    print(f"derive_series, all countries:   {vectorized_ms:8.1f} ms   ({size / 1e6:.1f} MB of arrays)")
+    print(f"pandas, country by country:     {pandas_ms:8.1f} ms")
+
+    countries = list(dataset.country_list)
+    print("country callback without the figure cache, per line series:")
+    for line, (name, _, _, _) in app.LINE_SERIES.items():
+        ms = best_ms(lambda: [app.build_country_response(dataset, country, line) for country in countries], repeat = 2) / len(countries)
+        print(f"  {name:60s} {ms:7.3f} ms")
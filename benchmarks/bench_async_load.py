@@ -0,0 +1,107 @@
+######################################
+# Asynchronous loading benchmark
+#
+# Starts gunicorn on a cold snapshot directory (the full ETL runs at
+# boot), with the data loaded at import and with COVID_ASYNC_LOAD=1,
+# and polls /healthz to time the first answered request and the first
+# request with the dataset loaded, in one worker and in all of them
+# (each worker loads its own). Checks that the async workers answer
+# 503 and serve the warming up layout until the dataset is ready, then
+# 200 with the full layout.
+#
+#   python benchmarks/bench_async_load.py [--source DIR] [--workers N]
+######################################
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+from fixture import ROOT, write_fixture
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# (status, JSON body) of a GET, or None while nothing accepts the connection
+def get(url):
+    try:
+        with urllib.request.urlopen(url, timeout = 5) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+    except (urllib.error.URLError, ConnectionError):
+        return None
+
+
+def run(env, workers, timeout = 300):
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "app:server", "--bind", f"127.0.0.1:{port}", "--workers", str(workers), "--timeout", "600"],
+        cwd = ROOT,
+        env = {**os.environ, "COVID_REFRESH_INTERVAL": "0", **env},
+        stdout = subprocess.DEVNULL,
+        stderr = subprocess.DEVNULL,
+    )
+    start = time.perf_counter()
+    first = ready = everywhere = None
+    warming = []
+    try:
+        while time.perf_counter() - start < timeout:
+            answer = get(f"{base}/healthz")
+            if answer is not None:
+                status, body = answer
+                if first is None:
+                    first = time.perf_counter() - start
+                if status == 200:
+                    ready = time.perf_counter() - start
+                    break
+                assert status == 503 and not body["loaded"], answer
+                if not warming:
+                    warming = get(f"{base}/_dash-layout")[1]["props"]["children"]
+            time.sleep(0.05)
+        assert ready is not None, "not ready in time"
+        # Every worker loads on its own: wait until a run of requests only gets loaded ones
+        loaded = 0
+        while loaded < 4 * workers and time.perf_counter() - start < timeout:
+            ids = {child["props"].get("id") for child in get(f"{base}/_dash-layout")[1]["props"]["children"]}
+            status, body = get(f"{base}/healthz")
+            loaded = loaded + 1 if "warming-up" not in ids and status == 200 else 0
+        everywhere = time.perf_counter() - start
+    finally:
+        process.terminate()
+        process.wait()
+    return first, ready, everywhere, warming, body
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Time to first request and to a loaded dataset under gunicorn.")
+    parser.add_argument("--source", help = "directory of CSSE CSVs (default: a generated fixture)")
+    parser.add_argument("--workers", type = int, default = 2)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        source = args.source or write_fixture(os.path.join(tmp, "fixture"))
+        print(f"gunicorn, {args.workers} workers, cold start (no snapshot)")
+        print(f"{'':12s} {'first answer':>14s} {'first loaded':>14s} {'all loaded':>12s}")
+        for name, extra in (("at import", {}), ("async", {"COVID_ASYNC_LOAD": "1"})):
+            env = {"COVID_DATA_SOURCE": source, "COVID_SNAPSHOT_DIR": os.path.join(tmp, f"snapshot-{name}"), **extra}
+            first, ready, everywhere, warming, status = run(env, args.workers)
+            print(f"{name:12s} {first * 1000:11.0f} ms {ready * 1000:11.0f} ms {everywhere * 1000:9.0f} ms")
+            if extra:
+                assert warming and {child["props"].get("id") for child in warming} >= {"warming-up", "healthz-url"}, warming
+        print(f"/healthz once loaded: {json.dumps(status)}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors = True)
@@ -0,0 +1,61 @@
+######################################
+# Data cleaning benchmark
+#
+# Times the original row-by-row cleaning loops against
+# cleaning.clean_locations and checks both give the same covid_global.
+#
+#   python benchmarks/bench_cleaning.py [directory of CSSE CSVs]
+######################################
+
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from fixture import ROOT, write_fixture
+
+sys.path.insert(0, ROOT)
+import cleaning
+import data
+
+
+# The cleaning step as it was written before the cleaning tables
+def clean_locations_loop(covid_merge):
+    change_country_region = covid_merge[covid_merge["Province/State"].notnull()]
+    for index, row in change_country_region.iterrows():
+        if row["Province/State"] in ["Diamond Princess", "Grand Princess", "Tibet"]:
+            covid_merge['Country/Region'].at[index] = row["Province/State"] # update the row in the dataframe
+        elif row["Country/Region"] in ["Denmark", "France", "Netherlands", "New Zealand", "United Kingdom"]:
+            covid_merge['Country/Region'].at[index] = row["Province/State"] # update the row in the dataframe
+    covid_merge["Country/Region"] = covid_merge["Country/Region"].replace(cleaning.replace_names)
+    for country in ["Canada", "China"]:
+        country_df = covid_merge.loc[covid_merge["Country/Region"] == country]
+        lat_mean = country_df['Lat'].mean()
+        long_mean = country_df['Long'].mean()
+        for index in country_df.loc[pd.isna(country_df["Lat"]), :].index:
+            covid_merge.loc[index, "Lat"] = lat_mean
+            covid_merge.loc[index, "Long"] = long_mean
+
+    return covid_merge
+
+
+def timed(function, covid_merge):
+    covid_merge = covid_merge.copy()
+    start = time.perf_counter()
+    function(covid_merge)
+    return time.perf_counter() - start, data.aggregate_frames(covid_merge)["covid_global"]
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else write_fixture(os.path.join(tempfile.mkdtemp(), "fixture"))
+    covid_merge = data.merge_frames(*data.melt_frames(*data.read_sources(source)))
+    print(f"covid_merge: {len(covid_merge):,} rows")
+
+    loop_time, expected = timed(clean_locations_loop, covid_merge)
+    vector_time, result = timed(cleaning.clean_locations, covid_merge)
+    pd.testing.assert_frame_equal(result, expected, check_exact = True)
+
+    print(f"row loop:   {loop_time * 1000:9.1f} ms")
+    print(f"vectorized: {vector_time * 1000:9.1f} ms  ({loop_time / vector_time:.0f}x faster, identical covid_global)")
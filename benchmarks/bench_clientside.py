@@ -0,0 +1,143 @@
+######################################
+# Clientside country figures benchmark
+#
+# Checks the per-country bundle (Brotli or gzip, immutable caching) and, when
+# node is available, that assets/country_figures.js builds the same
+# eight outputs as the server-side callback for every country and line
+# series of the bar and line chart. Then
+# compares the interaction latency: a local HTTP load test of the
+# server-side callback (with and without the figure cache) against the
+# clientside figures, which cost the server nothing per interaction.
+#
+#   python benchmarks/bench_clientside.py [directory of CSSE CSVs] [--requests N] [--concurrency N]
+######################################
+
+import argparse
+import gzip
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import brotli
+import numpy as np
+import requests
+from plotly.io.json import to_json_plotly
+
+from dash_client import update_requests
+from fixture import ROOT, write_fixture
+from http_load import run_load, start_server, stop_server, summary
+
+# Stub browser: load the asset, serve fetch() from the bundle file and time every country
+# and line series of the bar and line chart
+NODE_HARNESS = """
+const fs = require("fs");
+const [script, bundlePath, outputPath] = process.argv.slice(-3);
+global.window = {dash_clientside: {no_update: null}};
+global.fetch = (url) => Promise.resolve({ok: true, json: () => Promise.resolve(JSON.parse(fs.readFileSync(bundlePath)))});
+eval(fs.readFileSync(script, "utf8"));
+(async () => {
+    const bundle = JSON.parse(fs.readFileSync(bundlePath));
+    const figures = window.dash_clientside.country.figures;
+    await figures(Object.keys(bundle.countries)[0], "rolling7_confirmed", "bundle");
+    const results = {};
+    const times = [];
+    for (const country of Object.keys(bundle.countries)) {
+        results[country] = {};
+        for (const line of Object.keys(bundle.lines)) {
+            const start = process.hrtime.bigint();
+            results[country][line] = await figures(country, line, "bundle");
+            times.push(Number(process.hrtime.bigint() - start) / 1e6);
+        }
+    }
+    fs.writeFileSync(outputPath, JSON.stringify({results: results, times: times}));
+})();
+"""
+
+
+# Equal up to float rounding, with the dates of the bundle ("2022-03-10") and NaN as null
+def compare(got, expected, path = ""):
+    if isinstance(expected, dict):
+        assert isinstance(got, dict) and set(got) == set(expected), (path, set(got) ^ set(expected))
+        for key in expected:
+            compare(got[key], expected[key], f"{path}/{key}")
+    elif isinstance(expected, list):
+        assert isinstance(got, list) and len(got) == len(expected), (path, len(got), len(expected))
+        for i, (a, b) in enumerate(zip(got, expected)):
+            compare(a, b, f"{path}[{i}]")
+    elif isinstance(expected, float):
+        assert got is not None and math.isclose(got, expected, rel_tol = 1e-12, abs_tol = 1e-9), (path, got, expected)
+    elif isinstance(expected, str) and expected.endswith("T00:00:00"):
+        assert got == expected[:-len("T00:00:00")], (path, got, expected)
+    else:
+        assert got == expected, (path, got, expected)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Compare server-side and clientside country figures.")
+    parser.add_argument("source", nargs = "?")
+    parser.add_argument("--requests", type = int, default = 500)
+    parser.add_argument("--concurrency", type = int, default = 8)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        source = args.source or write_fixture(os.path.join(tmp, "fixture"))
+        env = {"COVID_DATA_SOURCE": source, "COVID_SNAPSHOT_DIR": os.path.join(tmp, "snapshot")}
+        os.environ.update(env, COVID_CLIENTSIDE_FIGURES = "1", COVID_REFRESH_INTERVAL = "0")
+        sys.path.insert(0, ROOT)
+        os.chdir(ROOT)
+        import app
+
+        dataset = app.data.current()
+        countries = list(dataset.country_list)
+        client = app.server.test_client()
+        layout = client.get("/_dash-layout").get_data(as_text = True)
+        url = f"/country-bundle/{dataset.version}.json"
+        assert url in layout
+        response = client.get(url, headers = {"Accept-Encoding": "gzip, deflate, br"})
+        assert response.headers["Content-Encoding"] == "br"
+        assert "immutable" in response.headers["Cache-Control"]
+        raw = brotli.decompress(response.data)
+        gzipped = client.get(url, headers = {"Accept-Encoding": "gzip"})
+        assert gzipped.headers["Content-Encoding"] == "gzip" and gzip.decompress(gzipped.data) == raw
+        assert client.get(url).data == raw
+        assert client.get("/country-bundle/unknown.json").status_code == 404
+        print(f"bundle: {len(raw):,} bytes, {len(response.data):,} with Brotli, {len(gzipped.data):,} gzipped, for {len(countries)} countries")
+
+        node = shutil.which("node")
+        if node:
+            bundle_path = os.path.join(tmp, "bundle.json")
+            output_path = os.path.join(tmp, "figures.json")
+            with open(bundle_path, "wb") as f:
+                f.write(raw)
+            subprocess.run([node, "-e", NODE_HARNESS, os.path.join(ROOT, "assets", "country_figures.js"), bundle_path, output_path], check = True)
+            with open(output_path) as f:
+                output = json.load(f)
+            for country in countries:
+                for line in app.LINE_SERIES:
+                    expected = json.loads(to_json_plotly(app.build_country_response(dataset, country, line)))
+                    compare(output["results"][country][line], expected, f"{country}/{line}")
+            times = np.array(output["times"])
+            print(f"clientside figures match the server for all {len(countries)} countries and {len(app.LINE_SERIES)} line series")
+            print(f"clientside, per interaction (node):  p50 {np.percentile(times, 50):7.2f} ms   p95 {np.percentile(times, 95):7.2f} ms   server CPU 0")
+        else:
+            print("node not found: skipping the clientside figure check")
+
+        random.seed(0)
+        choices = [random.choice(countries) for _ in range(args.requests)]
+        for label, extra in (("server, figure cache", {}), ("server, no cache", {"COVID_FIGURE_CACHE_SIZE": "0"})):
+            process, base_url = start_server(dict(env, COVID_CLIENTSIDE_FIGURES = "0", **extra))
+            try:
+                dependencies = requests.get(f"{base_url}/_dash-dependencies").json()
+                bodies = [body for country in choices for body in update_requests(dependencies, "country-dropdown", "value", country)]
+                latencies, cpu = run_load(process, base_url, bodies, args.concurrency)
+            finally:
+                stop_server(process)
+            print(f"{label + ', HTTP':34s}   {summary(latencies)}   server CPU {cpu / len(bodies) * 1000:6.2f} ms/interaction")
+    finally:
+        shutil.rmtree(tmp, ignore_errors = True)
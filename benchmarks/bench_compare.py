@@ -0,0 +1,71 @@
+######################################
+# Country comparison benchmark
+#
+# Latency of the comparison callback for 1, 10 and all countries, for
+# the slice of the dense (countries, days) matrix alone, the whole
+# callback in process and over HTTP (with response sizes), next to the
+# per-country frame filters the matrix replaces. Also checks that the
+# plotted series match the per-country series of the country callback.
+#
+#   python benchmarks/bench_compare.py [directory of CSSE CSVs]
+######################################
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from dash_client import update_requests
+from fixture import ROOT, write_fixture
+
+
+def best_ms(function, repeat = 5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+if __name__ == "__main__":
+    tmp = tempfile.mkdtemp()
+    os.environ["COVID_DATA_SOURCE"] = sys.argv[1] if len(sys.argv) > 1 else write_fixture(os.path.join(tmp, "fixture"))
+    os.environ["COVID_SNAPSHOT_DIR"] = os.path.join(tmp, "snapshot")
+    os.environ["COVID_REFRESH_INTERVAL"] = "0"
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    import app
+
+    dataset = app.data.current()
+    countries = list(dataset.country_list)
+    random.seed(0)
+    selections = {"1 country": random.sample(countries, 1), "10 countries": random.sample(countries, 10), f"all {len(countries)}": countries}
+
+    # Same values as the per-country series, and per area where area.csv has the country
+    confirmed, deaths = app.build_compare_response(dataset, selections["10 countries"])
+    for trace in confirmed["data"]:
+        assert list(trace["y"]) == list(dataset.country_series[trace["name"]]["daily_confirmed"][-365:])
+    areas = app.data.read_areas()
+    for trace in app.build_compare_response(dataset, selections["10 countries"], "area")[0]["data"]:
+        expected = dataset.country_series[trace["name"]]["daily_confirmed"][-365:] / areas.get(trace["name"], np.nan) * 1000
+        np.testing.assert_allclose(trace["y"], expected, atol = 5e-4)
+
+    covid_global = dataset.covid_global
+    client = app.server.test_client()
+    dependencies = client.get("/_dash-dependencies").get_json()
+    print(f"{'':16s} {'matrix slice':>14s} {'frame filters':>14s} {'callback':>12s} {'HTTP':>12s} {'response':>14s}")
+    for label, selection in selections.items():
+        rows = dataset.country_index.get_indexer(selection)
+        matrix = dataset.derived["daily_confirmed"]
+        slice_ms = best_ms(lambda: (matrix[rows, -365:], dataset.derived["daily_deaths"][rows, -365:]))
+        filter_ms = best_ms(lambda: [covid_global.loc[covid_global["Country/Region"] == country, ["confirmed", "deaths"]].diff().tail(365) for country in selection], repeat = 2)
+        callback_ms = best_ms(lambda: app.compare_countries(selection, "cases"))
+        bodies = [json.dumps(body) for body in update_requests(dependencies, "compare-dropdown", "value", selection, {("compare-scale", "value"): "cases"})]
+        http_ms = best_ms(lambda: [client.post("/_dash-update-component", data = body, content_type = "application/json") for body in bodies])
+        size = sum(len(client.post("/_dash-update-component", data = body, content_type = "application/json").data) for body in bodies)
+        print(f"{label:16s} {slice_ms:11.3f} ms {filter_ms:11.3f} ms {callback_ms:9.2f} ms {http_ms:9.2f} ms {size:11,} B")
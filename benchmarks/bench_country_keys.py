@@ -0,0 +1,50 @@
+######################################
+# Country key benchmark
+#
+# Memory of covid_global and the time of the usual per-country
+# operations (groupby, equality filter) with Country/Region as plain
+# strings against the int-coded categorical the ETL now produces.
+#
+#   python benchmarks/bench_country_keys.py [directory of CSSE CSVs]
+######################################
+
+import os
+import sys
+import tempfile
+import time
+
+from fixture import ROOT, write_fixture
+
+sys.path.insert(0, ROOT)
+import data
+
+
+def best_of(function, repeat = 5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def measure(covid_global, country):
+    return {
+        "memory": covid_global.memory_usage(deep = True).sum() / 2 ** 20,
+        "groupby": best_of(lambda: covid_global.groupby("Country/Region", observed = True)[["confirmed", "deaths"]].sum()),
+        "groupby date": best_of(lambda: covid_global.groupby(["date", "Country/Region"], observed = True)["confirmed"].sum()),
+        "filter": best_of(lambda: covid_global.loc[covid_global["Country/Region"] == country]),
+    }
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else write_fixture(os.path.join(tempfile.mkdtemp(), "fixture"))
+    covid_global = data.build_frames(*data.read_sources(source))["covid_global"]
+    strings = covid_global.astype({"Country/Region": object})
+    country = covid_global["Country/Region"].iloc[-1]
+    results = {"object": measure(strings, country), "categorical": measure(covid_global, country)}
+
+    print(f"covid_global Country/Region codes: {covid_global['Country/Region'].cat.codes.dtype}")
+    print(f"{'':18s} {'object':>10s} {'categorical':>12s}")
+    for name, unit in (("memory", "MiB"), ("groupby", "ms"), ("groupby date", "ms"), ("filter", "ms")):
+        print(f"{name + ' (' + unit + ')':18s} {results['object'][name]:10.1f} {results['categorical'][name]:12.1f}")
@@ -0,0 +1,69 @@
+######################################
+# Country callback benchmark
+#
+# Latency of country_kpi for every country in country_list, plus the
+# data preparation part on its own: the boolean scan over covid_global
+# that the callback used to do against the country_series index.
+#
+#   python benchmarks/bench_country_kpi.py [directory of CSSE CSVs]
+######################################
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from fixture import ROOT, write_fixture
+
+tmp = tempfile.mkdtemp()
+os.environ["COVID_DATA_SOURCE"] = sys.argv[1] if len(sys.argv) > 1 else write_fixture(os.path.join(tmp, "fixture"))
+os.environ["COVID_SNAPSHOT_DIR"] = os.path.join(tmp, "snapshot")
+sys.path.insert(0, ROOT)
+import app
+
+
+# Data preparation as the callback did it before the index
+def prepare_scan(country):
+    covid_global = app.data.current().covid_global
+    country_data = covid_global[covid_global["Country/Region"] == country]
+    country_data["confirmed"].iloc[-1] - country_data["confirmed"].iloc[-2]
+    country_daily_data = country_data.loc[:, ["Country/Region", "date", "confirmed", "deaths"]]
+    country_daily_data["daily_confirmed"] = country_daily_data["confirmed"] - country_daily_data["confirmed"].shift(1)
+    country_daily_data["daily_confirmed"] = country_daily_data["daily_confirmed"].fillna(0)
+    country_daily_data["daily_confirmed"] = country_daily_data["daily_confirmed"].astype(int)
+    country_daily_data["daily_deaths"] = country_daily_data["deaths"] - country_daily_data["deaths"].shift(1)
+    country_daily_data["daily_deaths"] = country_daily_data["daily_deaths"].fillna(0)
+    country_daily_data["daily_deaths"] = country_daily_data["daily_deaths"].astype(int)
+    country_daily_data["rolling_average"] = country_daily_data["daily_confirmed"].rolling(window = 7).mean()
+    return country_daily_data.tail(365)
+
+
+# Data preparation with the index
+def prepare_index(country):
+    series = app.data.current().country_series[country]
+    series["daily_confirmed"][-1]
+    last_year = slice(-365, None)
+    return series["daily_confirmed"][last_year], series["rolling_average"][last_year]
+
+
+def latencies(function):
+    timings = []
+    for country in app.data.current().country_list:
+        start = time.perf_counter()
+        function(country)
+        timings.append(time.perf_counter() - start)
+    return np.array(timings) * 1000
+
+
+def report(name, timings):
+    print(f"{name:22s} mean {timings.mean():8.3f} ms   p50 {np.percentile(timings, 50):8.3f}   p95 {np.percentile(timings, 95):8.3f}   max {timings.max():8.3f}")
+
+
+if __name__ == "__main__":
+    dataset = app.data.current()
+    print(f"{len(dataset.country_list)} countries, {len(dataset.covid_global):,} rows in covid_global")
+    report("prepare: scan", latencies(prepare_scan))
+    report("prepare: index", latencies(prepare_index))
+    report("country_kpi", latencies(app.country_kpi))
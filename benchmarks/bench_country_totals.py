@@ -0,0 +1,56 @@
+######################################
+# Country totals lookup benchmark
+#
+# Country totals of one day: the old scan of covid_global (comparing the
+# date column with the formatted "March 09, 2023" string, or with a
+# Timestamp) against Dataset.country_totals(), which slices the dense
+# per-date index. Checks that all three return the same rows.
+#
+#   python benchmarks/bench_country_totals.py [directory of CSSE CSVs]
+######################################
+
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from fixture import ROOT, write_fixture
+
+sys.path.insert(0, ROOT)
+import data
+
+
+def best_of(function, repeat = 20):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else write_fixture(os.path.join(tempfile.mkdtemp(), "fixture"))
+    frames = data.build_frames(*data.read_sources(source))
+    dataset = data.Dataset(frames, {"version": data.make_version(frames)})
+    covid_global = dataset.covid_global
+    dates = dataset.arrays["dates"]
+
+    for date in (dates[0], dates[len(dates) // 2], dates[-1]):
+        label = date.strftime("%B %d, %Y")
+        expected = covid_global.loc[covid_global["date"] == label].reset_index(drop = True)
+        pd.testing.assert_frame_equal(dataset.country_totals(date), expected)
+    pd.testing.assert_frame_equal(dataset.country_totals(), dataset.country_totals(dates[-1]))
+
+    date = dates[len(dates) // 2]
+    label = date.strftime("%B %d, %Y")
+    results = {
+        "scan, string date": best_of(lambda: covid_global.loc[covid_global["date"] == label]),
+        "scan, Timestamp": best_of(lambda: covid_global.loc[covid_global["date"] == date]),
+        "per-date index": best_of(lambda: dataset.country_totals(date)),
+    }
+    for name, elapsed in results.items():
+        print(f"{name:18s}: {elapsed:8.3f} ms")
+    print("country_totals() matches the scan")
@@ -0,0 +1,91 @@
+######################################
+# Dataset lookups and memory benchmark
+#
+# Checks the map view of every country (zoom from area.csv, location of
+# the latest day) found through the dataset's country rows and arrays
+# against the old area.csv scan and per-country location dict, times
+# both, checks that the Dataset (attributes, dicts and arrays) is
+# read-only, and prints the bytes held by each of its attributes
+# (Dataset.nbytes).
+#
+#   python benchmarks/bench_dataset.py [directory of CSSE CSVs]
+######################################
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from fixture import ROOT, write_fixture
+
+
+def best_ms(function, repeat = 5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+# The map view as computed before the indexed arrays: a scan of area.csv and a dict of locations
+def scan_map_view(area_df, locations, country):
+    if country in area_df.country.to_list():
+        area = area_df.loc[area_df.country == country, "areasqmi"].values[0]
+        zoom = 7 + (3 - 7) / (3800000 - 8900) * (area - 8900)
+    else:
+        zoom = 7
+    return {"zoom": zoom, "lat": locations[country]["Lat"], "lon": locations[country]["Long"]}
+
+
+if __name__ == "__main__":
+    tmp = tempfile.mkdtemp()
+    os.environ["COVID_DATA_SOURCE"] = sys.argv[1] if len(sys.argv) > 1 else write_fixture(os.path.join(tmp, "fixture"))
+    os.environ["COVID_SNAPSHOT_DIR"] = os.path.join(tmp, "snapshot")
+    os.environ["COVID_REFRESH_INTERVAL"] = "0"
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    import app
+
+    dataset = app.data.current()
+    countries = list(dataset.country_list)
+    area_df = pd.read_csv(os.path.join(ROOT, "area.csv"))
+    locations = dataset.country_totals_df.set_index("Country/Region")[["Lat", "Long"]].T.to_dict("dict")
+    for country in countries:
+        expected = scan_map_view(area_df, locations, country)
+        view = app.make_map_view(dataset, country)
+        assert view.keys() == expected.keys() and np.allclose(list(view.values()), list(expected.values()), rtol = 1e-12, equal_nan = True), (country, view, expected)
+
+    # Read-only: no attribute can be set again or deleted, no dict changed, no array written
+    for attempt in (lambda: setattr(dataset, "version", "x"), lambda: setattr(dataset, "other", 1), lambda: delattr(dataset, "version")):
+        try:
+            attempt()
+        except AttributeError:
+            pass
+        else:
+            raise AssertionError("Dataset attribute was set or deleted")
+    for mapping in (dataset.arrays, dataset.derived, dataset.global_derived, dataset.tot_global, dataset.new_global,
+                    dataset.pct_change, dataset.country_rows, dataset.country_series, dataset.country_series[countries[0]]):
+        try:
+            mapping["confirmed"] = None
+        except TypeError:
+            pass
+        else:
+            raise AssertionError("Dataset dict was changed")
+    assert isinstance(dataset.iso_dates, tuple)
+    for values in (dataset.arrays["confirmed"], dataset.derived["cfr"], dataset.country_series[countries[0]]["daily_deaths"], dataset.areas):
+        assert not values.flags.writeable
+
+    scan_ms = best_ms(lambda: [scan_map_view(area_df, locations, country) for country in countries])
+    indexed_ms = best_ms(lambda: [app.make_map_view(dataset, country) for country in countries])
+    print(f"map view of all {len(countries)} countries: area.csv scan {scan_ms:7.2f} ms   indexed arrays {indexed_ms:6.2f} ms")
+
+    sizes = dataset.nbytes()
+    print("Dataset memory")
+    for name, size in sorted(sizes.items(), key = lambda item: -item[1]):
+        if size:
+            print(f"  {name:24s} {size / 1e6:9.2f} MB")
+    print(f"  {'total':24s} {sum(sizes.values()) / 1e6:9.2f} MB")
@@ -0,0 +1,111 @@
+######################################
+# Downsampling benchmark
+#
+# Bytes and latency of the bar and line chart for every date range and
+# for zooms, with the weekly / monthly buckets and LTTB lines against
+# the same charts day by day (downsampling off). Checks the bucketed
+# bars against the daily values, that no chart sends more than
+# MAX_POINTS bars or line points, and that the date range, line series
+# and zoom requests only send the chart over HTTP.
+#
+#   python benchmarks/bench_downsample.py [directory of CSSE CSVs]
+######################################
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+import brotli
+import numpy as np
+from plotly.io.json import to_json_plotly
+
+from dash_client import update_requests
+from fixture import ROOT, write_fixture
+
+
+def best_ms(function, repeat = 5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def sizes(figure):
+    raw = to_json_plotly(figure).encode()
+    return len(raw), len(brotli.compress(raw, quality = 4))
+
+
+if __name__ == "__main__":
+    tmp = tempfile.mkdtemp()
+    os.environ["COVID_DATA_SOURCE"] = sys.argv[1] if len(sys.argv) > 1 else write_fixture(os.path.join(tmp, "fixture"))
+    os.environ["COVID_SNAPSHOT_DIR"] = os.path.join(tmp, "snapshot")
+    os.environ["COVID_REFRESH_INTERVAL"] = "0"
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    import app
+    import downsample
+
+    dataset = app.data.current()
+    country = dataset.country_totals_df.nlargest(1, "confirmed")["Country/Region"].iloc[0]
+    series = dataset.country_series[country]
+    max_points = downsample.MAX_POINTS
+    dates = dataset.arrays["dates"]
+    views = {f"range {date_range}": app.range_days(dataset, date_range)[0] for date_range in app.DATE_RANGES}
+    views["zoom 120 days"] = app.zoom_days(dataset, {"xaxis.range[0]": f"{dates[-300]:%Y-%m-%d}", "xaxis.range[1]": f"{dates[-181]:%Y-%m-%d}"})
+    views["zoom 600 days"] = app.zoom_days(dataset, {"xaxis.range": [f"{dates[-700]:%Y-%m-%d} 06:00", f"{dates[-101]:%Y-%m-%d} 18:00"]})
+
+    # Bucketed bars against the daily values, and the bounds
+    for label, days in views.items():
+        bucket, bars, points = app.bar_line_points(dataset, series, "doubling_time", days)
+        n_bars = len(bars["y"])
+        assert n_bars <= max_points and len(points["y"]) <= max_points, (label, n_bars, len(points["y"]))
+        if bucket[0] != "day":
+            _, starts = downsample.buckets(dates[days], max_points)
+            counts = np.diff(np.r_[starts, days.stop - days.start])
+            np.testing.assert_allclose(bars["y"] * counts, np.add.reduceat(series["daily_confirmed"][days], starts), atol = 0.005 * counts.max())
+            ends = np.r_[starts[1:], days.stop - days.start] - 1
+            assert list(bars["customdata"][:, 1]) == list(series["confirmed"][days][ends])
+            kept = [dataset.iso_dates.index(day) for day in points["x"]]
+            assert kept[0] == days.start and kept[-1] == days.stop - 1
+            np.testing.assert_array_equal(points["y"], np.round(series["doubling_time"][kept], 2))
+
+    print(f"{country}, at most {max_points} points per trace")
+    print(f"{'':16s} {'days':>6s} {'bucket':>8s} {'bars':>6s} {'line':>6s} {'bytes':>9s} {'br':>8s} {'build':>9s}   {'day by day':>10s} {'br':>8s} {'build':>9s}")
+    for label, days in views.items():
+        build = lambda: app.build_bar_line_chart(dataset, country, "rolling7_confirmed", days)
+        figure = build()
+        size, br = sizes(figure)
+        ms = best_ms(lambda: to_json_plotly(build()))
+        bucket = app.bar_line_points(dataset, series, "rolling7_confirmed", days)[0][0]
+        downsample.MAX_POINTS = 10 ** 9
+        daily_size, daily_br = sizes(build())
+        daily_ms = best_ms(lambda: to_json_plotly(build()))
+        downsample.MAX_POINTS = max_points
+        print(f"{label:16s} {days.stop - days.start:6d} {bucket:>8s} {len(figure['data'][0]['y']):6d} {len(figure['data'][1]['y']):6d} "
+              f"{size:9,} {br:8,} {ms:6.2f} ms   {daily_size:10,} {daily_br:8,} {daily_ms:6.2f} ms")
+
+    # Over HTTP: a new date range, line series or zoom only sends the chart
+    app.figure_cache.clear()
+    client = app.server.test_client()
+    dependencies = client.get("/_dash-dependencies").get_json()
+    state = {("country-dropdown", "value"): country, ("bar-line-series", "value"): "rolling7_confirmed", ("bar-line-range", "value"): "365"}
+    post = lambda body: client.post("/_dash-update-component", data = json.dumps(body), content_type = "application/json")
+    requests = {
+        "country": ("country-dropdown", "value", country),
+        "range all": ("bar-line-range", "value", "all"),
+        "line series": ("bar-line-series", "value", "cfr"),
+        "zoom": ("bar-line-chart", "relayoutData", {"xaxis.range[0]": f"{dates[-300]:%Y-%m-%d}", "xaxis.range[1]": f"{dates[-181]:%Y-%m-%d}"}),
+        "zoom reset": ("bar-line-chart", "relayoutData", {"xaxis.autorange": True}),
+    }
+    for label, (component, prop, value) in requests.items():
+        [body] = update_requests(dependencies, component, prop, value, state)
+        response = post(body)
+        outputs = set(response.get_json()["response"])
+        assert len(outputs) == 8 if label == "country" else outputs == {"bar-line-chart"}, (label, outputs)
+        print(f"{label:16s} {len(response.data):9,} bytes   {best_ms(lambda: post(body)):6.2f} ms   outputs: {len(outputs)}")
+    [body] = update_requests(dependencies, "bar-line-chart", "relayoutData", {"autosize": True}, state)
+    assert post(body).status_code == 204
@@ -0,0 +1,57 @@
+######################################
+# ETL engine benchmark
+#
+# Build time and peak traced memory of the long (melt + merge) pipeline
+# against the wide-array engine, starting from the same raw frames.
+#
+#   python benchmarks/bench_engine.py [directory of CSSE CSVs]
+######################################
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from fixture import ROOT, write_fixture
+
+sys.path.insert(0, ROOT)
+import data
+import engine as wide_engine
+
+
+def run(sources, engine):
+    if engine == "wide arrays":
+        # The country arrays alone, before covid_global is materialized
+        return wide_engine.group_countries(*wide_engine.align_sources(*sources))
+    return data.build_frames(*sources, engine = engine)
+
+
+# Time without tracing, then trace a second run for the peak
+def measure(sources, engine):
+    start = time.perf_counter()
+    frames = run(sources, engine)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    run(sources, engine)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, frames
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else write_fixture(os.path.join(tempfile.mkdtemp(), "fixture"))
+    sources = data.read_sources(source)
+    results = {engine: measure(sources, engine) for engine in ("long", "wide", "wide arrays")}
+    for name in data.FRAME_NAMES:
+        pd.testing.assert_frame_equal(results["wide"][2][name], results["long"][2][name], check_exact = False, rtol = 1e-12)
+
+    for engine, (elapsed, peak, frames) in results.items():
+        print(f"{engine:11s}: {elapsed * 1000:8.1f} ms   peak {peak / 2**20:7.1f} MiB")
+    long_time, long_peak = results["long"][:2]
+    wide_time, wide_peak = results["wide"][:2]
+    print(f"wide engine: {long_time / wide_time:.0f}x faster, {long_peak / wide_peak:.1f}x less peak memory, same frames")
+    arrays_time, arrays_peak = results["wide arrays"][:2]
+    print(f"wide arrays: {long_time / arrays_time:.0f}x faster, {long_peak / arrays_peak:.0f}x less peak memory")
@@ -0,0 +1,208 @@
+######################################
+# Fetch layer check and benchmark
+#
+# Serves the CSSE CSVs from a local HTTP stub (standing in for GitHub,
+# with ETag / Last-Modified support and injectable failures) and checks
+# the mirror: cold download, 304 revalidation, a single changed file,
+# retries on server errors, the fallback to the mirror when the server
+# is down and offline mode. Then times a refresh against an unchanged
+# upstream, and checks that a new day is picked up when its ingest
+# failed once after the download (the next fetch only gets 304s) and
+# when the mirror is updated by hand in offline mode. Exits non-zero on
+# any failure.
+#
+#   python benchmarks/bench_fetch.py [directory of CSSE CSVs]
+######################################
+
+import argparse
+import email.utils
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+from fixture import FILE_NAMES, ROOT, write_fixture
+
+sys.path.insert(0, ROOT)
+import data
+import fetch
+
+
+class StubHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            if server.failures > 0:
+                server.failures -= 1
+                server.statuses[503] += 1
+                self.send_error(503)
+                return
+        path = self.translate_path(self.path)
+        try:
+            with open(path, "rb") as f:
+                body = f.read()
+        except OSError:
+            self.send_error(404)
+            return
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        last_modified = email.utils.formatdate(os.path.getmtime(path), usegmt = True)
+        status = 304 if self.headers.get("If-None-Match") == etag else 200
+        with server.lock:
+            server.statuses[status] += 1
+        self.send_response(status)
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        if status == 304:
+            self.end_headers()
+            return
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_stub(directory):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), lambda *args: StubHandler(*args, directory = directory))
+    server.lock = threading.Lock()
+    server.failures = 0
+    server.statuses = Counter()
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server
+
+
+# Append one more day to the CSVs of a directory, repeating the last day's counts
+def add_day(directory):
+    for name in FILE_NAMES.values():
+        path = os.path.join(directory, name)
+        frame = pd.read_csv(path)
+        day = pd.Timestamp(frame.columns[-1]) + pd.Timedelta(days = 1)
+        frame[f"{day.month}/{day.day}/{day:%y}"] = frame[frame.columns[-1]]
+        frame.to_csv(path, index = False)
+    return day
+
+
+def same_files(source, mirror_dir):
+    for name in FILE_NAMES.values():
+        with open(os.path.join(source, name), "rb") as a, open(os.path.join(mirror_dir, name), "rb") as b:
+            assert a.read() == b.read(), name
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Check the fetch layer against a local HTTP stub.")
+    parser.add_argument("source", nargs = "?")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        upstream = os.path.join(tmp, "upstream")
+        if args.source:
+            shutil.copytree(args.source, upstream)
+        else:
+            write_fixture(upstream)
+        server = start_stub(upstream)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        urls = data.source_paths(base_url)
+        mirror_dir = os.path.join(tmp, "mirror")
+
+        # Cold mirror: everything is downloaded
+        start = time.perf_counter()
+        paths, changed = fetch.fetch_all(urls, mirror_dir)
+        cold_time = time.perf_counter() - start
+        assert changed and server.statuses[200] == 3, server.statuses
+        same_files(upstream, mirror_dir)
+
+        # Unchanged upstream: three 304s
+        server.statuses.clear()
+        start = time.perf_counter()
+        paths, changed = fetch.fetch_all(urls, mirror_dir)
+        warm_time = time.perf_counter() - start
+        assert not changed and server.statuses == {304: 3}, server.statuses
+
+        # One changed file is the only one downloaded again
+        with open(os.path.join(upstream, FILE_NAMES["deaths"]), "a") as f:
+            f.write(",Nowhere,0.0,0.0" + ",0" * (len(data.read_header(paths[0])) - 4) + "\n")
+        server.statuses.clear()
+        paths, changed = fetch.fetch_all(urls, mirror_dir)
+        assert changed and server.statuses == {200: 1, 304: 2}, server.statuses
+        same_files(upstream, mirror_dir)
+
+        # Server errors are retried
+        server.statuses.clear()
+        server.failures = 2
+        paths, changed = fetch.fetch_all(urls, mirror_dir)
+        assert not changed and server.statuses == {503: 2, 304: 3}, server.statuses
+
+        # Server down: fall back to the mirror
+        server.failures = 3 * 2
+        paths, changed = fetch.fetch_all(urls, mirror_dir, attempts = 2)
+        assert not changed
+        same_files(upstream, mirror_dir)
+        server.failures = 0
+
+        # Offline: the mirror only, and no requests at all
+        server.statuses.clear()
+        paths, changed = fetch.fetch_all(urls, mirror_dir, offline = True)
+        assert not changed and not server.statuses, server.statuses
+        try:
+            fetch.fetch_all(urls, os.path.join(tmp, "empty"), offline = True)
+        except FileNotFoundError:
+            pass
+        else:
+            raise AssertionError("offline without a mirror should fail")
+
+        # Refresh against an unchanged upstream skips parsing altogether
+        fetch.MIRROR_DIR = os.path.join(tmp, "app-mirror")
+        snapshot_dir = os.path.join(tmp, "snapshot")
+        start = time.perf_counter()
+        data.load(base_url, snapshot_dir)
+        load_time = time.perf_counter() - start
+        version = data.current().version
+        start = time.perf_counter()
+        data.refresh(base_url, snapshot_dir, max_age = 0)
+        refresh_time = time.perf_counter() - start
+        assert data.current().version == version
+
+        # A new day upstream whose ingest fails once: the next refresh gets three 304s
+        # and must still ingest the mirrored files
+        day = add_day(upstream)
+        ingest = data.ingest
+        def failing_ingest(*args, **kwargs):
+            raise OSError("disk hiccup")
+        data.ingest = failing_ingest
+        try:
+            data.refresh(base_url, snapshot_dir, max_age = 0)
+        except OSError:
+            pass
+        else:
+            raise AssertionError("the failing ingest should raise")
+        finally:
+            data.ingest = ingest
+        server.statuses.clear()
+        data.refresh(base_url, snapshot_dir, max_age = 0)
+        assert server.statuses == {304: 3}, server.statuses
+        assert data.current().arrays["dates"][-1] == day, data.current().arrays["dates"][-1]
+
+        # Offline, a mirror updated by hand is picked up
+        fetch.OFFLINE = True
+        day = add_day(fetch.MIRROR_DIR)
+        data.refresh(base_url, snapshot_dir, max_age = 0)
+        assert data.current().arrays["dates"][-1] == day, data.current().arrays["dates"][-1]
+        fetch.OFFLINE = False
+
+        print(f"cold fetch (3 files):       {cold_time * 1000:8.1f} ms")
+        print(f"revalidate (3 x 304):       {warm_time * 1000:8.1f} ms")
+        print(f"load (fetch + rebuild):     {load_time * 1000:8.1f} ms")
+        print(f"refresh, upstream unchanged:{refresh_time * 1000:8.1f} ms")
+        print("fetch layer checks passed")
+        server.shutdown()
+    finally:
+        shutil.rmtree(tmp, ignore_errors = True)
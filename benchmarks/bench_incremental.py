@@ -0,0 +1,115 @@
+######################################
+# Incremental ingest check and benchmark
+#
+# Builds a snapshot from the source with the last days cut off, then
+# ingests the full source incrementally and compares the result with a
+# full rebuild. Also checks that a revised historical value, recent or
+# long before the new days, falls back to a full rebuild. Exits non-zero
+# on any mismatch.
+#
+#   python benchmarks/bench_incremental.py [directory of CSSE CSVs] [--days N]
+######################################
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from fixture import FILE_NAMES, ROOT, write_fixture
+
+sys.path.insert(0, ROOT)
+import data
+
+
+# Copy the source CSVs without their last `days` date columns
+def truncated_copy(source, directory, days):
+    os.makedirs(directory, exist_ok = True)
+    for name in FILE_NAMES.values():
+        frame = pd.read_csv(os.path.join(source, name))
+        frame.iloc[:, :len(frame.columns) - days].to_csv(os.path.join(directory, name), index = False)
+    return directory
+
+
+def compare(frames, expected):
+    for name in data.FRAME_NAMES:
+        pd.testing.assert_frame_equal(frames[name], expected[name], check_exact = True)
+
+
+def compare_series(dataset, expected):
+    for name, values in expected.derived.items():
+        np.testing.assert_array_equal(dataset.derived[name], values)
+    for name, values in expected.global_derived.items():
+        np.testing.assert_array_equal(dataset.global_derived[name], values)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Compare incremental ingest with a full rebuild.")
+    parser.add_argument("source", nargs = "?")
+    parser.add_argument("--days", type = int, default = 3)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        source = args.source or write_fixture(os.path.join(tmp, "fixture"))
+        old_source = truncated_copy(source, os.path.join(tmp, "old"), args.days)
+
+        # Full rebuild of the complete source
+        start = time.perf_counter()
+        expected, expected_stamp = data.rebuild(source, os.path.join(tmp, "full"))
+        full_time = time.perf_counter() - start
+
+        # Snapshot without the last days, then append them
+        snapshot_dir = os.path.join(tmp, "incremental")
+        old_frames, old_stamp = data.rebuild(old_source, snapshot_dir)
+        start = time.perf_counter()
+        frames, stamp = data.ingest(source, snapshot_dir)
+        ingest_time = time.perf_counter() - start
+        compare(frames, expected)
+        assert stamp["version"] == expected_stamp["version"], (stamp, expected_stamp)
+
+        # The ingest derives only the new days of the stored analytics: they match a
+        # from-scratch build, and come back mapped from the snapshot it wrote
+        assert all(isinstance(values, np.memmap) for values in frames["derived"].values())
+        compare_series(data.Dataset(frames, stamp), data.Dataset(expected, expected_stamp))
+        arrays = data.wide_engine.arrays_from_long(frames["covid_global"])
+        start = time.perf_counter()
+        data.wide_engine.derive_series(arrays, previous = old_frames["derived"])
+        extend_time = time.perf_counter() - start
+
+        # Nothing new: no frames
+        assert data.ingest(source, snapshot_dir)[0] is None
+
+        # A revised historical value must trigger a full rebuild
+        revised = os.path.join(tmp, "revised")
+        shutil.copytree(source, revised)
+        path = os.path.join(revised, FILE_NAMES["deaths"])
+        frame = pd.read_csv(path)
+        frame.iloc[0, -2] += 1
+        frame.to_csv(path, index = False)
+        frames, stamp = data.ingest(revised, snapshot_dir)
+        compare(frames, data.rebuild(revised, os.path.join(tmp, "revised-full"))[0])
+
+        # So must a revision long before the new days, arriving together with them
+        old_revised = os.path.join(tmp, "old-revised")
+        shutil.copytree(source, old_revised)
+        path = os.path.join(old_revised, FILE_NAMES["confirmed"])
+        frame = pd.read_csv(path)
+        frame.iloc[0, -args.days - 30] += 1
+        frame.to_csv(path, index = False)
+        snapshot_dir = os.path.join(tmp, "old-revised-incremental")
+        data.rebuild(old_source, snapshot_dir)
+        frames, stamp = data.ingest(old_revised, snapshot_dir)
+        compare(frames, data.rebuild(old_revised, os.path.join(tmp, "old-revised-full"))[0])
+        assert data.ingest(old_revised, snapshot_dir)[0] is None
+
+        print(f"full rebuild:            {full_time * 1000:8.1f} ms")
+        print(f"incremental (+{args.days} days):   {ingest_time * 1000:8.1f} ms")
+        print(f"derived series, extend:  {extend_time * 1000:8.1f} ms")
+        print("incremental ingest matches the full rebuild")
+    finally:
+        shutil.rmtree(tmp, ignore_errors = True)
@@ -0,0 +1,78 @@
+######################################
+# JSON engine benchmark
+#
+# Serializes the country callback response of every country, and the
+# page layout, with Plotly's json encoder and with orjson, checks that
+# both give the same bytes, and times them: building and serializing
+# the responses, the layout, and cached /_dash-update-component
+# requests (Dash serializes the response with the same engine).
+#
+#   python benchmarks/bench_json.py [directory of CSSE CSVs]
+######################################
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from dash_client import update_requests
+from fixture import ROOT, write_fixture
+
+ENGINES = ["json", "orjson"]
+
+
+def per_call_ms(function, items, repeat = 3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            function(item)
+        best = min(best, time.perf_counter() - start)
+    return best / len(items) * 1000
+
+
+if __name__ == "__main__":
+    tmp = tempfile.mkdtemp()
+    os.environ["COVID_DATA_SOURCE"] = sys.argv[1] if len(sys.argv) > 1 else write_fixture(os.path.join(tmp, "fixture"))
+    os.environ["COVID_SNAPSHOT_DIR"] = os.path.join(tmp, "snapshot")
+    os.environ["COVID_REFRESH_INTERVAL"] = "0"
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    import plotly.io as pio
+    from plotly.io.json import to_json_plotly
+
+    import app
+
+    dataset = app.data.current()
+    countries = list(dataset.country_list)
+    layout = app.serve_layout()
+    client = app.server.test_client()
+    dependencies = client.get("/_dash-dependencies").get_json()
+    bodies = [json.dumps(body) for country in countries for body in update_requests(dependencies, "country-dropdown", "value", country)]
+    post = lambda body: client.post("/_dash-update-component", data = body, content_type = "application/json")
+
+    encoded = {}
+    wire = {}
+    for engine in ENGINES:
+        pio.json.config.default_engine = engine
+        # The figure builders return plain dicts for orjson (app.plain_figure)
+        build = lambda country: app.build_country_response(dataset, country)
+        responses = [build(country) for country in countries]
+        encoded[engine] = [to_json_plotly(response) for response in responses] + [to_json_plotly(layout)]
+        app.figure_cache.clear()
+        wire[engine] = [post(body).data for body in bodies]
+        print(f"{engine:8s}"
+              f"   build {per_call_ms(build, countries):6.3f} ms"
+              f" + serialize {per_call_ms(to_json_plotly, responses):6.3f} ms"
+              f"   layout {per_call_ms(to_json_plotly, [layout] * 20):6.3f} ms"
+              # The figure cache is warm from the requests above
+              f"   cached request {per_call_ms(post, bodies):6.3f} ms")
+
+    differ = sum(a != b for a, b in zip(*encoded.values()))
+    assert differ == 0, f"{differ} of the responses and the layout differ"
+    assert wire["json"] == wire["orjson"]
+    print(f"json and orjson give the same bytes for all {len(countries)} country responses, the layout "
+          f"and the callback responses over HTTP ({np.mean([len(data) for data in wire['json']]):,.0f} bytes on average)")
@@ -0,0 +1,67 @@
+######################################
+# Map date slider benchmark
+#
+# Server time and payload of one slider tick: the map-date callback
+# called directly for every day, and through the Flask test client
+# (/_dash-update-component) for a sample of days. Also checks that the
+# last day's markers match the initial map figure, and that a tick from
+# a page built on another data version is not answered.
+#
+#   python benchmarks/bench_map_slider.py [directory of CSSE CSVs]
+######################################
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from dash_client import update_requests
+from fixture import ROOT, write_fixture
+
+tmp = tempfile.mkdtemp()
+os.environ["COVID_DATA_SOURCE"] = sys.argv[1] if len(sys.argv) > 1 else write_fixture(os.path.join(tmp, "fixture"))
+os.environ["COVID_SNAPSHOT_DIR"] = os.path.join(tmp, "snapshot")
+sys.path.insert(0, ROOT)
+import app
+
+
+if __name__ == "__main__":
+    dataset = app.data.current()
+    n_days = len(dataset.arrays["dates"])
+
+    # The last day reproduces the markers of the initial figure
+    figure = app.get_map_figure(dataset)["data"][0]
+    last = app.make_map_day(dataset, n_days - 1)
+    np.testing.assert_allclose(last["size"], figure["marker"]["size"], atol = 1e-4)
+    np.testing.assert_allclose(last["color"], figure["marker"]["color"], atol = 1e-6)
+    assert last["values"][0] == [row[0] for row in figure["customdata"]]
+    assert last["label"] == figure["meta"]
+
+    times = []
+    for day in range(n_days):
+        start = time.perf_counter()
+        app.map_date(day, dataset.version)
+        times.append(time.perf_counter() - start)
+    times = np.array(times) * 1000
+    print(f"callback, all {n_days} days: mean {times.mean():6.2f} ms   p95 {np.percentile(times, 95):6.2f} ms   max {times.max():6.2f} ms")
+
+    client = app.server.test_client()
+    dependencies = client.get("/_dash-dependencies").get_json()
+    times = []
+    sizes = []
+    for day in np.linspace(0, n_days - 1, 100).astype(int):
+        for body in update_requests(dependencies, "map-date", "value", int(day), {("map-version", "data"): dataset.version}):
+            start = time.perf_counter()
+            response = client.post("/_dash-update-component", data = json.dumps(body), content_type = "application/json")
+            times.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.status_code
+            sizes.append(len(response.data))
+    # A page built from another data version keeps its map
+    for body in update_requests(dependencies, "map-date", "value", 0, {("map-version", "data"): "older-version"}):
+        assert client.post("/_dash-update-component", data = json.dumps(body), content_type = "application/json").status_code == 204
+    times = np.array(times) * 1000
+    print(f"HTTP, 100 days:     mean {times.mean():6.2f} ms   p95 {np.percentile(times, 95):6.2f} ms   payload {np.mean(sizes):8,.0f} bytes (max {max(sizes):,})")
+    print(f"full map figure:    {len(json.dumps(app.get_map_figure(dataset))):8,} bytes")
@@ -0,0 +1,98 @@
+######################################
+# Instrumentation overhead benchmark
+#
+# Checks the instrumentation end to end (Server-Timing headers, the
+# /metrics text, cProfile dumps of slow requests) and measures what it
+# costs: the no-op stage() when disabled, and an HTTP load test of the
+# country callback without the figure cache, with COVID_METRICS off, on,
+# and on with every request profiled.
+#
+#   python benchmarks/bench_metrics.py [directory of CSSE CSVs] [--requests N] [--concurrency N]
+######################################
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+
+import requests
+
+from dash_client import update_requests
+from fixture import ROOT, write_fixture
+from http_load import run_load, start_server, stop_server, summary
+from suite import find_options
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Measure the cost of the request instrumentation.")
+    parser.add_argument("source", nargs = "?")
+    parser.add_argument("--requests", type = int, default = 300)
+    parser.add_argument("--concurrency", type = int, default = 4)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    import metrics
+
+    n = 1_000_000
+    seconds = timeit.timeit("with stage('x'): pass", globals = {"stage": metrics.stage}, number = n)
+    print(f"stage() disabled: {seconds / n * 1e9:.0f} ns per stage")
+
+    tmp = tempfile.mkdtemp()
+    try:
+        source = args.source or write_fixture(os.path.join(tmp, "fixture"))
+        profile_dir = os.path.join(tmp, "profiles")
+        env = {
+            "COVID_DATA_SOURCE": source,
+            "COVID_SNAPSHOT_DIR": os.path.join(tmp, "snapshot"),
+            "COVID_FIGURE_CACHE_SIZE": "0",
+        }
+        modes = [
+            ("metrics off", {"COVID_METRICS": "0"}),
+            ("metrics on", {"COVID_METRICS": "1"}),
+            ("metrics on, all profiled", {"COVID_METRICS": "1", "COVID_PROFILE_DIR": profile_dir, "COVID_PROFILE_SAMPLE": "1", "COVID_PROFILE_THRESHOLD": "0"}),
+        ]
+        random.seed(0)
+        for label, extra in modes:
+            process, url = start_server(dict(env, **extra))
+            try:
+                dependencies = requests.get(f"{url}/_dash-dependencies").json()
+                countries = find_options(requests.get(f"{url}/_dash-layout").json(), "country-dropdown")
+                body = update_requests(dependencies, "country-dropdown", "value", "Canada")[0]
+                response = requests.post(f"{url}/_dash-update-component", json = body)
+                timing = response.headers.get("Server-Timing")
+                if extra["COVID_METRICS"] == "1":
+                    assert timing and "figures;dur=" in timing and "serialize;dur=" in timing and "total;dur=" in timing, timing
+                    text = requests.get(f"{url}/metrics").text
+                    assert 'covid_country_requests_total{country="Canada"} 1' in text, text
+                    assert 'covid_request_duration_seconds_count{handler="country-dropdown"} 1' in text, text
+                    # A new line series or a zoom of the chart is labelled by its own input,
+                    # and does not count as a country request
+                    state = {("country-dropdown", "value"): "Canada"}
+                    for component, prop, value in (("bar-line-series", "value", "cfr"), ("bar-line-chart", "relayoutData", {"xaxis.autorange": True})):
+                        for changed in update_requests(dependencies, component, prop, value, state):
+                            requests.post(f"{url}/_dash-update-component", json = changed)
+                    text = requests.get(f"{url}/metrics").text
+                    assert 'covid_country_requests_total{country="Canada"} 1' in text, text
+                    assert 'covid_request_duration_seconds_count{handler="bar-line-series"} 1' in text, text
+                    assert 'covid_request_duration_seconds_count{handler="bar-line-chart"} 1' in text, text
+                else:
+                    assert timing is None
+                    assert "covid_request_duration_seconds" not in requests.get(f"{url}/metrics").text
+                choices = [random.choice(countries) for _ in range(args.requests)]
+                bodies = [body for country in choices for body in update_requests(dependencies, "country-dropdown", "value", country)]
+                latencies, cpu = run_load(process, url, bodies, args.concurrency)
+                if extra["COVID_METRICS"] == "1" and "COVID_PROFILE_DIR" not in extra:
+                    stages = [line for line in requests.get(f"{url}/metrics").text.splitlines() if line.startswith("covid_stage_duration_seconds_sum")]
+            finally:
+                stop_server(process)
+            print(f"{label:26s} {summary(latencies)}   server CPU {cpu / len(bodies) * 1000:6.2f} ms/request")
+        for line in stages:
+            print(f"    {line}")
+        profiles = [name for name in os.listdir(profile_dir) if name.endswith(".prof")]
+        # Every callback request, plus the layout and dependency requests
+        assert len(profiles) > args.requests, len(profiles)
+        print(f"{len(profiles)} profiles written by the last run")
+    finally:
+        shutil.rmtree(tmp, ignore_errors = True)
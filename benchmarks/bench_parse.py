@@ -0,0 +1,88 @@
+######################################
+# CSV parsing benchmark
+#
+# Parses the three CSSE files with the old untyped pd.read_csv and with
+# the typed readers (pandas and pyarrow), each in a fresh process, and
+# reports the parse time, the size of the parsed frames and the resident
+# memory added by parsing (at the peak and once the frames are built).
+#
+#   python benchmarks/bench_parse.py [directory of CSSE CSVs] [--repeat N]
+######################################
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from fixture import ROOT, write_fixture
+
+sys.path.insert(0, ROOT)
+
+MODES = ["untyped", "pandas", "pyarrow"]
+
+
+def rss_mib():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+
+
+# Runs in a child process so every mode starts from the same baseline
+def measure(mode, source, repeat):
+    import pandas as pd
+    import pyarrow.csv  # noqa: F401, imported up front so it does not count as parse memory
+
+    import data
+
+    before = rss_mib()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        if mode == "untyped":
+            frames = [pd.read_csv(path) for path in data.source_paths(source)]
+        else:
+            data.CSV_READER = mode
+            frames = data.read_sources(source)
+        times.append(time.perf_counter() - start)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    retained = rss_mib()
+
+    return {
+        "mode": mode,
+        "parse_ms": min(times) * 1000,
+        "frames_mib": sum(frame.memory_usage(deep = True).sum() for frame in frames) / 2 ** 20,
+        "peak_rss_mib": peak - before,
+        "retained_rss_mib": retained - before,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark parsing the CSSE time series.")
+    parser.add_argument("source", nargs = "?")
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--mode", choices = MODES, help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(measure(args.mode, args.source, args.repeat)))
+        sys.exit()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        source = args.source or write_fixture(os.path.join(tmp, "fixture"))
+        print(f"{'reader':<10} {'parse':>10} {'frames':>11} {'peak RSS +':>12} {'RSS after':>11}")
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, __file__, source, "--repeat", str(args.repeat), "--mode", mode],
+                check = True, capture_output = True, text = True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{mode:<10} {result['parse_ms']:7.1f} ms {result['frames_mib']:7.1f} MiB {result['peak_rss_mib']:8.1f} MiB {result['retained_rss_mib']:7.1f} MiB")
+    finally:
+        shutil.rmtree(tmp, ignore_errors = True)
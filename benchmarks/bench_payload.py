@@ -0,0 +1,51 @@
+######################################
+# Response size benchmark
+#
+# Bytes on the wire for the country-dropdown callbacks of every country
+# and for the page layout, through the Flask test client: per output
+# uncompressed, and in total uncompressed, with Brotli and with gzip.
+#
+#   python benchmarks/bench_payload.py [directory of CSSE CSVs]
+######################################
+
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from dash_client import update_requests
+from fixture import ROOT, write_fixture
+
+tmp = tempfile.mkdtemp()
+os.environ["COVID_DATA_SOURCE"] = sys.argv[1] if len(sys.argv) > 1 else write_fixture(os.path.join(tmp, "fixture"))
+os.environ["COVID_SNAPSHOT_DIR"] = os.path.join(tmp, "snapshot")
+sys.path.insert(0, ROOT)
+import app
+
+
+def response_sizes(client, country):
+    sizes = {}
+    dependencies = client.get("/_dash-dependencies").get_json()
+    for body in update_requests(dependencies, "country-dropdown", "value", country):
+        response = client.post("/_dash-update-component", data = json.dumps(body), content_type = "application/json")
+        for output, value in response.get_json()["response"].items():
+            for prop, content in value.items():
+                sizes[f"{output}.{prop}"] = sizes.get(f"{output}.{prop}", 0) + len(json.dumps(content, separators = (",", ":")))
+        sizes["total"] = sizes.get("total", 0) + len(response.data)
+        # The same response as sent to browsers that accept Brotli, and to gzip-only clients
+        for encoding in ("br", "gzip"):
+            compressed = client.post("/_dash-update-component", data = json.dumps(body), content_type = "application/json", headers = {"Accept-Encoding": encoding})
+            sizes[f"total, {encoding}"] = sizes.get(f"total, {encoding}", 0) + len(compressed.data)
+    return sizes
+
+
+if __name__ == "__main__":
+    client = app.server.test_client()
+    layout = {encoding: len(client.get("/_dash-layout", headers = {"Accept-Encoding": encoding}).data) for encoding in ("identity", "br", "gzip")}
+    print(f"layout: {layout['identity']:,} bytes, {layout['br']:,} with br, {layout['gzip']:,} with gzip")
+    sizes = [response_sizes(client, country) for country in app.data.current().country_list]
+    for name in sizes[0]:
+        values = np.array([size.get(name, 0) for size in sizes])
+        print(f"{name:32s} mean {values.mean():10,.0f} bytes   max {values.max():10,}")
@@ -0,0 +1,176 @@
+######################################
+# Startup time report
+#
+# Starts the app in fresh processes and breaks the time until it can
+# answer "/" down by imported package (python -X importtime), fetched
+# file and ETL / load step (the metrics stages), in two scenarios:
+#   cold   no snapshot and an empty mirror: the sources are fetched from
+#          a local HTTP server and the full ETL runs
+#   warm   a snapshot on disk, as for every worker after the first
+# With budgets it exits with status 1 when the warm start exceeds them,
+# or when a module that startup should not need gets imported, so it
+# can run in CI to catch import-time regressions.
+#
+#   python benchmarks/bench_startup.py [--source DIR] [--repeat N] [--max-import-ms MS] [--max-ready-ms MS] [--json FILE]
+######################################
+
+import argparse
+import functools
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from fixture import ROOT, write_fixture
+
+# Run in the child: import the app, then serve the first page load
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.server.test_client()
+assert client.get("/").status_code == 200
+assert client.get("/_dash-layout").status_code == 200
+ready = time.perf_counter()
+import metrics
+print(json.dumps({
+    "import_app_ms": (imported - start) * 1000,
+    "first_request_ms": (ready - imported) * 1000,
+    "stages_ms": {name: seconds * 1000 for name, seconds in metrics.stage_seconds().items()},
+    "modules": sorted(sys.modules),
+}))
+"""
+
+# Not needed to start a worker: heavy, unused, or only needed to fetch
+FORBIDDEN = ["plotly.express", "scipy", "statsmodels", "requests", "tenacity"]
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+# Serve the fixture directory over HTTP, so the cold start goes through the fetch layer
+def serve_directory(directory):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory = directory))
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# Self import time in ms per top-level package, without the app module itself
+# (its body loads the data, which the stages account for)
+def import_times(stderr):
+    packages = {}
+    for match in IMPORT_LINE.finditer(stderr):
+        name = match.group(4)
+        if name == "app":
+            continue
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0.0) + int(match.group(1)) / 1000
+    return packages
+
+
+def run_child(env):
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD],
+        cwd = ROOT,
+        env = {**os.environ, "COVID_METRICS": "1", "COVID_REFRESH_INTERVAL": "0", **env},
+        capture_output = True,
+        text = True,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr[-3000:])
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result["imports_ms"] = import_times(process.stderr)
+    return result
+
+
+# Best of `repeat` runs for every number
+def best(runs):
+    result = dict(runs[0])
+    for key in ("import_app_ms", "first_request_ms"):
+        result[key] = min(run[key] for run in runs)
+    for key in ("imports_ms", "stages_ms"):
+        result[key] = {name: min(run[key].get(name, float("inf")) for run in runs) for name in runs[0][key]}
+    result["total_imports_ms"] = sum(result["imports_ms"].values())
+    result["ready_ms"] = min(run["import_app_ms"] + run["first_request_ms"] for run in runs)
+    modules = result.pop("modules")
+    result["forbidden"] = [module for module in FORBIDDEN if module in modules]
+    return result
+
+
+def report(name, result, top):
+    print(f"{name} start")
+    print(f"  {'import app':52s} {result['import_app_ms']:9.1f} ms")
+    print(f"    {'imports':50s} {result['total_imports_ms']:9.1f} ms")
+    packages = sorted(result["imports_ms"].items(), key = lambda item: -item[1])
+    for package, ms in packages[:top]:
+        print(f"      {package:48s} {ms:9.1f}")
+    rest = sum(ms for _, ms in packages[top:])
+    print(f"      {f'{len(packages) - top} others':48s} {rest:9.1f}")
+    print("    fetch and data steps")
+    for stage, ms in result["stages_ms"].items():
+        print(f"      {stage:48s} {ms:9.1f}")
+    print(f"  {'first request (/ and layout)':52s} {result['first_request_ms']:9.1f} ms")
+    print(f"  {'ready to serve':52s} {result['ready_ms']:9.1f} ms")
+    if result["forbidden"]:
+        print(f"  imported at startup: {', '.join(result['forbidden'])}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Report where the app spends its startup time.")
+    parser.add_argument("--source", help = "directory of CSSE CSVs (default: a generated fixture)")
+    parser.add_argument("--repeat", type = int, default = 3, help = "runs per scenario, the best is reported")
+    parser.add_argument("--top", type = int, default = 12, help = "packages listed by import time")
+    parser.add_argument("--max-import-ms", type = float, help = "budget for the imports of a warm start")
+    parser.add_argument("--max-ready-ms", type = float, help = "budget for a warm start to serve the first page")
+    parser.add_argument("--json", help = "write the results to this file")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    server = None
+    try:
+        source = args.source or write_fixture(os.path.join(tmp, "fixture"))
+        server, url = serve_directory(source)
+        results = {}
+        cold = []
+        for i in range(args.repeat):
+            env = {
+                "COVID_DATA_SOURCE": url,
+                "COVID_SNAPSHOT_DIR": os.path.join(tmp, f"snapshot-{i}"),
+                "COVID_MIRROR_DIR": os.path.join(tmp, f"mirror-{i}"),
+            }
+            cold.append(run_child(env))
+        results["cold"] = best(cold)
+        # Every cold run left a snapshot and a mirror behind: start from the first one
+        results["warm"] = best([run_child(env) for _ in range(args.repeat)])
+        for name in ("cold", "warm"):
+            report(name, results[name], args.top)
+            print()
+
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent = 2)
+        warm = results["warm"]
+        failures = []
+        if warm["forbidden"]:
+            failures.append(f"warm start imports {', '.join(warm['forbidden'])}")
+        if args.max_import_ms is not None and warm["total_imports_ms"] > args.max_import_ms:
+            failures.append(f"imports took {warm['total_imports_ms']:.0f} ms (budget {args.max_import_ms:.0f} ms)")
+        if args.max_ready_ms is not None and warm["ready_ms"] > args.max_ready_ms:
+            failures.append(f"ready after {warm['ready_ms']:.0f} ms (budget {args.max_ready_ms:.0f} ms)")
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1 if failures else 0)
+    finally:
+        if server is not None:
+            server.shutdown()
+        shutil.rmtree(tmp, ignore_errors = True)
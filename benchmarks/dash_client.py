@@ -0,0 +1,34 @@
+######################################
+# Helpers for calling Dash callbacks over HTTP
+#
+# Builds /_dash-update-component request bodies from the app's
+# /_dash-dependencies, so the benchmarks keep working when callback
+# outputs change.
+######################################
+
+
+def parse_output(output):
+    # "id.prop" or "..id.prop...id.prop.." for multi-output callbacks
+    if output.startswith(".."):
+        return [dict(zip(("id", "property"), part.rsplit(".", 1))) for part in output[2:-2].split("...")]
+    return dict(zip(("id", "property"), output.rsplit(".", 1)))
+
+
+# Request bodies for every server-side callback triggered by input_id.input_property
+def update_requests(dependencies, input_id, input_property, value, values = None):
+    values = dict(values or {})
+    values[(input_id, input_property)] = value
+    bodies = []
+    for dependency in dependencies:
+        if dependency.get("clientside_function"):
+            continue
+        if not any(item["id"] == input_id and item["property"] == input_property for item in dependency["inputs"]):
+            continue
+        bodies.append({
+            "output": dependency["output"],
+            "outputs": parse_output(dependency["output"]),
+            "inputs": [dict(item, value = values.get((item["id"], item["property"]))) for item in dependency["inputs"]],
+            "state": [dict(item, value = values.get((item["id"], item["property"]))) for item in dependency["state"]],
+            "changedPropIds": [f"{input_id}.{input_property}"],
+        })
+    return bodies
@@ -0,0 +1,112 @@
+######################################
+# Synthetic CSSE time series fixture
+#
+# Writes the three *_global.csv files with the same layout as the
+# CSSEGISandData repository (Province/State, Country/Region, Lat, Long,
+# then one column per day) so the dashboard can run without GitHub.
+######################################
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FILE_NAMES = {
+    "confirmed": "time_series_covid19_confirmed_global.csv",
+    "deaths": "time_series_covid19_deaths_global.csv",
+    "recovered": "time_series_covid19_recovered_global.csv",
+}
+
+# Rows that exercise every branch of the data cleaning stage
+SPECIAL_LOCATIONS = [
+    # (Province/State, Country/Region, Lat, Long)
+    ("Alberta", "Canada", 53.9333, -116.5765),
+    ("Ontario", "Canada", 51.2538, -85.3232),
+    ("Quebec", "Canada", 52.9399, -73.5491),
+    ("Diamond Princess", "Canada", np.nan, np.nan),
+    ("Grand Princess", "Canada", np.nan, np.nan),
+    ("Repatriated Travellers", "Canada", np.nan, np.nan),
+    ("Beijing", "China", 40.1824, 116.4142),
+    ("Hubei", "China", 30.9756, 112.2707),
+    ("Tibet", "China", 31.6927, 88.0924),
+    ("Unknown", "China", np.nan, np.nan),
+    ("Faroe Islands", "Denmark", 61.8926, -6.9118),
+    ("Greenland", "Denmark", 71.7069, -42.6043),
+    (np.nan, "Denmark", 56.2639, 9.5018),
+    ("Martinique", "France", 14.6415, -61.0242),
+    ("Reunion", "France", -21.1151, 55.5364),
+    (np.nan, "France", 46.2276, 2.2137),
+    ("Aruba", "Netherlands", 12.5211, -69.9683),
+    (np.nan, "Netherlands", 52.1326, 5.2913),
+    ("Cook Islands", "New Zealand", -21.2367, -159.7777),
+    (np.nan, "New Zealand", -40.9006, 174.886),
+    ("Bermuda", "United Kingdom", 32.3078, -64.7505),
+    (np.nan, "United Kingdom", 55.3781, -3.436),
+    ("Australian Capital Territory", "Australia", -35.4735, 149.0124),
+    ("New South Wales", "Australia", -33.8688, 151.2093),
+    (np.nan, "US", 40.0, -100.0),
+    (np.nan, "Korea, South", 35.907757, 127.766922),
+    (np.nan, "Korea, North", 40.3399, 127.5101),
+    (np.nan, "Taiwan*", 23.7, 121.0),
+    (np.nan, "Burma", 21.9162, 95.956),
+    (np.nan, "Holy See", 41.9029, 12.4534),
+    (np.nan, "Diamond Princess", np.nan, np.nan),
+    (np.nan, "MS Zaandam", np.nan, np.nan),
+    (np.nan, "Summer Olympics 2020", 35.6491, 139.7737),
+]
+
+
+def make_locations(area_csv, n_countries):
+    area_df = pd.read_csv(area_csv)
+    rng = np.random.default_rng(0)
+    locations = list(SPECIAL_LOCATIONS)
+    taken = {loc[1] for loc in locations}
+    for country in area_df.country:
+        if len(locations) >= n_countries:
+            break
+        if country in taken:
+            continue
+        taken.add(country)
+        locations.append((np.nan, country, round(rng.uniform(-50, 60), 4), round(rng.uniform(-170, 170), 4)))
+    return pd.DataFrame(locations, columns = ["Province/State", "Country/Region", "Lat", "Long"])
+
+
+def make_series(n_locations, n_days, seed, scale):
+    rng = np.random.default_rng(seed)
+    daily = rng.poisson(lam = rng.uniform(0, scale, size = (n_locations, 1)), size = (n_locations, n_days))
+    # A few negative corrections, like the real data
+    daily[rng.random((n_locations, n_days)) < 0.001] *= -1
+    return np.maximum(daily.cumsum(axis = 1), 0)
+
+
+def write_fixture(directory, n_days = 1143, n_countries = 289, area_csv = os.path.join(ROOT, "area.csv")):
+    os.makedirs(directory, exist_ok = True)
+    locations = make_locations(area_csv, n_countries)
+    dates = pd.date_range("2020-01-22", periods = n_days, freq = "D")
+    date_columns = [f"{d.month}/{d.day}/{d.strftime('%y')}" for d in dates]
+    confirmed = make_series(len(locations), n_days, 1, 2000)
+    deaths = confirmed // 60
+    recovered = (confirmed * 0.9).astype(np.int64)
+    # CSSE stopped reporting recoveries in August 2021
+    recovered[:, 567:] = 0
+    for name, values in (("confirmed", confirmed), ("deaths", deaths), ("recovered", recovered)):
+        frame = pd.concat([locations, pd.DataFrame(values, columns = date_columns)], axis = 1)
+        if name == "recovered":
+            # The recovered file reports Canada as a single row
+            frame = frame[frame["Country/Region"] != "Canada"]
+            canada = pd.DataFrame([[np.nan, "Canada", 56.1304, -106.3468] + [0] * n_days], columns = frame.columns)
+            frame = pd.concat([frame, canada], ignore_index = True)
+        frame.to_csv(os.path.join(directory, FILE_NAMES[name]), index = False)
+    return directory
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Write synthetic CSSE time series CSVs.")
+    parser.add_argument("directory")
+    parser.add_argument("--days", type = int, default = 1143)
+    parser.add_argument("--locations", type = int, default = 289)
+    args = parser.parse_args()
+    write_fixture(args.directory, args.days, args.locations)
@@ -0,0 +1,106 @@
+######################################
+# Helpers for HTTP load tests
+#
+# Starts the app in its own process (Flask's threaded server, or gunicorn
+# with several workers), fires callback requests at it from a pool of
+# client threads and reads the server's CPU time from /proc, so client
+# work is not counted.
+######################################
+
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from fixture import ROOT
+
+
+def free_port():
+    import socket
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# Run app.py on a free port with extra environment variables; returns (process, base URL).
+# workers > 0 runs it under gunicorn with that many worker processes.
+def start_server(env, timeout = 300, workers = 0):
+    port = free_port()
+    if workers:
+        command = [sys.executable, "-m", "gunicorn", "app:server", "-w", str(workers), "-b", f"127.0.0.1:{port}"]
+    else:
+        command = [sys.executable, "-c", f"import app; app.app.run(host = '127.0.0.1', port = {port}, threaded = True)"]
+    process = subprocess.Popen(
+        command,
+        cwd = ROOT,
+        env = {**os.environ, "COVID_REFRESH_INTERVAL": "0", **env},
+        stdout = subprocess.DEVNULL,
+        stderr = subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with {process.returncode}")
+        try:
+            if requests.get(f"{url}/_dash-layout", timeout = 5).status_code == 200:
+                return process, url
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("Server did not start")
+
+
+def stop_server(process):
+    process.terminate()
+    process.wait(timeout = 30)
+
+
+# User + system CPU seconds used by a process and its (gunicorn worker) children so far
+def process_cpu(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        children = [int(child) for child in f.read().split()]
+    for child in children:
+        try:
+            cpu += process_cpu(child)
+        except OSError:
+            pass
+    return cpu
+
+
+# POST every body to /_dash-update-component from `concurrency` threads.
+# Returns the latencies in ms and the server CPU seconds spent; with sizes = True
+# also the response sizes in bytes and the wall time of the whole run.
+def run_load(process, url, bodies, concurrency = 8, sizes = False):
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize = concurrency))
+
+    def post(body):
+        start = time.perf_counter()
+        response = session.post(f"{url}/_dash-update-component", data = json.dumps(body), headers = {"Content-Type": "application/json"})
+        response.raise_for_status()
+        return (time.perf_counter() - start) * 1000, len(response.content)
+
+    cpu = process_cpu(process.pid)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = concurrency) as pool:
+        results = np.array(list(pool.map(post, bodies)))
+    elapsed = time.perf_counter() - start
+    cpu = process_cpu(process.pid) - cpu
+    if sizes:
+        return results[:, 0], cpu, results[:, 1], elapsed
+
+    return results[:, 0], cpu
+
+
+def summary(latencies):
+    return f"p50 {np.percentile(latencies, 50):7.1f} ms   p95 {np.percentile(latencies, 95):7.1f} ms"
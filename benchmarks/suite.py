@@ -0,0 +1,296 @@
+######################################
+# Benchmark suite
+#
+# One run over a local fixture dataset (never the GitHub URLs), in three parts:
+#   etl        the ETL stages of both engines (read, melt, merge, cleaning,
+#              groupby, totals / align, group, long frame, totals, dataset)
+#   callbacks  country_kpi for every country, cold and cached, and every
+#              make_* builder: time per call and serialized bytes
+#   load       gunicorn with several workers under concurrent
+#              /_dash-update-component requests: throughput, p50/p95/p99
+#              latency and response bytes
+# Results go to a JSON file named after the commit, so two commits can be
+# compared with --compare.
+#
+#   python benchmarks/suite.py [--source DIR] [--parts etl,callbacks,load] [--output FILE]
+#   python benchmarks/suite.py --compare results/OLD.json results/NEW.json
+######################################
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import requests
+
+from dash_client import update_requests
+from fixture import ROOT, write_fixture
+from http_load import run_load, start_server, stop_server
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+PARTS = ["etl", "callbacks", "load"]
+
+
+# Best and median wall time in ms of `repeat` calls; setup() builds fresh arguments
+# for stages that modify their input
+def time_calls(function, repeat = 5, setup = None):
+    times = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        function(*args)
+        times.append((time.perf_counter() - start) * 1000)
+    return {"best_ms": min(times), "median_ms": float(np.median(times))}
+
+
+def distribution(times_ms, sizes = None):
+    times_ms = np.asarray(times_ms)
+    result = {
+        "calls": len(times_ms),
+        "mean_ms": float(times_ms.mean()),
+        "p50_ms": float(np.percentile(times_ms, 50)),
+        "p95_ms": float(np.percentile(times_ms, 95)),
+        "p99_ms": float(np.percentile(times_ms, 99)),
+        "max_ms": float(times_ms.max()),
+    }
+    if sizes is not None:
+        result["mean_bytes"] = float(np.mean(sizes))
+        result["max_bytes"] = int(np.max(sizes))
+    return result
+
+
+def run_etl(source, repeat):
+    import cleaning
+    import data
+    import engine as wide_engine
+
+    sources = data.read_sources(source)
+    melted = data.melt_frames(*sources)
+    merged = data.merge_frames(*melted)
+    cleaned = cleaning.clean_locations(merged.copy())
+    grouped = data.group_frames(cleaned.copy())
+    aligned = wide_engine.align_sources(*sources)
+    arrays = wide_engine.group_countries(*aligned)
+    frames = wide_engine.frames_from_aligned(*aligned)
+    stamp = {"version": data.make_version(frames)}
+
+    return {
+        "read": time_calls(lambda: data.read_sources(source), repeat),
+        "long/melt": time_calls(lambda: data.melt_frames(*sources), repeat),
+        "long/merge": time_calls(lambda: data.merge_frames(*melted), repeat),
+        "long/cleaning": time_calls(cleaning.clean_locations, repeat, setup = lambda: (merged.copy(),)),
+        "long/groupby": time_calls(data.group_frames, repeat, setup = lambda: (cleaned.copy(),)),
+        "long/totals": time_calls(lambda: data.total_frames(grouped), repeat),
+        "long/total": time_calls(lambda: data.build_frames(*sources, engine = "long"), max(1, repeat // 2)),
+        "wide/align": time_calls(lambda: wide_engine.align_sources(*sources), repeat),
+        "wide/group": time_calls(lambda: wide_engine.group_countries(*aligned), repeat),
+        "wide/long frame": time_calls(lambda: wide_engine.long_frame(arrays), repeat),
+        "wide/totals": time_calls(lambda: wide_engine.daily_totals(arrays), repeat),
+        "wide/total": time_calls(lambda: data.build_frames(*sources, engine = "wide"), repeat),
+        "dataset": time_calls(lambda: data.Dataset(frames, stamp), repeat),
+    }
+
+
+def run_callbacks(repeat):
+    from plotly.io.json import to_json_plotly
+
+    import app
+
+    dataset = app.data.current()
+    countries = list(dataset.country_list)
+    results = {}
+
+    # Every country without the figure cache, then through country_kpi with a warm cache
+    times, sizes = [], []
+    for country in countries:
+        start = time.perf_counter()
+        response = to_json_plotly(app.build_country_response(dataset, country))
+        times.append((time.perf_counter() - start) * 1000)
+        sizes.append(len(response))
+    results["country_kpi, cold"] = distribution(times, sizes)
+    for country in countries:
+        app.country_kpi(country)
+    times = []
+    for country in countries:
+        start = time.perf_counter()
+        app.country_kpi(country)
+        times.append((time.perf_counter() - start) * 1000)
+    results["country_kpi, cached"] = distribution(times)
+
+    series = dataset.country_series[countries[0]]
+    builders = {
+        "make_kpi": lambda: app.make_kpi(10, 5, "orange", "<b>New Confirmed</b>"),
+        "make_pie_chart": lambda: app.make_pie_chart(countries[0], 4, 3, 2, 1, ["orange", "#dd1e35", "#7CFC00", "#e55467"]),
+        "make_bar_line_chart": lambda: app.build_country_response(dataset, countries[0])[6],
+        "make_map_chart": lambda: app.make_map_chart(dataset.country_totals_df, 1, 20, 0),
+        "make_map_view": lambda: app.make_map_view(dataset, countries[0]),
+        "make_map_day": lambda: app.make_map_day(dataset, len(series["date"]) // 2),
+        "make_country_bundle": lambda: app.make_country_bundle(dataset),
+        "make_marquee": lambda: app.make_marquee(dataset),
+        "make_cards": lambda: app.make_cards(dataset),
+        "make_country_info": lambda: app.make_country_info(dataset),
+        "make_map_info": lambda: app.make_map_info(dataset),
+        "serve_layout": app.serve_layout,
+    }
+    for name, builder in builders.items():
+        result = time_calls(builder, repeat)
+        result["bytes"] = len(to_json_plotly(builder()))
+        results[name] = result
+
+    return results
+
+
+def run_load_test(env, workers, concurrency, n_requests):
+    process, url = start_server(env, workers = workers)
+    try:
+        dependencies = requests.get(f"{url}/_dash-dependencies").json()
+        layout = requests.get(f"{url}/_dash-layout").json()
+        countries = find_options(layout, "country-dropdown")
+        n_days = find_prop(layout, "map-date", "max") + 1
+        # Slider ticks are answered for the data version of the page
+        state = {("map-version", "data"): find_prop(layout, "map-version", "data")}
+        random.seed(0)
+        inputs = {
+            "country-dropdown": ("value", [random.choice(countries) for _ in range(n_requests)]),
+            "map-date": ("value", [random.randrange(n_days) for _ in range(n_requests)]),
+        }
+        results = {}
+        for input_id, (prop, values) in inputs.items():
+            bodies = [body for value in values for body in update_requests(dependencies, input_id, prop, value, state)]
+            if not bodies:
+                continue
+            latencies, cpu, sizes, elapsed = run_load(process, url, bodies, concurrency, sizes = True)
+            result = distribution(latencies, sizes)
+            result["throughput_rps"] = len(bodies) / elapsed
+            result["server_cpu_ms"] = cpu / len(bodies) * 1000
+            results[input_id] = result
+    finally:
+        stop_server(process)
+
+    return {"workers": workers, "concurrency": concurrency, "callbacks": results}
+
+
+def walk(component):
+    if isinstance(component, dict):
+        yield component
+        for value in component.get("props", {}).values():
+            yield from walk(value)
+    elif isinstance(component, list):
+        for item in component:
+            yield from walk(item)
+
+
+def find_prop(layout, component_id, prop):
+    for component in walk(layout):
+        if component.get("props", {}).get("id") == component_id:
+            return component["props"][prop]
+    raise KeyError(component_id)
+
+
+def find_options(layout, component_id):
+    return [option["value"] for option in find_prop(layout, component_id, "options")]
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd = ROOT, capture_output = True, text = True, check = True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd = ROOT, capture_output = True, text = True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, dirty
+
+
+# Flatten {"part": {"name": {"metric": value}}} to {"part/name/metric": value}
+def flatten(results, prefix = ""):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}/"))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(old_path, new_path, threshold):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{old['commit']} -> {new['commit']}")
+    old_flat = flatten({part: old[part] for part in PARTS if part in old})
+    new_flat = flatten({part: new[part] for part in PARTS if part in new})
+    regressions = 0
+    for key in sorted(old_flat.keys() & new_flat.keys()):
+        if not key.endswith(("_ms", "_rps", "bytes")) or not old_flat[key]:
+            continue
+        change = (new_flat[key] - old_flat[key]) / old_flat[key] * 100
+        # Higher throughput is better, everything else is better lower
+        worse = -change if key.endswith("_rps") else change
+        flag = ""
+        if worse > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{key:60s} {old_flat[key]:12.2f} {new_flat[key]:12.2f} {change:+8.1f}%{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Run the dashboard benchmark suite.")
+    parser.add_argument("--source", help = "directory of CSSE CSVs (default: a generated fixture)")
+    parser.add_argument("--parts", default = ",".join(PARTS))
+    parser.add_argument("--repeat", type = int, default = 5)
+    parser.add_argument("--workers", type = int, default = 2)
+    parser.add_argument("--concurrency", type = int, default = 8)
+    parser.add_argument("--requests", type = int, default = 300)
+    parser.add_argument("--output", help = "results file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", nargs = 2, metavar = ("OLD", "NEW"))
+    parser.add_argument("--threshold", type = float, default = 10.0, help = "percent change reported as a regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+
+    parts = [part for part in args.parts.split(",") if part]
+    tmp = tempfile.mkdtemp()
+    try:
+        source = args.source or write_fixture(os.path.join(tmp, "fixture"))
+        env = {
+            "COVID_DATA_SOURCE": source,
+            "COVID_SNAPSHOT_DIR": os.path.join(tmp, "snapshot"),
+            "COVID_REFRESH_INTERVAL": "0",
+        }
+        os.environ.update(env)
+        sys.path.insert(0, ROOT)
+        commit, dirty = git_commit()
+        results = {
+            "commit": commit,
+            "dirty": dirty,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "source": args.source or "fixture",
+        }
+        if "etl" in parts:
+            results["etl"] = run_etl(source, args.repeat)
+        if "callbacks" in parts:
+            results["callbacks"] = run_callbacks(args.repeat)
+        if "load" in parts:
+            results["load"] = run_load_test(env, args.workers, args.concurrency, args.requests)
+
+        output = args.output or os.path.join(RESULTS_DIR, f"{commit}{'-dirty' if dirty else ''}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok = True)
+        with open(output, "w") as f:
+            json.dump(results, f, indent = 2)
+        for key, value in flatten({part: results[part] for part in PARTS if part in results}).items():
+            if key.endswith(("best_ms", "p50_ms", "p95_ms", "p99_ms", "throughput_rps", "mean_bytes", "/bytes")):
+                print(f"{key:60s} {value:12.2f}")
+        print(f"results saved to {output}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors = True)
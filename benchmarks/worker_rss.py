@@ -0,0 +1,96 @@
+######################################
+# Per-worker memory report
+#
+# Starts gunicorn against a fixture dataset with and without
+# COVID_SHARED_DATA and prints RSS and PSS for every worker.
+# PSS splits shared pages between the processes mapping them, so it is
+# the number that shows what each extra worker really costs.
+#
+#   python benchmarks/worker_rss.py --workers 4
+######################################
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from dash_client import update_requests
+from fixture import ROOT, write_fixture
+
+
+def read_kb(pid, path, field):
+    with open(f"/proc/{pid}/{path}") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def worker_pids(master_pid):
+    with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+def measure(shared, workers, port, source, snapshot_dir):
+    env = dict(
+        os.environ,
+        COVID_DATA_SOURCE = source,
+        COVID_SNAPSHOT_DIR = snapshot_dir,
+        COVID_SHARED_DATA = "1" if shared else "0",
+    )
+    master = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "app:server", "-w", str(workers), "-b", f"127.0.0.1:{port}"],
+        cwd = ROOT, env = env, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL,
+    )
+    try:
+        url = f"http://127.0.0.1:{port}"
+        deadline = time.time() + 300
+        while True:
+            try:
+                urllib.request.urlopen(url, timeout = 5).read()
+                break
+            except OSError:
+                if time.time() > deadline or master.poll() is not None:
+                    raise RuntimeError("gunicorn did not come up")
+                time.sleep(0.5)
+        # Give every worker a chance to serve a few callbacks
+        dependencies = json.loads(urllib.request.urlopen(f"{url}/_dash-dependencies", timeout = 60).read())
+        bodies = [json.dumps(body).encode() for body in update_requests(dependencies, "country-dropdown", "value", "Belize")]
+        for _ in range(workers * 8):
+            for body in bodies:
+                request = urllib.request.Request(f"{url}/_dash-update-component", data = body, headers = {"Content-Type": "application/json"})
+                urllib.request.urlopen(request, timeout = 60).read()
+        rows = []
+        for pid in worker_pids(master.pid):
+            rows.append((pid, read_kb(pid, "status", "VmRSS"), read_kb(pid, "smaps_rollup", "Pss")))
+        return rows
+    finally:
+        master.terminate()
+        master.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Report per-worker RSS/PSS with and without the shared dataset.")
+    parser.add_argument("--workers", type = int, default = 4)
+    parser.add_argument("--port", type = int, default = 8765)
+    parser.add_argument("--source", help = "Directory of CSSE CSVs (a synthetic fixture is generated when omitted)")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        source = args.source or write_fixture(os.path.join(tmp, "fixture"))
+        for shared in (False, True):
+            # Each mode starts from an empty snapshot directory
+            snapshot_dir = os.path.join(tmp, f"snapshot-{int(shared)}")
+            rows = measure(shared, args.workers, args.port, source, snapshot_dir)
+            print(f"COVID_SHARED_DATA={int(shared)}")
+            for pid, rss, pss in rows:
+                print(f"  worker {pid}: RSS {rss / 1024:7.1f} MiB   PSS {pss / 1024:7.1f} MiB")
+            print(f"  total PSS: {sum(row[2] for row in rows) / 1024:.1f} MiB")
+    finally:
+        shutil.rmtree(tmp, ignore_errors = True)
@@ -0,0 +1,121 @@
+######################################
+# Figure cache for the country callback
+#
+# Keeps the built callback response per (country, chart options, data version) in
+# a bounded LRU, so a hit is handed to Dash as is and only serialized once.
+# An optional directory store lets workers share entries as JSON (point it at
+# /dev/shm to keep it in shared memory); only that store serializes on a put.
+######################################
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+# Number of responses kept in memory per worker (0 disables the cache)
+CACHE_SIZE = int(os.environ.get("COVID_FIGURE_CACHE_SIZE", "256"))
+# Directory shared by all workers, unset for a per-worker cache only
+CACHE_DIR = os.environ.get("COVID_FIGURE_CACHE_DIR")
+
+
+# dumps turns a response into JSON bytes or text for the directory store, loads reads it back
+class FigureCache:
+    def __init__(self, maxsize = CACHE_SIZE, directory = CACHE_DIR, dumps = json.dumps, loads = json.loads):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.dumps = dumps
+        self.loads = loads
+        self.version = None
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Point the cache at a data version and drop everything built from older ones
+    def set_version(self, version):
+        with self.lock:
+            if version == self.version:
+                return
+            self.version = version
+            self.entries.clear()
+        if self.directory and os.path.isdir(self.directory):
+            for entry in os.listdir(self.directory):
+                if entry != version:
+                    shutil.rmtree(os.path.join(self.directory, entry), ignore_errors = True)
+
+    def path(self, key):
+        name = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, str(key[-1]), f"{name}.json")
+
+    def get(self, key):
+        if self.maxsize <= 0:
+            return None
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+        if self.directory:
+            try:
+                with open(self.path(key), "rb") as f:
+                    value = self.loads(f.read())
+            except (OSError, ValueError):
+                pass
+            else:
+                self.store(key, value)
+                with self.lock:
+                    self.disk_hits += 1
+                return value
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self.store(key, value)
+        if self.directory:
+            path = self.path(key)
+            try:
+                value = self.dumps(value)
+                if isinstance(value, str):
+                    value = value.encode()
+                os.makedirs(os.path.dirname(path), exist_ok = True)
+                # Write then rename, so other workers never read a partial file
+                tmp = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+                with open(tmp, "wb") as f:
+                    f.write(value)
+                os.replace(tmp, path)
+            except OSError:
+                pass
+
+    # Add to the in-memory LRU, evicting the least recently used entries
+    def store(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last = False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "version": self.version,
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "shared_directory": self.directory,
+            }
@@ -0,0 +1,43 @@
+######################################
+# Location cleaning for the COVID-19 dashboard
+#
+# The tables that turn CSSE locations into the countries shown by the
+# dashboard, shared by the long pipeline (data.py) and the wide engine
+# (engine.py), which applies them to one row per location.
+######################################
+
+# Provinces that are reported as a country of their own
+province_countries = ["Diamond Princess", "Grand Princess", "Tibet"]
+# Countries whose provinces (mostly overseas territories) are shown as separate countries
+split_countries = ["Denmark", "France", "Netherlands", "New Zealand", "United Kingdom"]
+replace_names = {
+    "US": "USA",
+    "Korea, South": "South Korea",
+    "Korea, North": "North Korea",
+    "Taiwan*": "Taiwan",
+    "Burma": "Myanmar",
+    "Holy See": "Vatican City",
+    "Diamond Princess": "Cruise Ship",
+    "MS Zaandam": "Cruise Ship",
+    "Grand Princess": "Cruise Ship",
+}
+# Countries whose missing "Lat" and "Long" are imputed with the mean of their other rows
+impute_location_countries = ["Canada", "China"]
+
+
+# Apply the cleaning tables with whole-column operations (updates covid_merge in place)
+def clean_locations(covid_merge):
+    province = covid_merge["Province/State"]
+    country = covid_merge["Country/Region"]
+    # Use the province as the country name
+    override = province.notnull() & (province.isin(province_countries) | country.isin(split_countries))
+    covid_merge["Country/Region"] = country.where(~override, province).replace(replace_names)
+    # Impute the missing "Lat" and "Long" with the country mean
+    for name in impute_location_countries:
+        condition = covid_merge["Country/Region"] == name
+        centroid = covid_merge.loc[condition, ["Lat", "Long"]].mean()
+        missing = condition & covid_merge["Lat"].isna()
+        covid_merge.loc[missing, "Lat"] = centroid["Lat"]
+        covid_merge.loc[missing, "Long"] = centroid["Long"]
+
+    return covid_merge
@@ -0,0 +1,839 @@
+######################################
+# Data layer for the COVID-19 dashboard
+#
+# Mirrors the CSSE time series (fetch.py), runs the ETL and keeps the finished
+# frames in a local Arrow IPC snapshot so workers can boot from disk
+# instead of re-running the whole pipeline.
+######################################
+
+import calendar
+import contextlib
+import csv
+import fcntl
+import gc
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+import types
+
+import numpy as np
+import pandas as pd
+
+import cleaning
+import engine as wide_engine
+import fetch
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Upstream CSSE time series
+csse_base_url = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series"
+file_confirmed_global = "time_series_covid19_confirmed_global.csv"
+file_deaths_global = "time_series_covid19_deaths_global.csv"
+file_recovered_global = "time_series_covid19_recovered_global.csv"
+url_confirmed_global = f"{csse_base_url}/{file_confirmed_global}"
+url_deaths_global = f"{csse_base_url}/{file_deaths_global}"
+url_recovered_global = f"{csse_base_url}/{file_recovered_global}"
+
+# Where the three CSVs come from: a base URL (mirrored locally) or a local directory of fixture CSVs
+DATA_SOURCE = os.environ.get("COVID_DATA_SOURCE", csse_base_url)
+# Where the snapshot lives
+SNAPSHOT_DIR = os.environ.get("COVID_SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshot"))
+# "wide" aligns the files as (locations, days) arrays (engine.py), "long" melts and merges them
+ETL_ENGINE = os.environ.get("COVID_ETL_ENGINE", "wide")
+# Seconds between snapshot rebuilds by the background refresher (0 disables it)
+REFRESH_INTERVAL = float(os.environ.get("COVID_REFRESH_INTERVAL", "3600"))
+# Refresh by appending only the new date columns to the snapshot (falls back to a full rebuild)
+INCREMENTAL = os.environ.get("COVID_INCREMENTAL", "1") == "1"
+# CSV parser for the source files: "pandas", or "pyarrow" (multithreaded, faster on
+# several cores but its memory pool keeps the parse buffers resident afterwards)
+CSV_READER = os.environ.get("COVID_CSV_READER", "pandas")
+# Area (sq mi) of the countries, for the map zoom and the per-area rates
+AREA_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "area.csv")
+# Bump when the layout of the snapshot files changes
+SNAPSHOT_FORMAT = 4
+# Shared mode: the gunicorn master builds the snapshot before forking and the
+# workers attach to the memory-mapped files read-only instead of copying them
+SHARED_DATA = os.environ.get("COVID_SHARED_DATA", "0") == "1"
+# Load the dataset in a background thread at boot instead of at import, so the server
+# accepts connections (and answers /healthz) while the snapshot is read or built
+ASYNC_LOAD = os.environ.get("COVID_ASYNC_LOAD", "0") == "1"
+# Frames stored in the snapshot
+FRAME_NAMES = ["covid_global", "daily_cum_global", "country_totals_df"]
+# Aligned per-location arrays stored next to the frames, for incremental ingest
+SOURCE_NAMES = ["confirmed", "deaths", "recovered"]
+# The analytics of every country (engine.derive_series) are stored too, as .npy files in
+# derived/ that every worker maps read-only instead of computing its own private copy
+DERIVED_DIR = "derived"
+
+
+# Paths or URLs of the three CSSE time series under a base URL or a local directory
+def source_paths(source = None):
+    source = source or DATA_SOURCE
+    if os.path.isdir(source):
+        join = os.path.join
+    else:
+        join = lambda base, name: f"{base.rstrip('/')}/{name}"
+
+    return [join(source, name) for name in (file_confirmed_global, file_deaths_global, file_recovered_global)]
+
+
+# Local directory holding the three CSVs: the source itself, or the up to date mirror
+# of a remote source. Returns (directory, changed); changed is False only when the
+# mirror was already current.
+def local_source(source = None):
+    source = source or DATA_SOURCE
+    if os.path.isdir(source):
+        return source, True
+    paths, changed = fetch.fetch_all(source_paths(source))
+
+    return os.path.dirname(paths[0]), changed
+
+
+# SHA-1 of the three source files of a local directory: the digest the fetch layer recorded
+# in the .meta.json of a mirrored file when that is newer than the file, else the file hashed
+# (a local source, or a mirror edited by hand). Stored in the snapshot stamp, so a refresh
+# can tell whether the snapshot was built from exactly these files.
+def source_digests(source):
+    digests = []
+    for path in source_paths(source):
+        meta = fetch.read_meta(path)
+        try:
+            recorded = meta.get("sha1") and os.path.getmtime(f"{path}.meta.json") >= os.path.getmtime(path)
+        except OSError:
+            recorded = False
+        if recorded:
+            digests.append(meta["sha1"])
+            continue
+        digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        digests.append(digest.hexdigest())
+
+    return digests
+
+
+# Column names of a CSV file, without parsing any rows
+def read_header(path):
+    with open(path, newline = "") as f:
+        return next(csv.reader(f))
+
+
+# Explicit schema of a CSSE file: categorical location keys, float64 coordinates
+# (a few hundred rows, kept exact) and int32 counts for the date columns
+def source_dtypes(header):
+    dtypes = {
+        "Province/State": "category",
+        "Country/Region": "category",
+        "Lat": np.float64,
+        "Long": np.float64,
+    }
+    dtypes.update((column, np.int32) for column in header[4:])
+
+    return dtypes
+
+
+# Parse one CSSE file (or only `columns` of it) with the explicit schema
+def read_source(path, columns = None):
+    header = read_header(path)
+    columns = columns or header
+    wanted = set(columns)
+    dtypes = {column: dtype for column, dtype in source_dtypes(header).items() if column in wanted}
+    if CSV_READER == "pyarrow":
+        import pyarrow as pa
+        from pyarrow import csv as pa_csv
+
+        column_types = {column: pa.dictionary(pa.int32(), pa.string()) if dtype == "category" else pa.from_numpy_dtype(dtype) for column, dtype in dtypes.items()}
+        table = pa_csv.read_csv(
+            path,
+            read_options = pa_csv.ReadOptions(use_threads = True),
+            # Empty cells are missing values, as in pd.read_csv
+            convert_options = pa_csv.ConvertOptions(column_types = column_types, include_columns = columns, strings_can_be_null = True),
+        )
+        return table.to_pandas()
+    try:
+        return pd.read_csv(path, usecols = columns, dtype = dtypes)
+    except ValueError:
+        # Blank counts cannot be int32: let pandas infer the date columns
+        logger.warning("%s has missing counts, parsing them as floats", path)
+        return pd.read_csv(path, usecols = columns, dtype = {column: dtypes[column] for column in columns[:4]})
+
+
+# Read the three CSSE time series from a local directory (see local_source)
+def read_sources(source = None):
+    path_confirmed, path_deaths, path_recovered = source_paths(source)
+    confirmed_df = read_source(path_confirmed)
+    deaths_df = read_source(path_deaths)
+    recovered_df = read_source(path_recovered)
+
+    return confirmed_df, deaths_df, recovered_df
+
+
+# Unpivot (reshape) the data using the melt() function
+def melt_frames(confirmed_df, deaths_df, recovered_df):
+    melted = []
+    for frame, value_name in ((confirmed_df, "confirmed"), (deaths_df, "deaths"), (recovered_df, "recovered")):
+        frame = frame.astype({key: object for key in wide_engine.LOCATION_KEYS})
+        frame_global = frame.melt(
+            id_vars = ["Province/State", "Country/Region", "Lat", "Long"],
+            value_vars = frame.columns[4:],
+            var_name = "date",
+            value_name = value_name
+        )
+        # melt() stacks the date columns in order: parse the header once instead of every row
+        frame_global["date"] = np.repeat(wide_engine.parse_dates(frame.columns[4:]).to_numpy(), len(frame))
+        # Sum the parsed int32 counts as int64, like the wide engine
+        if pd.api.types.is_integer_dtype(frame_global[value_name]):
+            frame_global[value_name] = frame_global[value_name].astype(np.int64)
+        melted.append(frame_global)
+
+    return melted
+
+
+#################### Merge Datasets ####################
+def merge_frames(confirmed_global, deaths_global, recovered_global):
+    # Locations are matched on their names, the coordinates come from the confirmed file
+    keys = ['Province/State', 'Country/Region', 'date']
+    covid_merge = pd.merge(confirmed_global, deaths_global.drop(columns = ["Lat", "Long"]), on = keys, how = "left")
+    covid_merge = pd.merge(covid_merge, recovered_global.drop(columns = ["Lat", "Long"]), on = keys, how = "left")
+    covid_merge["recovered"] = covid_merge["recovered"].fillna(0)
+    covid_merge["recovered"] = covid_merge["recovered"].astype(int)
+    # Active cases
+    covid_merge["active"] = covid_merge["confirmed"] - covid_merge["deaths"]- covid_merge["recovered"]
+
+    return covid_merge
+
+
+# Final Dataset
+def aggregate_frames(covid_merge):
+    return total_frames(group_frames(covid_merge))
+
+
+# Country totals for each day
+def group_frames(covid_merge):
+    # Group on country codes (sorted categories, like the wide engine)
+    covid_merge["Country/Region"] = covid_merge["Country/Region"].astype("category")
+    covid_global = covid_merge.groupby(["date", "Country/Region"], as_index = False, observed = True).agg(
+        {
+            "Lat": "mean",
+            "Long": "mean",
+            "confirmed": "sum",
+            "deaths": "sum",
+            "recovered": "sum",
+            "active": "sum",
+        }
+    # observed=True keeps the groups in order of appearance: sort by date, then country code
+    ).sort_values(["date", "Country/Region"], ignore_index = True)
+
+    return covid_global
+
+
+# Global and latest country totals of the grouped covid_global
+def total_frames(covid_global):
+    # Global Cumulative for each day
+    daily_cum_global = covid_global.groupby(["date"])[['confirmed', 'deaths', 'recovered', 'active']].sum().reset_index()
+    # Countries Lattest Totals
+    # The rows of the last date (covid_global is sorted by date)
+    dates = covid_global["date"].to_numpy()
+    country_totals_df = covid_global.iloc[dates.searchsorted(dates[-1]):].reset_index(drop = True)
+
+    return {
+        "covid_global": covid_global,
+        "daily_cum_global": daily_cum_global,
+        "country_totals_df": country_totals_df,
+    }
+
+
+# Run the ETL on the raw time series and return the final frames
+def build_frames(confirmed_df, deaths_df, recovered_df, engine = None):
+    if (engine or ETL_ENGINE) == "wide":
+        return wide_engine.build_frames(confirmed_df, deaths_df, recovered_df)
+    covid_merge = merge_frames(*melt_frames(confirmed_df, deaths_df, recovered_df))
+    cleaning.clean_locations(covid_merge)
+
+    return aggregate_frames(covid_merge)
+
+
+# Version stamp: the last date plus a digest of the final dataset
+def make_version(frames):
+    covid_global = frames["covid_global"]
+    digest = hashlib.sha1(pd.util.hash_pandas_object(covid_global, index = False).values.tobytes()).hexdigest()
+    return f"{covid_global['date'].iloc[-1]:%Y%m%d}-{digest[:10]}"
+
+
+# Write the frames, the aligned source arrays and the derived country analytics into
+# snapshot/<version>/ and point snapshot/CURRENT at it.
+# Each version gets its own directory so files that are in use are never overwritten.
+def save_snapshot(frames, aligned, derived, snapshot_dir = None, keep = 2, sources = None):
+    from pyarrow import feather
+
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    version = make_version(frames)
+    version_dir = os.path.join(snapshot_dir, version)
+    tmp_dir = f"{version_dir}.tmp-{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok = True)
+    for name in FRAME_NAMES:
+        # One record batch per file, so columns can be mapped without concatenating chunks
+        feather.write_feather(frames[name], os.path.join(tmp_dir, f"{name}.arrow"), compression = "uncompressed", chunksize = max(len(frames[name]), 1))
+    # Location-level source arrays and the raw date header, for incremental ingest
+    locations, date_columns, values = aligned
+    feather.write_feather(locations, os.path.join(tmp_dir, "locations.arrow"), compression = "uncompressed")
+    for name in SOURCE_NAMES:
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), values[name])
+    with open(os.path.join(tmp_dir, "date_columns.json"), "w") as f:
+        json.dump(list(date_columns), f)
+    os.makedirs(os.path.join(tmp_dir, DERIVED_DIR), exist_ok = True)
+    for name, values in derived.items():
+        if name != "rolling_average":
+            np.save(os.path.join(tmp_dir, DERIVED_DIR, f"{name}.npy"), values)
+    if os.path.isdir(version_dir):
+        shutil.rmtree(tmp_dir)
+    else:
+        os.replace(tmp_dir, version_dir)
+    stamp = {
+        "format": SNAPSHOT_FORMAT,
+        "version": version,
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "sources": sources,
+    }
+    write_stamp(stamp, snapshot_dir)
+    # Drop old versions
+    versions = sorted(
+        (entry for entry in os.listdir(snapshot_dir) if os.path.isdir(os.path.join(snapshot_dir, entry)) and ".tmp-" not in entry),
+        key = lambda entry: os.path.getmtime(os.path.join(snapshot_dir, entry)),
+    )
+    for entry in versions[:-keep]:
+        if entry != version:
+            shutil.rmtree(os.path.join(snapshot_dir, entry), ignore_errors = True)
+
+    return stamp
+
+
+# Point snapshot/CURRENT at a stamp (its mtime is when the sources were last checked)
+def write_stamp(stamp, snapshot_dir = None):
+    current = os.path.join(snapshot_dir or SNAPSHOT_DIR, "CURRENT")
+    with open(f"{current}.tmp-{os.getpid()}", "w") as f:
+        json.dump(stamp, f)
+    os.replace(f"{current}.tmp-{os.getpid()}", current)
+
+
+# Read snapshot/CURRENT, or None when there is no usable snapshot
+def read_stamp(snapshot_dir = None):
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    try:
+        with open(os.path.join(snapshot_dir, "CURRENT")) as f:
+            stamp = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if stamp.get("format") != SNAPSHOT_FORMAT:
+        return None
+    if not os.path.isdir(os.path.join(snapshot_dir, stamp["version"])):
+        return None
+
+    return stamp
+
+
+def load_snapshot(stamp, snapshot_dir = None, shared = False):
+    from pyarrow import feather
+
+    version_dir = os.path.join(snapshot_dir or SNAPSHOT_DIR, stamp["version"])
+    frames = {}
+    for name in FRAME_NAMES:
+        table = feather.read_table(os.path.join(version_dir, f"{name}.arrow"), memory_map = True)
+        if shared:
+            # split_blocks keeps null-free numeric and date columns as read-only
+            # views of the mapped file, so every worker shares the same pages
+            frames[name] = table.to_pandas(split_blocks = True)
+        else:
+            frames[name] = table.to_pandas()
+    frames["derived"] = load_derived(stamp, snapshot_dir)
+
+    return frames
+
+
+# Derived country analytics of a snapshot, mapped, not read: the pages are shared by
+# every process using this version
+def load_derived(stamp, snapshot_dir = None):
+    derived_dir = os.path.join(snapshot_dir or SNAPSHOT_DIR, stamp["version"], DERIVED_DIR)
+    derived = {name[:-4]: np.load(os.path.join(derived_dir, name), mmap_mode = "r") for name in sorted(os.listdir(derived_dir))}
+    derived["rolling_average"] = derived["rolling7_confirmed"]
+
+    return derived
+
+
+# Location-level arrays of a snapshot: (locations, date header, {name: (locations, days) int32})
+def load_aligned(stamp, snapshot_dir = None):
+    from pyarrow import feather
+
+    version_dir = os.path.join(snapshot_dir or SNAPSHOT_DIR, stamp["version"])
+    locations = feather.read_feather(os.path.join(version_dir, "locations.arrow"))
+    with open(os.path.join(version_dir, "date_columns.json")) as f:
+        date_columns = json.load(f)
+    values = {name: np.load(os.path.join(version_dir, f"{name}.npy"), mmap_mode = "r") for name in SOURCE_NAMES}
+
+    return locations, date_columns, values
+
+
+# Write the snapshot and add the derived analytics to the frames: the mapped files just
+# written, or the computed arrays when the snapshot could not be written
+def write_snapshot(frames, aligned, derived, snapshot_dir = None, sources = None):
+    try:
+        stamp = save_snapshot(frames, aligned, derived, snapshot_dir, sources = sources)
+    except OSError as e:
+        # A read-only disk should not keep the app from starting
+        logger.warning("Could not write snapshot: %s", e)
+        frames["derived"] = derived
+        return {"format": SNAPSHOT_FORMAT, "version": make_version(frames), "built_at": None}
+    frames["derived"] = load_derived(stamp, snapshot_dir)
+
+    return stamp
+
+
+# Download the sources, run the ETL and write a fresh snapshot
+def rebuild(source = None, snapshot_dir = None):
+    source, _ = local_source(source)
+    digests = source_digests(source)
+    with metrics.stage("etl/read"):
+        sources = read_sources(source)
+    with metrics.stage("etl/align"):
+        locations, dates, values = wide_engine.align_sources(*sources)
+    with metrics.stage(f"etl/frames ({ETL_ENGINE})"):
+        if ETL_ENGINE == "wide":
+            frames = wide_engine.frames_from_aligned(locations, dates, values)
+        else:
+            frames = build_frames(*sources)
+    with metrics.stage("etl/derive"):
+        derived = wide_engine.derive_series(wide_engine.arrays_from_long(frames["covid_global"]))
+    with metrics.stage("etl/write snapshot"):
+        stamp = write_snapshot(frames, (locations, sources[0].columns[4:], values), derived, snapshot_dir, digests)
+
+    return frames, stamp
+
+
+# Read each source and compare all the stored dates with the snapshot: a revision of any
+# day, however old, means the stored arrays are stale. Returns None when the header or
+# the history no longer match the snapshot, otherwise
+# (new date header, {name: (locations, new days) int32}).
+def read_new_columns(aligned, source = None):
+    locations, date_columns, values = aligned
+    keys = wide_engine.location_index(locations)
+    new_columns = None
+    new_values = {}
+    for name, path in zip(SOURCE_NAMES, source_paths(source)):
+        header = read_header(path)
+        if name == "confirmed":
+            # The confirmed file defines the grid: it may only grow to the right
+            if list(header[4:4 + len(date_columns)]) != date_columns:
+                return None
+            new_columns = list(header[4 + len(date_columns):])
+        frame = read_source(path)
+        if name == "confirmed":
+            # Same locations in the same order, at the same coordinates
+            if not wide_engine.location_index(frame).equals(keys):
+                return None
+            if not frame[["Lat", "Long"]].equals(locations[["Lat", "Long"]]):
+                return None
+        frame = frame.set_index(wide_engine.location_index(frame))
+        frame = frame.reindex(index = keys, columns = date_columns + new_columns).fillna(0)
+        if not np.array_equal(frame[date_columns].to_numpy(dtype = np.int32), values[name]):
+            return None
+        new_values[name] = frame[new_columns].to_numpy(dtype = np.int32)
+
+    return new_columns, new_values
+
+
+# Incremental ingest: run the ETL only on the date columns the snapshot does not have yet
+# and append them to the stored arrays and frames. Falls back to a full rebuild when there
+# is no snapshot or the stored history changed upstream.
+# Returns (frames, stamp), or (None, stamp) when there is nothing new.
+def ingest(source = None, snapshot_dir = None):
+    stamp = read_stamp(snapshot_dir)
+    if stamp is None:
+        return rebuild(source, snapshot_dir)
+    source, _ = local_source(source)
+    digests = source_digests(source)
+    aligned = load_aligned(stamp, snapshot_dir)
+    with metrics.stage("etl/read new columns"):
+        new = read_new_columns(aligned, source)
+    if new is None:
+        logger.info("Upstream history changed, rebuilding the snapshot")
+        return rebuild(source, snapshot_dir)
+    new_columns, new_values = new
+    if not new_columns:
+        return None, stamp
+    locations, date_columns, values = aligned
+    dates = wide_engine.parse_dates(new_columns)
+    with metrics.stage("etl/append days"):
+        stored = load_snapshot(stamp, snapshot_dir)
+        frames = wide_engine.append_days(stored, locations, dates, new_values)
+        values = {name: np.concatenate([values[name], new_values[name]], axis = 1) for name in SOURCE_NAMES}
+    # Same countries, more days: only the new days of the stored analytics are derived
+    with metrics.stage("etl/derive"):
+        derived = wide_engine.derive_series(wide_engine.arrays_from_long(frames["covid_global"]), previous = stored["derived"])
+    with metrics.stage("etl/write snapshot"):
+        stamp = write_snapshot(frames, (locations, date_columns + new_columns, values), derived, snapshot_dir, digests)
+
+    return frames, stamp
+
+
+# Make sure a snapshot exists without keeping any frames in this process.
+# Called by the gunicorn master before it forks the workers.
+def ensure_snapshot(source = None, snapshot_dir = None):
+    stamp = read_stamp(snapshot_dir)
+    if stamp is None:
+        frames, stamp = rebuild(source, snapshot_dir)
+        # Free the final and intermediate frames before the workers fork
+        del frames
+        gc.collect()
+
+    return stamp
+
+
+# Load the frames from the snapshot, rebuilding only when there is none
+def load_frames(source = None, snapshot_dir = None, shared = None):
+    shared = SHARED_DATA if shared is None else shared
+    stamp = read_stamp(snapshot_dir)
+    if stamp is not None:
+        try:
+            with metrics.stage("load/snapshot"):
+                return load_snapshot(stamp, snapshot_dir, shared), stamp
+        except (OSError, ValueError) as e:
+            logger.warning("Could not read snapshot %s: %s", stamp["version"], e)
+
+    return rebuild(source, snapshot_dir)
+
+
+
+# Area (sq mi) per country name. area.csv lists a few countries twice: the first row counts.
+def read_areas(path = None):
+    return pd.read_csv(path or AREA_CSV).groupby("country", sort = False)["areasqmi"].first()
+
+
+areas_by_country = read_areas()
+
+
+# Make the arrays of a dict read-only; views taken from them afterwards are read-only too
+def read_only(arrays):
+    for values in arrays.values():
+        if isinstance(values, np.ndarray):
+            values.flags.writeable = False
+
+    return types.MappingProxyType(arrays)
+
+
+# One fully built, read-only dataset with everything the layout and callbacks need.
+# Requests take data.current() once and use that object throughout, so a refresh
+# swapping in a new Dataset can never be observed half-way.
+# Every per-country value is a NumPy array row, found through country_rows (one dict
+# lookup); once built no attribute can be set again or deleted, the dicts are read-only
+# mappings and no array can be written.
+class Dataset:
+    __slots__ = (
+        "stamp", "version", "loaded_at",
+        "covid_global", "daily_cum_global", "country_totals_df",
+        "last_update", "tot_global", "new_global", "pct_change",
+        "arrays", "derived", "global_derived", "country_series",
+        "country_list", "country_index", "country_rows", "areas",
+        "map_markers", "date_index", "iso_dates", "consecutive_days",
+    )
+
+    def __init__(self, frames, stamp, previous = None):
+        covid_global = frames["covid_global"]
+        daily_cum_global = frames["daily_cum_global"]
+        country_totals_df = frames["country_totals_df"]
+        self.stamp = stamp
+        self.version = stamp["version"]
+        self.loaded_at = time.time()
+        self.covid_global = covid_global
+        self.daily_cum_global = daily_cum_global
+        self.country_totals_df = country_totals_df
+        # Last Update
+        self.last_update = covid_global["date"].iloc[-1].strftime("%B %d, %Y")
+        # Global Totals, New Global Cases and Percentage of Previous Day
+        tot_global = {}
+        new_global = {}
+        pct_change = {}
+        for name in wide_engine.METRICS:
+            total = daily_cum_global[name].iloc[-1]
+            yesterday = daily_cum_global[name].iloc[-2]
+            tot_global[name] = total
+            new_global[name] = total - yesterday
+            pct_change[name] = 0 if yesterday == 0 else round(((total - yesterday) / yesterday) * 100, 2)
+        self.tot_global = types.MappingProxyType(tot_global)
+        self.new_global = types.MappingProxyType(new_global)
+        self.pct_change = types.MappingProxyType(pct_change)
+        # Per-country arrays for the country callback (cumulative, daily and their analytics),
+        # and the same analytics of the global totals as (1, days) arrays.
+        # When this dataset only adds days to `previous`, only the new days are derived.
+        self.arrays = read_only(wide_engine.arrays_from_long(covid_global))
+        prior = prior_global = None
+        if previous is not None and np.array_equal(previous.arrays["countries"], self.arrays["countries"]) \
+                and self.arrays["dates"][:len(previous.arrays["dates"])].equals(previous.arrays["dates"]):
+            prior = previous.derived
+            prior_global = previous.global_derived
+        # A snapshot brings the country analytics as mapped files (frames["derived"])
+        derived = frames.get("derived")
+        if derived is None:
+            derived = wide_engine.derive_series(self.arrays, previous = prior)
+        self.derived = read_only(derived)
+        global_arrays = {name: self.arrays[name].sum(axis = 0, keepdims = True) for name in wide_engine.METRICS}
+        self.global_derived = read_only(wide_engine.derive_series(global_arrays, previous = prior_global))
+        self.country_series = types.MappingProxyType({
+            country: types.MappingProxyType(series)
+            for country, series in wide_engine.country_series(self.arrays, self.derived).items()
+        })
+        # List of all countries (sorted, like the grouped covid_global), and their row in the
+        # arrays: a dict for one country, the Index for many at once (get_indexer)
+        self.country_list = self.arrays["countries"]
+        self.country_index = pd.Index(self.country_list)
+        self.country_rows = types.MappingProxyType({country: row for row, country in enumerate(self.country_list)})
+        # Area of every country (NaN when area.csv does not list it); the locations of the
+        # latest day are arrays["lat"] and arrays["long"]
+        self.areas = areas_by_country.reindex(self.country_list).to_numpy(dtype = np.float64)
+        self.areas.flags.writeable = False
+        # Map marker sizes and colors of every day, for the map date slider
+        self.map_markers = read_only(wide_engine.map_markers(self.arrays))
+        # Dense per-date index: covid_global has one row per country for every day,
+        # so the rows of a day start at day * number of countries
+        self.date_index = pd.Series(np.arange(len(self.arrays["dates"])) * len(self.country_list), index = self.arrays["dates"])
+        # Dates as ISO strings for the figures, formatted once per data version, and whether
+        # they are consecutive days (a start date and a step are enough to plot them)
+        dates = self.arrays["dates"]
+        self.iso_dates = tuple(dates.strftime("%Y-%m-%d"))
+        self.consecutive_days = len(dates) < 2 or (dates[-1] - dates[0]).days == len(dates) - 1
+
+    # Country totals of any day (the latest by default) as a slice of covid_global, without a scan.
+    # Raises KeyError for a date outside the dataset.
+    def country_totals(self, date = None):
+        if date is None:
+            return self.country_totals_df
+        start = self.date_index[pd.Timestamp(date)]
+
+        return self.covid_global.iloc[start:start + len(self.country_list)].reset_index(drop = True)
+
+    def __setattr__(self, name, value):
+        if hasattr(self, name):
+            raise AttributeError(f"Dataset is read-only, cannot set {name}")
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        raise AttributeError(f"Dataset is read-only, cannot delete {name}")
+
+    # Bytes held by the arrays, indexes and frames of each attribute (an array under two
+    # names, like rolling_average, counts once; country_series only holds views)
+    def nbytes(self):
+        sizes = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if isinstance(value, types.MappingProxyType):
+                values = {id(item): item for item in value.values() if isinstance(item, (np.ndarray, pd.Index))}
+                sizes[name] = sum(item.nbytes for item in values.values())
+            elif isinstance(value, (np.ndarray, pd.Index)):
+                sizes[name] = value.nbytes
+            elif isinstance(value, pd.DataFrame):
+                sizes[name] = int(value.memory_usage(index = True, deep = True).sum())
+        return sizes
+
+
+################################ Current Dataset ######################
+_current = None
+_prepare_hooks = []
+_swap_hooks = []
+_refresher = None
+_loader = None
+_load_error = None
+
+
+def current():
+    return _current
+
+
+# Called with a new Dataset before it is swapped in (to warm derived objects)
+def on_prepare(hook):
+    _prepare_hooks.append(hook)
+    return hook
+
+
+# Called with the new Dataset right after it is swapped in
+def on_swap(hook):
+    _swap_hooks.append(hook)
+    return hook
+
+
+def publish(dataset):
+    global _current
+    for hook in _prepare_hooks:
+        with metrics.stage(f"prepare/{hook.__name__}"):
+            hook(dataset)
+    # Rebinding one name is atomic: readers see either the old or the new Dataset
+    _current = dataset
+    for hook in _swap_hooks:
+        hook(dataset)
+
+    return dataset
+
+
+# Load the snapshot (or build it) and make it the current dataset
+def load(source = None, snapshot_dir = None):
+    frames, stamp = load_frames(source, snapshot_dir)
+    with metrics.stage("load/dataset"):
+        dataset = Dataset(frames, stamp)
+
+    return publish(dataset)
+
+
+# Only one process rebuilds the snapshot at a time. When the lock file cannot be created
+# (a read-only disk) every process goes ahead without it, like write_snapshot does.
+@contextlib.contextmanager
+def rebuild_lock(snapshot_dir):
+    f = None
+    try:
+        os.makedirs(snapshot_dir, exist_ok = True)
+        f = open(os.path.join(snapshot_dir, ".lock"), "w")
+    except OSError as e:
+        logger.warning("Could not create the rebuild lock, going on without it: %s", e)
+    if f is None:
+        yield True
+        return
+    with f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def snapshot_age(snapshot_dir = None):
+    try:
+        return time.time() - os.path.getmtime(os.path.join(snapshot_dir or SNAPSHOT_DIR, "CURRENT"))
+    except OSError:
+        return float("inf")
+
+
+# One refresh step: rebuild the snapshot when it is older than max_age, and swap in
+# any snapshot version that differs from the current dataset (including one written
+# by another worker). Runs off the request path.
+def refresh(source = None, snapshot_dir = None, max_age = None):
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    max_age = REFRESH_INTERVAL if max_age is None else max_age
+    age = snapshot_age(snapshot_dir)
+    if _current is not None and _current.stamp.get("built_at") is None:
+        # No snapshot could be written: the current dataset was checked when it was built
+        age = time.time() - _current.loaded_at
+    if age >= max_age:
+        with rebuild_lock(snapshot_dir) as acquired:
+            if acquired:
+                source, _ = local_source(source)
+                # Compare the files themselves with the ones the snapshot was built from: the
+                # mirror may be current (all 304) while an earlier ingest of it failed
+                digests = source_digests(source)
+                stamp = read_stamp(snapshot_dir)
+                if stamp is None or stamp.get("sources") != digests:
+                    frames, stamp = (ingest if INCREMENTAL else rebuild)(source, snapshot_dir)
+                else:
+                    frames = None
+                if frames is None:
+                    # Nothing new in the files: mark the snapshot as checked against them
+                    write_stamp({**stamp, "sources": digests}, snapshot_dir)
+                # A dataset that could not be saved is published again, which restarts its age
+                elif _current is None or stamp["version"] != _current.version or stamp.get("built_at") is None:
+                    publish(Dataset(frames, stamp, _current))
+    stamp = read_stamp(snapshot_dir)
+    if stamp is not None and (_current is None or stamp["version"] != _current.version):
+        publish(Dataset(load_snapshot(stamp, snapshot_dir, SHARED_DATA), stamp, _current))
+
+    return _current
+
+
+def refresh_loop(interval):
+    # Poll more often than the rebuild interval so every worker picks up a new snapshot soon
+    while True:
+        time.sleep(min(interval, 60))
+        try:
+            refresh(max_age = interval)
+        except Exception:
+            logger.exception("Dataset refresh failed")
+
+
+# Start the background refresher thread once per process
+def start_refresher(interval = None):
+    global _refresher
+    interval = REFRESH_INTERVAL if interval is None else interval
+    if interval <= 0 or (_refresher is not None and _refresher[0] == os.getpid()):
+        return
+    thread = threading.Thread(target = refresh_loop, args = (interval,), name = "dataset-refresher", daemon = True)
+    thread.start()
+    _refresher = (os.getpid(), thread)
+
+
+# Load the dataset, retrying until it succeeds, then keep it fresh. When there is no
+# snapshot yet only the process holding the rebuild lock builds it; the others wait
+# for its snapshot instead of running the same ETL side by side.
+def load_loop(source, snapshot_dir, interval, poll):
+    global _load_error
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    while _current is None:
+        try:
+            with rebuild_lock(snapshot_dir) as acquired:
+                if acquired or read_stamp(snapshot_dir) is not None:
+                    load(source, snapshot_dir)
+        except Exception as e:
+            logger.exception("Dataset load failed")
+            _load_error = f"{type(e).__name__}: {e}"
+        if _current is None:
+            time.sleep(poll)
+    _load_error = None
+    logger.info("Dataset %s loaded", _current.version)
+    start_refresher(interval)
+
+
+# Start loading the dataset in a background thread once per process (see ASYNC_LOAD).
+# Until it is loaded current() is None.
+def start_loader(source = None, snapshot_dir = None, interval = None, poll = 0.5):
+    global _loader
+    if _current is not None:
+        start_refresher(interval)
+        return
+    if _loader is not None and _loader[0] == os.getpid():
+        return
+    thread = threading.Thread(target = load_loop, args = (source, snapshot_dir, interval, poll), name = "dataset-loader", daemon = True)
+    thread.start()
+    _loader = (os.getpid(), thread, snapshot_dir)
+
+
+# Loading state and age of the current dataset, for health checks
+def status():
+    dataset = _current
+    if dataset is None:
+        return {"loaded": False, "loading": _loader is not None and _loader[1].is_alive(), "error": _load_error}
+    built_at = dataset.stamp.get("built_at")
+    built = calendar.timegm(time.strptime(built_at, "%Y-%m-%dT%H:%M:%SZ")) if built_at else dataset.loaded_at
+    now = time.time()
+    return {
+        "loaded": True,
+        "version": dataset.version,
+        "last_date": dataset.iso_dates[-1],
+        "built_at": built_at,
+        # Seconds since the snapshot was built, since it was last checked upstream and since this process loaded it
+        "age": round(now - built, 1),
+        "checked": round(snapshot_age(_loader[2] if _loader is not None else None), 1) if built_at else None,
+        "loaded_for": round(now - dataset.loaded_at, 1),
+    }
+
+
+if __name__ == '__main__':
+    # Rebuild the snapshot, e.g. from a scheduled job: python data.py [source]
+    logging.basicConfig(level = logging.INFO)
+    start = time.perf_counter()
+    frames, stamp = rebuild(sys.argv[1] if len(sys.argv) > 1 else None)
+    print(f"Snapshot {stamp['version']} built in {time.perf_counter() - start:.1f}s")
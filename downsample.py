@@ -0,0 +1,97 @@
+######################################
+# Downsampling of long daily series for the charts
+#
+# A chart of the whole history would send one bar and one line point
+# per day, with their hover data. Above MAX_POINTS days the bars are
+# aggregated into weekly or monthly buckets and the lines are reduced
+# with Largest-Triangle-Three-Buckets (LTTB), which keeps the peaks and
+# troughs that a fixed stride would drop. Either way a chart sends at
+# most MAX_POINTS bars and MAX_POINTS line points, whatever the range.
+######################################
+
+import os
+
+import numpy as np
+
+# Most bars, and most points per line, in one chart
+MAX_POINTS = int(os.environ.get("COVID_MAX_POINTS", "400"))
+
+# Bucket sizes, finest first: pandas period, bar period for plotly (ms or months) and the
+# first day of a period. Weeks run from Monday to Sunday.
+BUCKETS = [
+    ("day", None, None, None),
+    ("week", "W", 7 * 86400000, "2020-01-06"),
+    ("month", "M", "M1", "2020-01-01"),
+]
+
+
+# The finest bucket size that keeps the days (a DatetimeIndex) to at most max_points buckets.
+# Returns the bucket entry of BUCKETS and the index of the first day of every bucket.
+def buckets(dates, max_points):
+    for bucket in BUCKETS:
+        freq = bucket[1]
+        if freq is None:
+            starts = np.arange(len(dates))
+        else:
+            codes = dates.to_period(freq).asi8
+            starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        if len(starts) <= max_points:
+            break
+
+    return bucket, starts
+
+
+# Mean of the values over each bucket (starts from buckets())
+def bucket_means(values, starts):
+    counts = np.diff(np.r_[starts, len(values)])
+
+    return np.add.reduceat(values, starts) / counts
+
+
+# Indices of at most n_out points of values (evenly spaced in x) chosen by LTTB: the first and
+# the last point, and in each of n_out - 2 buckets in between the point that makes the largest
+# triangle with the point chosen before it and the mean of the next bucket. NaN values (gaps in
+# the line) are only chosen for buckets without any value, so the gaps are kept.
+def lttb(values, n_out):
+    n = len(values)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    known = ~np.isnan(values)
+    # Means of every bucket, for the third point of the triangles (the last point ends the line)
+    counts = np.add.reduceat(known[:-1], edges[:-1])
+    sums = np.add.reduceat(np.where(known, values, 0.0)[:-1], edges[:-1])
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        means_y = np.append(np.where(counts > 0, sums / counts, np.nan), values[-1])
+    means_x = np.append((edges[:-1] + edges[1:] - 1) / 2, n - 1)
+    # A plain loop over Python floats: the buckets hold a few points each, too few for numpy
+    ys = values.tolist()
+    next_x = means_x[1:].tolist()
+    next_y = means_y[1:].tolist()
+    bounds = edges.tolist()
+    chosen = [0]
+    a = 0
+    for i in range(n_out - 2):
+        ax, ay = a, ys[a]
+        best = -1.0
+        pick = None
+        first_known = None
+        for x in range(bounds[i], bounds[i + 1]):
+            y = ys[x]
+            if y != y:
+                continue
+            if first_known is None:
+                first_known = x
+            area = abs((ax - next_x[i]) * (y - ay) - (ax - x) * (next_y[i] - ay))
+            if area > best:
+                best = area
+                pick = x
+        # Without any area (a gap before or after the bucket) the first value of the bucket,
+        # and the first day of a bucket without values
+        if pick is None:
+            pick = bounds[i] if first_known is None else first_known
+        chosen.append(pick)
+        a = pick
+    chosen.append(n - 1)
+
+    return np.array(chosen)
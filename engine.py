@@ -0,0 +1,273 @@
+######################################
+# Wide-array ETL engine
+#
+# The three CSSE files share one location-by-date grid, so instead of
+# melting and merging them we align them once by location and keep the
+# values as (locations, days) arrays. Countries are grouped sums over
+# those arrays; the long covid_global frame is only built at the end.
+######################################
+
+import numpy as np
+import pandas as pd
+
+import cleaning
+
+# Columns that identify a location in the CSSE files
+LOCATION_KEYS = ["Province/State", "Country/Region"]
+LOCATION_COLUMNS = ["Province/State", "Country/Region", "Lat", "Long"]
+METRICS = ["confirmed", "deaths", "recovered", "active"]
+
+
+def location_index(frame):
+    # "Province/State" is empty for whole countries (the keys may be parsed as categoricals)
+    return pd.MultiIndex.from_frame(frame[LOCATION_KEYS].astype(object).fillna(""))
+
+
+# Dates of a CSSE date header ("1/22/20", ...), parsed once per file
+def parse_dates(date_columns):
+    return pd.DatetimeIndex(pd.to_datetime(date_columns, format = "%m/%d/%y"), name = "date")
+
+
+# Align the three files on the confirmed locations and dates.
+# Returns the locations frame, the dates and one int32 (locations, days) array per file.
+def align_sources(confirmed_df, deaths_df, recovered_df):
+    date_columns = confirmed_df.columns[4:]
+    keys = location_index(confirmed_df)
+    values = {}
+    for name, frame in (("confirmed", confirmed_df), ("deaths", deaths_df), ("recovered", recovered_df)):
+        frame = frame.set_index(location_index(frame))[date_columns.intersection(frame.columns[4:])]
+        # Locations or dates missing from deaths/recovered count as 0, as in the left merge
+        frame = frame.reindex(index = keys, columns = date_columns)
+        values[name] = frame.fillna(0).to_numpy(dtype = np.int32)
+    locations = confirmed_df[LOCATION_COLUMNS].astype({key: object for key in LOCATION_KEYS}).reset_index(drop = True)
+    # The date header is parsed once, not once per melted row
+    dates = parse_dates(date_columns)
+
+    return locations, dates, values
+
+
+# Group the location rows into countries.
+# Returns a dict of sorted country names, mean Lat/Long and (countries, days) int64 sums.
+def group_countries(locations, dates, values):
+    # The cleaning tables only have to touch one row per location
+    locations = cleaning.clean_locations(locations.copy())
+    countries, codes = np.unique(locations["Country/Region"].to_numpy(dtype = object), return_inverse = True)
+    order = np.argsort(codes, kind = "stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0])
+    arrays = {
+        "dates": dates,
+        "countries": countries,
+    }
+    for column, key in (("Lat", "lat"), ("Long", "long")):
+        coordinate = locations[column].to_numpy(dtype = np.float64)[order]
+        known = ~np.isnan(coordinate)
+        total = np.add.reduceat(np.where(known, coordinate, 0.0), starts)
+        count = np.add.reduceat(known.astype(np.int64), starts)
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            arrays[key] = np.where(count > 0, total / count, np.nan)
+    for name in ["confirmed", "deaths", "recovered"]:
+        arrays[name] = np.add.reduceat(values[name][order].astype(np.int64), starts, axis = 0)
+    # Active cases
+    arrays["active"] = arrays["confirmed"] - arrays["deaths"] - arrays["recovered"]
+
+    return arrays
+
+
+# Materialize the long (date, country) frame from the country arrays
+def long_frame(arrays):
+    dates = arrays["dates"]
+    countries = arrays["countries"]
+    n_countries = len(countries)
+    columns = {
+        "date": np.repeat(dates.to_numpy(), n_countries),
+        # Country codes into the sorted country list (int16 codes for up to 32767 countries)
+        "Country/Region": pd.Categorical.from_codes(np.tile(np.arange(n_countries), len(dates)), categories = countries),
+        "Lat": np.tile(arrays["lat"], len(dates)),
+        "Long": np.tile(arrays["long"], len(dates)),
+    }
+    for name in METRICS:
+        # (countries, days) -> date-major rows, like groupby(["date", "Country/Region"])
+        columns[name] = arrays[name].T.ravel()
+
+    return pd.DataFrame(columns)
+
+
+# Build the final frames from the aligned location arrays
+def frames_from_aligned(locations, dates, values):
+    arrays = group_countries(locations, dates, values)
+    covid_global = long_frame(arrays)
+    # Global Cumulative for each day
+    daily_cum_global = daily_totals(arrays)
+    # Countries Lattest Totals
+    country_totals_df = covid_global.iloc[-len(arrays["countries"]):].reset_index(drop = True)
+
+    return {
+        "covid_global": covid_global,
+        "daily_cum_global": daily_cum_global,
+        "country_totals_df": country_totals_df,
+    }
+
+
+# Global cumulative values for each day
+def daily_totals(arrays):
+    daily_cum_global = pd.DataFrame({"date": arrays["dates"].to_numpy()})
+    for name in METRICS:
+        daily_cum_global[name] = arrays[name].sum(axis = 0)
+
+    return daily_cum_global
+
+
+# Build the same frames as the long pipeline of data.build_frames, with the wide arrays
+def build_frames(confirmed_df, deaths_df, recovered_df):
+    return frames_from_aligned(*align_sources(confirmed_df, deaths_df, recovered_df))
+
+
+# Append new trailing days (aligned on the same locations) to the frames of a previous build.
+# Only the new days are grouped and turned into rows.
+def append_days(frames, locations, dates, values):
+    arrays = group_countries(locations, dates, values)
+    covid_global = pd.concat([frames["covid_global"], long_frame(arrays)], ignore_index = True)
+    daily_cum_global = pd.concat([frames["daily_cum_global"], daily_totals(arrays)], ignore_index = True)
+    country_totals_df = covid_global.iloc[-len(arrays["countries"]):].reset_index(drop = True)
+
+    return {
+        "covid_global": covid_global,
+        "daily_cum_global": daily_cum_global,
+        "country_totals_df": country_totals_df,
+    }
+
+
+# Rebuild the country arrays from a long covid_global frame (e.g. one loaded from the snapshot).
+# covid_global is a full (date, country) grid sorted by date, then country.
+def arrays_from_long(covid_global):
+    dates = pd.DatetimeIndex(covid_global["date"].unique(), name = "date")
+    n_days = len(dates)
+    n_countries = len(covid_global) // n_days
+    arrays = {
+        "dates": dates,
+        "countries": covid_global["Country/Region"].iloc[:n_countries].to_numpy(dtype = object),
+        "lat": covid_global["Lat"].to_numpy(dtype = np.float64)[-n_countries:],
+        "long": covid_global["Long"].to_numpy(dtype = np.float64)[-n_countries:],
+    }
+    for name in METRICS:
+        # (days, countries) -> (countries, days) with contiguous rows
+        arrays[name] = np.ascontiguousarray(covid_global[name].to_numpy().reshape(n_days, n_countries).T)
+
+    return arrays
+
+
+# Rolling mean windows (days) of the analytics series, and the days back that the
+# week-over-week growth and the doubling time compare with
+WINDOWS = [7, 14, 28]
+LAG = 7
+# Days of daily values behind the analytics of a day, itself included
+LOOKBACK = max(WINDOWS + [LAG + WINDOWS[0]])
+
+
+# Mean of the last `window` days from a running sum; the first window - 1 days are NaN
+def rolling_mean(running, window):
+    mean = np.full(running.shape, np.nan)
+    mean[:, window - 1:] = running[:, window - 1:]
+    mean[:, window:] -= running[:, :-window]
+    mean /= window
+
+    return mean
+
+
+# Change (%) of each day against LAG days before, NaN where the earlier value is not positive
+def growth(values):
+    change = np.full(values.shape, np.nan)
+    before = values[:, :-LAG]
+    np.divide(values[:, LAG:], before, out = change[:, LAG:], where = before > 0)
+    change -= 1
+    change *= 100
+
+    return change
+
+
+# Days the cumulative values take to double at the growth rate of the last LAG days,
+# NaN where they did not grow
+def doubling_time(cumulative):
+    days = np.full(cumulative.shape, np.nan)
+    now = cumulative[:, LAG:]
+    before = cumulative[:, :-LAG]
+    grew = (before > 0) & (now > before)
+    ratio = np.divide(now, before, out = np.ones(now.shape), where = grew)
+    np.divide(LAG * np.log(2), np.log(ratio), out = days[:, LAG:], where = grew)
+
+    return days
+
+
+# Deaths per confirmed case (%), NaN before the first case
+def case_fatality(confirmed, deaths):
+    ratio = np.full(confirmed.shape, np.nan)
+    np.divide(deaths, confirmed, out = ratio, where = confirmed > 0)
+    ratio *= 100
+
+    return ratio
+
+
+# Daily deltas of every metric and their analytics, as (countries, days) float arrays
+# computed for all countries at once: rolling means of the daily values over WINDOWS
+# (one running sum per metric), week-over-week growth (%) of the 7-day mean of the
+# daily confirmed cases and deaths, doubling time (days) of the confirmed cases and
+# case fatality ratio (%). rolling_average is rolling7_confirmed, as plotted by default.
+# With `previous` (the derived arrays of a dataset whose days are a prefix of these,
+# for the same countries) only the new days are computed.
+def derive_series(arrays, previous = None):
+    n_days = arrays["confirmed"].shape[1]
+    n_old = 0
+    if previous is not None and previous["daily_confirmed"].shape[0] == arrays["confirmed"].shape[0]:
+        n_old = min(previous["daily_confirmed"].shape[1], n_days)
+    # Recompute from the longest lookback before the first new day; the days every
+    # series leaves NaN at the start of that range are old days, taken from `previous`
+    start = max(n_old - LOOKBACK, 0)
+    derived = {}
+    for name in METRICS:
+        values = arrays[name][:, start:]
+        # The first day has no previous day and counts as 0
+        before = arrays[name][:, start - 1:start] if start > 0 else values[:, :1]
+        derived[f"daily_{name}"] = np.diff(values, axis = 1, prepend = before)
+        running = np.cumsum(derived[f"daily_{name}"], axis = 1)
+        for window in WINDOWS:
+            derived[f"rolling{window}_{name}"] = rolling_mean(running, window)
+    for name in ["confirmed", "deaths"]:
+        derived[f"growth_{name}"] = growth(derived[f"rolling{WINDOWS[0]}_{name}"])
+    derived["doubling_time"] = doubling_time(arrays["confirmed"][:, start:])
+    derived["cfr"] = case_fatality(arrays["confirmed"][:, start:], arrays["deaths"][:, start:])
+    if n_old:
+        # Keep what was already computed for the old days
+        for name, values in derived.items():
+            derived[name] = np.concatenate([previous[name][:, :n_old], values[:, n_old - start:]], axis = 1)
+    derived["rolling_average"] = derived["rolling7_confirmed"]
+
+    return derived
+
+
+# Map markers of every day, as (countries, days) float32 arrays: the marker size and the
+# color, scaled to [0, 1] within each day like the map of the latest day.
+def map_markers(arrays):
+    confirmed = arrays["confirmed"]
+    low = confirmed.min(axis = 0)
+    span = confirmed.max(axis = 0) - low
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        color = np.where(span > 0, (confirmed - low) / span, 0.0)
+
+    return {
+        "size": (confirmed / 80000).astype(np.float32),
+        "color": color.astype(np.float32),
+    }
+
+
+# Per-country series used by the country callback, computed once for all countries.
+# Maps each country to contiguous arrays of cumulative values, daily deltas and their
+# analytics (derive_series).
+def country_series(arrays, derived):
+    index = {}
+    for row, country in enumerate(arrays["countries"]):
+        series = {"date": arrays["dates"]}
+        series.update({name: arrays[name][row] for name in METRICS})
+        series.update({name: values[row] for name, values in derived.items()})
+        index[country] = series
+
+    return index
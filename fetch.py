@@ -0,0 +1,136 @@
+######################################
+# Fetch layer for the CSSE time series
+#
+# Keeps a local mirror of the source CSVs. Each download is a conditional
+# request (If-None-Match / If-Modified-Since) against the validators of
+# the mirrored copy, so an unchanged file costs one 304 and no parsing.
+# The files are fetched concurrently and transient errors are retried
+# with exponential backoff. In offline mode, or when the network is down,
+# the mirror is used as is.
+#
+# requests and tenacity are imported on the first fetch: a worker that
+# starts from a snapshot never needs them.
+######################################
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Local copy of the source CSVs
+MIRROR_DIR = os.environ.get("COVID_MIRROR_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "mirror"))
+# Never touch the network, read the mirror only
+OFFLINE = os.environ.get("COVID_OFFLINE", "0") == "1"
+# Attempts per file before falling back to the mirror
+FETCH_ATTEMPTS = int(os.environ.get("COVID_FETCH_ATTEMPTS", "4"))
+# Seconds to wait for the server to connect / send data
+FETCH_TIMEOUT = float(os.environ.get("COVID_FETCH_TIMEOUT", "30"))
+
+
+# Connection problems, timeouts, rate limits and server errors are worth retrying
+def is_transient(error):
+    import requests
+
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return False
+
+
+def read_meta(path):
+    try:
+        with open(f"{path}.meta.json") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_meta(path, meta):
+    tmp = f"{path}.meta.json.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, f"{path}.meta.json")
+
+
+# One conditional GET of `url` into `path`. Returns True when the mirrored file changed.
+def download(session, url, path, meta):
+    headers = {}
+    # Validators are only valid for the URL they came from
+    if meta.get("url") == url and os.path.exists(path):
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    with session.get(url, headers = headers, timeout = FETCH_TIMEOUT, stream = True) as response:
+        if response.status_code == 304:
+            return False
+        response.raise_for_status()
+        # Write then rename, so readers never see a partial file
+        tmp = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        digest = hashlib.sha1()
+        with open(tmp, "wb") as f:
+            for chunk in response.iter_content(chunk_size = 1 << 16):
+                digest.update(chunk)
+                f.write(chunk)
+        os.replace(tmp, path)
+        changed = digest.hexdigest() != meta.get("sha1") or meta.get("url") != url
+        write_meta(path, {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "sha1": digest.hexdigest(),
+            "fetched_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        })
+
+    # A server without validators may resend the same bytes
+    return changed
+
+
+# Bring the mirrored copy of one URL up to date. Returns True when it changed.
+def fetch(session, url, path, attempts = None):
+    import requests
+    from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_exponential
+
+    meta = read_meta(path)
+    retrying = Retrying(
+        stop = stop_after_attempt(attempts or FETCH_ATTEMPTS),
+        wait = wait_exponential(multiplier = 0.5, max = 30),
+        retry = retry_if_exception(is_transient),
+        reraise = True,
+    )
+    try:
+        with metrics.stage(f"fetch/{os.path.basename(path)}"):
+            return retrying(download, session, url, path, meta)
+    except requests.RequestException as e:
+        if not os.path.exists(path):
+            raise
+        logger.warning("Could not fetch %s, using the mirrored copy: %s", url, e)
+        return False
+
+
+# Mirror `urls` into `mirror_dir` (concurrently) and return (paths, changed), where
+# changed is True when any file differs from the previous mirror.
+def fetch_all(urls, mirror_dir = None, offline = None, attempts = None):
+    mirror_dir = mirror_dir or MIRROR_DIR
+    offline = OFFLINE if offline is None else offline
+    paths = [os.path.join(mirror_dir, url.rsplit("/", 1)[-1]) for url in urls]
+    if offline:
+        missing = [path for path in paths if not os.path.exists(path)]
+        if missing:
+            raise FileNotFoundError(f"Offline and not mirrored: {', '.join(missing)}")
+        return paths, False
+    import requests
+
+    os.makedirs(mirror_dir, exist_ok = True)
+    with requests.Session() as session, ThreadPoolExecutor(max_workers = len(urls)) as pool:
+        changed = list(pool.map(lambda args: fetch(session, *args, attempts = attempts), zip(urls, paths)))
+
+    return paths, any(changed)
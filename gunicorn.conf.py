@@ -0,0 +1,25 @@
+######################################
+# Gunicorn settings
+#
+# gunicorn picks this file up automatically from the working directory.
+######################################
+
+import data
+
+
+# Runs once in the master before any worker is forked. With ASYNC_LOAD the workers
+# build the snapshot in the background instead, so the master binds at once.
+def on_starting(server):
+    if data.SHARED_DATA and not data.ASYNC_LOAD:
+        stamp = data.ensure_snapshot()
+        server.log.info("Shared dataset %s ready", stamp["version"])
+
+
+# With --preload the app (and its refresher or loader thread) lives in the master,
+# so every worker needs its own after the fork
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        if data.ASYNC_LOAD:
+            data.start_loader()
+        else:
+            data.start_refresher()
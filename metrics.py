@@ -0,0 +1,212 @@
+######################################
+# Request instrumentation (opt-in, COVID_METRICS=1)
+#
+# Times every request and the named stages inside it (data slicing,
+# figure building, serialization, ...), records the payload size and the
+# selected country, and exposes the totals as Prometheus text on /metrics
+# and per request as a Server-Timing header. Slow requests can be
+# profiled with cProfile on a sample of requests. When disabled, stage()
+# is a shared no-op context manager and no request hooks are installed.
+#
+# The numbers are per process: with several gunicorn workers every
+# scrape of /metrics reads the worker that happens to serve it.
+######################################
+
+import contextlib
+import cProfile
+import json
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+
+import flask
+
+ENABLED = os.environ.get("COVID_METRICS", "0") == "1"
+# Directory for the cProfile dumps of slow requests (unset: no profiling)
+PROFILE_DIR = os.environ.get("COVID_PROFILE_DIR")
+# Requests slower than this (ms) keep their profile
+PROFILE_THRESHOLD = float(os.environ.get("COVID_PROFILE_THRESHOLD", "500"))
+# Fraction of requests that run under the profiler
+PROFILE_SAMPLE = float(os.environ.get("COVID_PROFILE_SAMPLE", "0.05"))
+
+# Upper bounds (seconds) of the request duration histogram
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+_disabled = contextlib.nullcontext()
+_lock = threading.Lock()
+_requests = defaultdict(lambda: [0] * (len(BUCKETS) + 1))
+_request_seconds = defaultdict(float)
+_response_bytes = defaultdict(int)
+_stage_seconds = defaultdict(float)
+_stage_count = defaultdict(int)
+_countries = defaultdict(int)
+_profiles = 0
+
+
+@contextlib.contextmanager
+def _stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            _stage_seconds[name] += elapsed
+            _stage_count[name] += 1
+        if flask.has_request_context():
+            stages = flask.g.setdefault("stages", {})
+            stages[name] = stages.get(name, 0.0) + elapsed
+
+
+# Time a named stage of the current request:  with metrics.stage("figures"): ...
+def stage(name):
+    if not ENABLED:
+        return _disabled
+    return _stage(name)
+
+
+# Total seconds per stage so far, in the order the stages first ran
+def stage_seconds():
+    with _lock:
+        return dict(_stage_seconds)
+
+
+# Label of a request and the country it selected (None unless the country dropdown
+# triggered it). A Dash callback is labelled by the inputs that triggered it
+# (changedPropIds), or by its outputs on the initial call, which has none; other
+# requests by their URL rule.
+def request_label():
+    if flask.request.path.endswith("/_dash-update-component"):
+        body = flask.request.get_json(silent = True) or {}
+        changed = body.get("changedPropIds") or []
+        if not changed:
+            return str(body.get("output", "callback")), None
+        label = ",".join(sorted({str(prop_id).rsplit(".", 1)[0] for prop_id in changed}))
+        country = None
+        if "country-dropdown.value" in changed:
+            country = next((item.get("value") for item in body.get("inputs") or [] if item.get("id") == "country-dropdown"), None)
+        return label, country
+    rule = flask.request.url_rule
+
+    return (rule.rule if rule is not None else "unmatched"), None
+
+
+def before_request():
+    flask.g.started = time.perf_counter()
+    if PROFILE_DIR and random.random() < PROFILE_SAMPLE:
+        flask.g.profiler = cProfile.Profile()
+        flask.g.profiler.enable()
+
+
+def after_request(response):
+    started = flask.g.pop("started", None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    profiler = flask.g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+    label, country = request_label()
+    size = response.calculate_content_length() or 0
+    with _lock:
+        counts = _requests[label]
+        counts[next((i for i, bound in enumerate(BUCKETS) if elapsed <= bound), len(BUCKETS))] += 1
+        _request_seconds[label] += elapsed
+        _response_bytes[label] += size
+        if country is not None:
+            _countries[str(country)] += 1
+    stages = flask.g.get("stages", {})
+    response.headers["Server-Timing"] = ", ".join(
+        [f"{name};dur={seconds * 1000:.2f}" for name, seconds in stages.items()] + [f"total;dur={elapsed * 1000:.2f}"]
+    )
+    if profiler is not None and elapsed * 1000 >= PROFILE_THRESHOLD:
+        write_profile(profiler, label, country, elapsed)
+
+    return response
+
+
+def write_profile(profiler, label, country, elapsed):
+    global _profiles
+    with _lock:
+        _profiles += 1
+        number = _profiles
+    os.makedirs(PROFILE_DIR, exist_ok = True)
+    name = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{number}-{label}-{elapsed * 1000:.0f}ms".replace("/", "_")
+    profiler.dump_stats(os.path.join(PROFILE_DIR, f"{name}.prof"))
+    # What the request was about, next to the profile
+    with open(os.path.join(PROFILE_DIR, f"{name}.json"), "w") as f:
+        json.dump({"label": label, "country": country, "ms": elapsed * 1000, "stages": flask.g.get("stages", {})}, f)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Prometheus text exposition format
+def render():
+    lines = []
+    with _lock:
+        lines += [
+            "# HELP covid_request_duration_seconds Request duration by triggering callback input or URL rule.",
+            "# TYPE covid_request_duration_seconds histogram",
+        ]
+        for label, counts in sorted(_requests.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ["+Inf"], counts):
+                cumulative += count
+                lines.append(f'covid_request_duration_seconds_bucket{{handler="{escape(label)}",le="{bound}"}} {cumulative}')
+            lines.append(f'covid_request_duration_seconds_sum{{handler="{escape(label)}"}} {_request_seconds[label]:.6f}')
+            lines.append(f'covid_request_duration_seconds_count{{handler="{escape(label)}"}} {cumulative}')
+        lines += [
+            "# HELP covid_response_bytes_total Response body bytes by triggering callback input or URL rule.",
+            "# TYPE covid_response_bytes_total counter",
+        ]
+        lines += [f'covid_response_bytes_total{{handler="{escape(label)}"}} {size}' for label, size in sorted(_response_bytes.items())]
+        lines += [
+            "# HELP covid_stage_duration_seconds Time spent in each instrumented stage.",
+            "# TYPE covid_stage_duration_seconds summary",
+        ]
+        for name in sorted(_stage_seconds):
+            lines.append(f'covid_stage_duration_seconds_sum{{stage="{escape(name)}"}} {_stage_seconds[name]:.6f}')
+            lines.append(f'covid_stage_duration_seconds_count{{stage="{escape(name)}"}} {_stage_count[name]}')
+        lines += [
+            "# HELP covid_country_requests_total Country dropdown requests by country.",
+            "# TYPE covid_country_requests_total counter",
+        ]
+        lines += [f'covid_country_requests_total{{country="{escape(country)}"}} {count}' for country, count in sorted(_countries.items())]
+        lines += [
+            "# HELP covid_profiles_written_total cProfile dumps written for slow requests.",
+            "# TYPE covid_profiles_written_total counter",
+            f"covid_profiles_written_total {_profiles}",
+        ]
+
+    return "\n".join(lines) + "\n"
+
+
+# Dash serializes the response of a callback inside its dispatch, after the callback
+# returned (dash._callback.to_json): time that as the "serialize" stage
+def time_serialization():
+    from dash import _callback
+
+    to_json = _callback.to_json
+    if getattr(to_json, "timed", False):
+        return
+
+    def timed_to_json(value):
+        with _stage("serialize"):
+            return to_json(value)
+
+    timed_to_json.timed = True
+    _callback.to_json = timed_to_json
+
+
+# Install the request hooks and the /metrics endpoint (only when enabled)
+def init_app(server):
+    if not ENABLED:
+        return
+    time_serialization()
+    server.before_request(before_request)
+    server.after_request(after_request)
+    server.add_url_rule("/metrics", "metrics", lambda: flask.Response(render(), mimetype = "text/plain; version=0.0.4"))